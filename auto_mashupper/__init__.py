@@ -25,6 +25,15 @@ def _get_segmentation_functions():
     except ImportError as e:
         raise ImportError(f"Segmentation functions not available: {e}")
 
+def _get_feature_functions():
+    """Lazy import of feature functions"""
+    try:
+        from .features import extract_features
+        from .mashability import score_features
+        return extract_features, score_features
+    except ImportError as e:
+        raise ImportError(f"Feature functions not available: {e}")
+
 def _get_utility_functions():
     """Lazy import of utility functions"""
     try:
@@ -39,6 +48,22 @@ def _get_utility_functions():
     except ImportError as e:
         raise ImportError(f"Utility functions not available: {e}")
 
+def _get_rendering_functions():
+    """Lazy import of rendering functions"""
+    try:
+        from .utilities import render_mixes, iter_mixes
+        return render_mixes, iter_mixes
+    except ImportError as e:
+        raise ImportError(f"Rendering functions not available: {e}")
+
+def _get_compositor_functions():
+    """Lazy import of compositor functions"""
+    try:
+        from .compositor import compose_mashup, compose_from_csv
+        return compose_mashup, compose_from_csv
+    except ImportError as e:
+        raise ImportError(f"Compositor functions not available: {e}")
+
 # Expose functions with lazy loading
 def get_mashability(*args, **kwargs):
     """Calculate mashability between two audio vectors"""
@@ -70,11 +95,41 @@ def get_beat_sync_spectrums(*args, **kwargs):
     _, _, func = _get_segmentation_functions()
     return func(*args, **kwargs)
 
+def extract_features(*args, **kwargs):
+    """Analyse a track once into TrackFeatures"""
+    func, _ = _get_feature_functions()
+    return func(*args, **kwargs)
+
+def score_features(*args, **kwargs):
+    """Calculate mashability from precomputed TrackFeatures"""
+    _, func = _get_feature_functions()
+    return func(*args, **kwargs)
+
 def mix_songs(*args, **kwargs):
     """Mix two songs with tempo and pitch adjustment"""
     func, _, _, _, _ = _get_utility_functions()
     return func(*args, **kwargs)
 
+def render_mixes(*args, **kwargs):
+    """Render several candidates over the same base loop"""
+    func, _ = _get_rendering_functions()
+    return func(*args, **kwargs)
+
+def iter_mixes(*args, **kwargs):
+    """Iterate over mixes of several candidates over the same base loop"""
+    _, func = _get_rendering_functions()
+    return func(*args, **kwargs)
+
+def compose_mashup(*args, **kwargs):
+    """Stack several candidate layers over a base loop"""
+    func, _ = _get_compositor_functions()
+    return func(*args, **kwargs)
+
+def compose_from_csv(*args, **kwargs):
+    """Stack the most mashable candidates of a csv over a base loop"""
+    _, func = _get_compositor_functions()
+    return func(*args, **kwargs)
+
 def adjust_tempo(*args, **kwargs):
     """Adjust tempo of audio"""
     _, func, _, _, _ = _get_utility_functions()
@@ -104,7 +159,13 @@ __all__ = [
     "get_beat_sync_chroma_and_spectrum",
     "get_beat_sync_chroma",
     "get_beat_sync_spectrums",
+    "extract_features",
+    "score_features",
     "mix_songs",
+    "render_mixes",
+    "iter_mixes",
+    "compose_mashup",
+    "compose_from_csv",
     "adjust_tempo",
     "match_target_amplitude", 
     "self_tempo_estimation",
@@ -0,0 +1,132 @@
+"""
+Append-only checkpoints of mashability scans.
+
+Each candidate scored by mashability.main is appended to a log next to the csv
+of the base song, so a scan that crashed can resume without scoring the same
+candidates again. The first line describes the scan, the others are one
+candidate each, scored with its tuning and beat grid when known, or skipped
+with the reason:
+    {"base_song": "base.mp3", "analysis_sr": null, "tempo_preset": "accurate"}
+    {"song": "loops/a.mp3", "scores": [0.91, -2, 0, 0.87, 0.95],
+     "track": [440.2, 0.12, 0.5, 31]}
+    {"song": "loops/b.mp3", "error": "Candidate is smaller than 3 seconds"}
+
+The log is synced to disk every few records. A record cut short by a crash is
+dropped when the log is resumed, and a later record of a candidate replaces the
+earlier ones. Records are only read back when resuming, a scan does not keep the
+ones it appends in memory.
+"""
+
+import json
+import os
+
+CHECKPOINT_SUFFIX = ".scan.jsonl"
+
+
+def checkpoint_path(base_song):
+    """
+    Path of the scan log of a base song, next to the csv of mashability.main
+    :param base_song: The path to the base song
+    :return: The path of the log
+    """
+    return base_song.split("/")[-1].replace(".mp3", "") + CHECKPOINT_SUFFIX
+
+
+class ScanLog:
+    """
+    Append-only log of the candidates scored by a scan. The scores, tracks and
+    errors dicts hold the records of the previous scan when resuming, and are
+    not changed by appending
+    :param path: The path of the log
+    :param settings: A dict describing the scan, written as the first line
+    :param resume: Keep the records of the previous scan in the log. It must have
+    been made with the same settings
+    :param sync_every: Number of records after which the log is synced to disk
+    """
+
+    def __init__(self, path, settings, resume=False, sync_every=100):
+        self.path = path
+        self.sync_every = sync_every
+        self.scores = {}
+        self.tracks = {}
+        self.errors = {}
+        self._unsynced = 0
+        if resume and os.path.exists(path) and self._read(settings):
+            self._file = open(path, "a")
+        else:
+            self._file = open(path, "w")
+            self._write(settings)
+            self.sync()
+
+    def _read(self, settings):
+        """
+        Load the records of a previous scan
+        :return: False if the log has no complete line
+        """
+        with open(self.path, "rb") as f:
+            lines = f.read().split(b"\n")
+        size = 0
+        # The last item is empty, or the record being written during a crash
+        for line in lines[:-1]:
+            record = json.loads(line)
+            if size == 0:
+                if record != settings:
+                    raise ValueError(
+                        "%s is the log of another scan: %s" % (self.path, record)
+                    )
+            elif "error" in record:
+                self.scores.pop(record["song"], None)
+                self.tracks.pop(record["song"], None)
+                self.errors[record["song"]] = record["error"]
+            else:
+                self.errors.pop(record["song"], None)
+                self.scores[record["song"]] = record["scores"]
+                if "track" in record:
+                    self.tracks[record["song"]] = record["track"]
+                else:
+                    self.tracks.pop(record["song"], None)
+            size += len(line) + 1
+        os.truncate(self.path, size)
+        return size > 0
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self.sync()
+
+    def record(self, song, scores, track=None):
+        """
+        Append a scored candidate
+        :param song: The path to the candidate
+        :param scores: The values of its row of results
+        :param track: The values of its results.TRACK_DTYPE row, if known
+        """
+        record = {"song": song, "scores": list(scores)}
+        if track is not None:
+            record["track"] = list(track)
+        self._write(record)
+
+    def record_error(self, song, reason):
+        """
+        Append a skipped candidate
+        :param song: The path to the candidate
+        :param reason: Why it was skipped
+        """
+        self._write({"song": song, "error": reason})
+
+    def sync(self):
+        """Write the appended records to disk"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
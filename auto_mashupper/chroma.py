@@ -0,0 +1,156 @@
+"""
+Beat synchronous chroma from one spectrogram of the whole track.
+
+The power spectrogram of the track is computed once, mapped to 12 pitch classes
+with a single product by the chroma filterbank, and the normalised frames are
+averaged between beats. Frames are centred in the beat they belong to, so short
+beats do not suffer from the padding of an STFT per beat.
+
+Filterbanks only depend on the sample rate, FFT size and tuning, and are kept
+in memory once built. With a cache directory, given to ChromaEngine or in the
+AUTOMASHUPPER_FILTERBANK_CACHE environment variable, they are also written to
+.npy files that other processes memory map instead of building them again.
+"""
+
+import os
+
+import numpy as np
+
+from . import threads
+
+# FFT size and hop of the chroma STFT
+N_FFT = 2048
+HOP_LENGTH = 512
+
+FILTERBANK_CACHE_ENV = "AUTOMASHUPPER_FILTERBANK_CACHE"
+
+# (sr, n_fft, tuning): read-only filterbank, shared by every thread
+_filterbanks = {}
+
+
+def chroma_filterbank(sr, n_fft=N_FFT, tuning=0.0, cache_dir=None):
+    """
+    The chroma filterbank of a sample rate and FFT size, built once
+    :param sr: The sample rate of the signal
+    :param n_fft: The FFT size
+    :param tuning: The tuning deviation from A440 in fractions of a semitone,
+    rounded to hundredths
+    :param cache_dir: Directory of filterbanks shared between processes,
+    AUTOMASHUPPER_FILTERBANK_CACHE if None, memory only if neither is set
+    :return: Read-only float32 array of shape (12, n_fft // 2 + 1)
+    """
+    tuning = round(float(tuning), 2) + 0.0
+    key = (sr, n_fft, tuning)
+    filterbank = _filterbanks.get(key)
+    if filterbank is not None:
+        return filterbank
+    cache_dir = cache_dir or os.environ.get(FILTERBANK_CACHE_ENV)
+    path = None
+    if cache_dir:
+        path = os.path.join(cache_dir, "chroma-%d-%d-%+.2f.npy" % key)
+    if path is not None and os.path.exists(path):
+        filterbank = np.load(path, mmap_mode="r")
+    else:
+        from librosa import filters
+
+        filterbank = filters.chroma(
+            sr=sr, n_fft=n_fft, tuning=tuning, n_chroma=12, dtype=np.float32
+        )
+        filterbank.flags.writeable = False
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp_path, "wb") as f:
+                np.save(f, filterbank)
+            os.replace(tmp_path, path)
+    _filterbanks[key] = filterbank
+    return filterbank
+
+
+def beat_frames(boundaries, sr, n_frames, hop_length=HOP_LENGTH):
+    """
+    The frames centred in each beat
+    :param boundaries: The beat boundaries in seconds, increasing
+    :param sr: The sample rate of the signal
+    :param n_frames: The number of frames of the spectrogram
+    :param hop_length: The hop between frames, in samples
+    :return: (starts, ends), beat i is frames starts[i]:ends[i], at least one
+    """
+    first_frames = np.ceil(np.asarray(boundaries) * sr / hop_length).astype(int)
+    first_frames = np.clip(first_frames, 0, n_frames)
+    starts = np.minimum(first_frames[:-1], n_frames - 1)
+    # Beats shorter than a hop get the frame closest to their start
+    ends = np.maximum(first_frames[1:], starts + 1)
+    return starts, ends
+
+
+def pool_beats(frames, starts, ends):
+    """
+    Average frame features between beats
+    :param frames: The features, shape (n_features, n_frames)
+    :param starts: The first frame of each beat
+    :param ends: The frame after the last one of each beat
+    :return: The beat features, shape (n_features, n_beats)
+    """
+    sums = np.zeros((frames.shape[0], frames.shape[1] + 1))
+    np.cumsum(frames, axis=1, out=sums[:, 1:])
+    return (sums[:, ends] - sums[:, starts]) / (ends - starts)
+
+
+class ChromaEngine:
+    """
+    Chroma of whole tracks with shared filterbanks
+    :param sr: The sample rate of the signals
+    :param n_fft: The FFT size
+    :param hop_length: The hop between frames, in samples
+    :param tuning: The tuning deviation from A440 in fractions of a semitone,
+    estimated from each track if None
+    :param cache_dir: Directory of filterbanks shared between processes, see
+    chroma_filterbank
+    """
+
+    def __init__(
+        self, sr, n_fft=N_FFT, hop_length=HOP_LENGTH, tuning=None, cache_dir=None
+    ):
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.tuning = tuning
+        self.cache_dir = cache_dir
+
+    def power(self, y):
+        """
+        :param y: The mono signal
+        :return: The power spectrogram, shape (n_fft // 2 + 1, n_frames)
+        """
+        stft = threads.stft(y, n_fft=self.n_fft, hop_length=self.hop_length)
+        return np.abs(stft) ** 2
+
+    def chroma(self, power):
+        """
+        The chroma of every frame, each normalised by its loudest pitch class
+        :param power: The power spectrogram
+        :return: The chroma, shape (12, n_frames)
+        """
+        from librosa import estimate_tuning, util
+
+        tuning = self.tuning
+        if tuning is None:
+            tuning = estimate_tuning(S=power, sr=self.sr, bins_per_octave=12)
+        filterbank = chroma_filterbank(self.sr, self.n_fft, tuning, self.cache_dir)
+        return util.normalize(filterbank @ power, norm=np.inf, axis=0)
+
+    def beat_sync_chroma(self, y, boundaries):
+        """
+        The chroma averaged between beats
+        :param y: The mono signal
+        :param boundaries: The beat boundaries in seconds, n_beats + 1 of them
+        :return: (chroma of shape (12, n_beats), average power spectrum of the
+        frames between the first and last boundaries)
+        """
+        power = self.power(y)
+        starts, ends = beat_frames(boundaries, self.sr, power.shape[1], self.hop_length)
+        if len(starts) == 0:
+            return np.zeros((12, 0)), np.zeros(power.shape[0])
+        chroma = pool_beats(self.chroma(power), starts, ends)
+        return chroma, power[:, starts[0] : ends[-1]].mean(axis=1)
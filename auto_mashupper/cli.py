@@ -4,6 +4,7 @@ Command Line Interface for AutoMashupper
 """
 
 import argparse
+import os
 import sys
 from pathlib import Path
 
@@ -15,6 +16,12 @@ def main():
     )
 
     parser.add_argument("--version", action="version", version="automashupper 0.1.0")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="BLAS and FFT threads of each process, AUTOMASHUPPER_THREADS by default",
+    )
 
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
@@ -22,22 +29,260 @@ def main():
     mashability_parser = subparsers.add_parser(
         "mashability", help="Calculate mashability between songs"
     )
-    mashability_parser.add_argument("base_song", nargs="?", help="Base song file path")
+    mashability_parser.add_argument(
+        "base_song",
+        nargs="*",
+        help="Base song file path, several bases are scored against the library "
+        "in one pass",
+    )
+    mashability_parser.add_argument(
+        "--analysis-sr",
+        type=int,
+        default=None,
+        help="Lower sample rate for chroma and tempo analysis, e.g. 22050 or 11025",
+    )
+    mashability_parser.add_argument(
+        "--tempo-preset",
+        choices=["accurate", "fast"],
+        default="accurate",
+        help="Tempo estimation preset, fast uses the onset autocorrelation only",
+    )
+    mashability_parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help="Write all the scores of several bases to one .npz file instead of "
+        "one csv per base",
+    )
+    mashability_parser.add_argument(
+        "--work-dir",
+        default=None,
+        help="Shared directory of a sharded scan. Any number of processes or nodes "
+        "can work on the same directory",
+    )
+    mashability_parser.add_argument(
+        "--shards",
+        type=int,
+        default=None,
+        help="Number of shards of a sharded scan, set by its first worker",
+    )
+    mashability_parser.add_argument(
+        "--stale-after",
+        type=float,
+        default=None,
+        help="Seconds after which the shard of a crashed worker is claimed again",
+    )
+    mashability_parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="Merge the finished shards of --work-dir into the ranked csv",
+    )
+    mashability_parser.add_argument(
+        "--checkpoint",
+        action="store_true",
+        help="Log each candidate as it is scored, so the scan can be resumed",
+    )
+    mashability_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip the candidates already scored by an interrupted scan of the base",
+    )
+    mashability_parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="With --resume, score again the candidates skipped by the scan",
+    )
+    mashability_parser.add_argument(
+        "--tempo-tolerance",
+        type=float,
+        default=None,
+        help="Skip candidates whose tempo is further than this ratio, e.g. 0.08, "
+        "from the base tempo or its half or double",
+    )
+    mashability_parser.add_argument(
+        "--max-key-shift",
+        type=int,
+        default=None,
+        help="Skip candidates more than this many semitones from a key compatible "
+        "with the base",
+    )
+    mashability_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Stream the candidates through this many processes, decoding ahead in "
+        "I/O threads",
+    )
+    mashability_parser.add_argument(
+        "--top-k",
+        type=int,
+        default=None,
+        help="With --workers, only keep this many of the best candidates",
+    )
 
     # Generate mashup command
     generate_parser = subparsers.add_parser(
         "generate", help="Generate mashup from base song"
     )
     generate_parser.add_argument("base_song", help="Base song file path")
+    generate_parser.add_argument(
+        "--stereo",
+        action="store_true",
+        help="Render the mixes with the channels of the base song",
+    )
+
+    # Mashup command
+    mashup_parser = subparsers.add_parser(
+        "mashup", help="Stack the most mashable candidates over a base song"
+    )
+    mashup_parser.add_argument("base_song", help="Base song file path")
+    mashup_parser.add_argument(
+        "-n", "--layers", type=int, default=3, help="Number of candidates to stack"
+    )
+    mashup_parser.add_argument(
+        "-o", "--output", default=None, help="Output wav file path"
+    )
+    mashup_parser.add_argument(
+        "--jobs", type=int, default=None, help="Number of layers rendered in parallel"
+    )
+    mashup_parser.add_argument(
+        "--stereo",
+        action="store_true",
+        help="Render the mashup with the channels of the base song",
+    )
+
+    # Serve command
+    serve_parser = subparsers.add_parser(
+        "serve", help="Serve mashability and mix jobs over local HTTP"
+    )
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Host to bind")
+    serve_parser.add_argument("--port", type=int, default=8765, help="Port to bind")
+    serve_parser.add_argument(
+        "--workers", type=int, default=None, help="Number of worker processes"
+    )
+    serve_parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=64,
+        help="Number of pending jobs above which new jobs are rejected",
+    )
+
+    # Benchmark command
+    benchmark_parser = subparsers.add_parser(
+        "benchmark-threads",
+        help="Time the analysis with each split of the cores between processes "
+        "and threads",
+    )
+    benchmark_parser.add_argument(
+        "songs",
+        nargs="*",
+        help="Songs to analyse, noise signals of 30 seconds if none are given",
+    )
+    benchmark_parser.add_argument(
+        "--cores",
+        type=int,
+        default=None,
+        help="Number of cores, all of them by default",
+    )
+    benchmark_parser.add_argument(
+        "--repeat", type=int, default=1, help="Runs of each split, the best is kept"
+    )
 
     args = parser.parse_args()
 
+    if args.command is not None:
+        from .threads import set_threads
+
+        set_threads(args.threads)
+
     # Try to import required modules when needed
     if args.command == "mashability":
         try:
             from .mashability import main as mashability_main
+            from .mashability import main_many
+
+            # Flags of the scan of a single base, without --work-dir or -o
+            single_scan_flags = [
+                flag
+                for flag, value in [
+                    ("--tempo-tolerance", args.tempo_tolerance),
+                    ("--max-key-shift", args.max_key_shift),
+                    ("--workers", args.workers),
+                    ("--top-k", args.top_k),
+                    ("--checkpoint", args.checkpoint or None),
+                    ("--resume", args.resume or None),
+                    ("--retry-failed", args.retry_failed or None),
+                ]
+                if value is not None
+            ]
+            # Flags of a sharded scan, with --work-dir
+            shard_flags = [
+                flag
+                for flag, value in [
+                    ("--shards", args.shards),
+                    ("--stale-after", args.stale_after),
+                    ("--merge", args.merge or None),
+                ]
+                if value is not None
+            ]
+            single_scan = (
+                not args.work_dir and not args.output and len(args.base_song) <= 1
+            )
+            if single_scan_flags and not single_scan:
+                print(
+                    "Error: %s only apply to the scan of one base song, without "
+                    "--work-dir or -o" % ", ".join(single_scan_flags),
+                    file=sys.stderr,
+                )
+                sys.exit(1)
+            if shard_flags and not args.work_dir:
+                print(
+                    "Error: %s only apply to a sharded scan, with --work-dir"
+                    % ", ".join(shard_flags),
+                    file=sys.stderr,
+                )
+                sys.exit(1)
+            if args.top_k is not None and args.workers is None:
+                print("Error: --top-k takes --workers", file=sys.stderr)
+                sys.exit(1)
+            if args.work_dir:
+                from .sharding import merge_shards, scan_shards
 
-            mashability_main(args.base_song)
+                if len(args.base_song) != 1:
+                    print("Error: A sharded scan takes one base song", file=sys.stderr)
+                    sys.exit(1)
+                if args.merge:
+                    merge_shards(args.base_song[0], args.work_dir)
+                else:
+                    done = scan_shards(
+                        args.base_song[0],
+                        args.work_dir,
+                        n_shards=args.shards,
+                        analysis_sr=args.analysis_sr,
+                        tempo_preset=args.tempo_preset,
+                        stale_after=args.stale_after,
+                    )
+                    print("Scored shards %s" % done)
+            elif len(args.base_song) > 1 or args.output:
+                main_many(
+                    args.base_song,
+                    analysis_sr=args.analysis_sr,
+                    tempo_preset=args.tempo_preset,
+                    output=args.output,
+                )
+            else:
+                mashability_main(
+                    args.base_song[0] if args.base_song else None,
+                    analysis_sr=args.analysis_sr,
+                    tempo_preset=args.tempo_preset,
+                    resume=args.resume,
+                    retry_failed=args.retry_failed,
+                    tempo_tolerance=args.tempo_tolerance,
+                    max_key_shift=args.max_key_shift,
+                    workers=args.workers,
+                    top_k=args.top_k,
+                    checkpoint=args.checkpoint,
+                )
         except ImportError as e:
             print(f"Error: Required dependencies not available: {e}", file=sys.stderr)
             print(
@@ -57,7 +302,7 @@ def main():
             if not base_song.exists():
                 print(f"Error: File {base_song} not found", file=sys.stderr)
                 sys.exit(1)
-            write_songs_mash(str(base_song))
+            write_songs_mash(str(base_song), mono=not args.stereo)
             print(f"Mashup generated successfully for {base_song}")
         except ImportError as e:
             print(f"Error: Required dependencies not available: {e}", file=sys.stderr)
@@ -70,6 +315,68 @@ def main():
             print(f"Error: {e}", file=sys.stderr)
             sys.exit(1)
 
+    elif args.command == "mashup":
+        try:
+            from soundfile import write as write_wav
+
+            from .compositor import compose_from_csv
+
+            base_song = Path(args.base_song)
+            if not base_song.exists():
+                print(f"Error: File {base_song} not found", file=sys.stderr)
+                sys.exit(1)
+            output = args.output or base_song.stem + "_MASHUP.wav"
+            mix = compose_from_csv(
+                str(base_song), args.layers, n_jobs=args.jobs, mono=not args.stereo
+            )
+            # soundfile takes the channels last
+            write_wav(output, mix.T, 44100)
+            print(f"Mashup written to {output}")
+        except ImportError as e:
+            print(f"Error: Required dependencies not available: {e}", file=sys.stderr)
+            print(
+                "Please ensure all audio processing dependencies are installed.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    elif args.command == "serve":
+        try:
+            from .server import serve
+
+            serve(args.host, args.port, args.workers, args.max_pending, args.threads)
+        except ImportError as e:
+            print(f"Error: Required dependencies not available: {e}", file=sys.stderr)
+            print(
+                "Please ensure all audio processing dependencies are installed.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
+    elif args.command == "benchmark-threads":
+        try:
+            from .threads import analysis_job, benchmark_splits
+
+            n_cores = args.cores or os.cpu_count() or 1
+            items = args.songs or list(range(2 * n_cores))
+            timings = benchmark_splits(analysis_job, items, n_cores, args.repeat)
+            for n_processes, n_threads, seconds in timings:
+                print(
+                    "%3d processes x %3d threads: %.2f s"
+                    % (n_processes, n_threads, seconds)
+                )
+            print("Best split: --workers %d --threads %d" % tuple(timings[0][:2]))
+        except ImportError as e:
+            print(f"Error: Required dependencies not available: {e}", file=sys.stderr)
+            print(
+                "Please ensure all audio processing dependencies are installed.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
     else:
         parser.print_help()
         sys.exit(1)
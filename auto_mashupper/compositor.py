@@ -0,0 +1,203 @@
+"""
+Multi-song mashups: a base loop with N candidate layers stacked on top
+"""
+
+import csv
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Optional
+
+import numpy as np
+
+from .results import read_top_candidates
+from .tempo import BeatGrid
+from .utilities import (
+    AUDIO_DTYPE,
+    align_candidate,
+    load_song,
+    match_channels,
+    peak,
+    self_tempo_estimation,
+    to_mono,
+    tuning_frequency,
+)
+
+
+@dataclass
+class Layer:
+    """
+    A candidate placed over the base loop
+    :param song: The path to the candidate or numpy array
+    :param beat_offset: The beat offset inside the candidate
+    :param pitch_shift: The pitch shift applied to the candidate
+    :param gain: The gain of the layer, None shares the headroom equally
+    :param start_beat: The beat of the base loop where the layer comes in
+    :param tuning: The tuning frequency of the candidate, estimated if None
+    :param beats: The beat times of the candidate in seconds, estimated if None
+    """
+
+    song: object
+    beat_offset: int = 0
+    pitch_shift: int = 0
+    gain: Optional[float] = None
+    start_beat: int = 0
+    tuning: Optional[float] = None
+    beats: Optional[np.ndarray] = None
+
+
+def layers_from_csv(csv_path, n_layers, gain=None):
+    """
+    Build layers from the top rows of a mashability csv
+    :param csv_path: The csv written by mashability.main
+    :param n_layers: Number of ranked candidates to take
+    :param gain: The gain of every layer, None shares the headroom equally
+    :return: A list of Layer
+    """
+    with open(csv_path, "r") as csvfile:
+        return layers_from_rows(
+            itertools.islice(csv.DictReader(csvfile), n_layers), gain
+        )
+
+
+def layers_from_rows(rows, gain=None):
+    """
+    Build layers from ranked mashability results
+    :param rows: Dicts with the file, beat_offset and pitch_shift of a candidate,
+    as read from the csv or the result store, and its tuning and beats when the
+    store has them
+    :param gain: The gain of every layer, None shares the headroom equally
+    :return: A list of Layer
+    """
+    return [
+        Layer(
+            song=row["file"],
+            beat_offset=int(row["beat_offset"]),
+            pitch_shift=int(row["pitch_shift"]),
+            gain=gain,
+            tuning=row.get("tuning"),
+            beats=row.get("beats"),
+        )
+        for row in rows
+    ]
+
+
+def render_layer(
+    layer, final_tempo, final_len, tunning_main, sr=44100, mono=True, grid=None
+):
+    """
+    Align a layer to the base loop and apply its gain and placement
+    :param layer: The Layer
+    :param final_tempo: The tempo of the base loop
+    :param final_len: The length of the base loop in samples
+    :param tunning_main: The tuning frequency of the base loop
+    :param sr: The sample rate
+    :param mono: Downmix the layer if it is a file, see align_candidate
+    :param grid: The BeatGrid of the base loop, a grid at final_tempo starting
+    at the first sample if None
+    :return: (start sample, layer signal ready to be added to the mix)
+    """
+    if grid is None:
+        grid = BeatGrid([], sr, final_tempo)
+    start = grid.beat_to_sample(layer.start_beat)
+    start = min(max(start, 0), final_len)
+    cand_song = align_candidate(
+        layer.song,
+        layer.beat_offset,
+        layer.pitch_shift,
+        final_tempo,
+        final_len - start,
+        tunning_main,
+        sr,
+        layer.tuning,
+        layer.beats,
+        mono=mono,
+    )
+    cand_song = np.asarray(cand_song[..., : final_len - start], dtype=AUDIO_DTYPE)
+    cand_song *= layer.gain / peak(cand_song)
+    return start, cand_song
+
+
+def compose_mashup(
+    base_song,
+    layers,
+    sr=44100,
+    base_gain=None,
+    n_jobs=None,
+    base_tuning=None,
+    mono=True,
+):
+    """
+    Render a base loop and N layers into a single mix. Layers are aligned in
+    parallel and summed into the base buffer, so the cost grows linearly with N
+    :param base_song: The path to the base loop or numpy array
+    :param layers: Iterable of Layer
+    :param sr: The sample rate to load the songs at, or of the numpy arrays
+    :param base_gain: The gain of the base loop, None shares the headroom equally
+    :param n_jobs: Number of layers aligned at the same time
+    :param base_tuning: The tuning frequency of the base loop, estimated if None
+    :param mono: Downmix the files. Without it the mashup keeps the channels of
+    the base loop, with shape (n_channels, n_samples)
+    :return: The mashup, as long as the base loop, with its peak at most 1
+    """
+    base = load_song(base_song, sr, mono=mono)
+    layers = list(layers)
+    default_gain = 1 / (len(layers) + 1)
+    layers = [
+        replace(layer, gain=default_gain) if layer.gain is None else layer
+        for layer in layers
+    ]
+    analysis_base = to_mono(base)
+    final_tempo, base_beats = self_tempo_estimation(analysis_base, sr)
+    # Layers come in on the beats of the base, phase-aligned with its onsets
+    grid = BeatGrid([] if base_beats is None else base_beats, sr, final_tempo)
+    tunning_main = base_tuning or tuning_frequency(analysis_base, sr)
+    final_len = base.shape[-1]
+
+    # The base buffer becomes the mix buffer
+    mix = base
+    mix *= (default_gain if base_gain is None else base_gain) / peak(base)
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        rendered = [
+            executor.submit(
+                render_layer,
+                layer,
+                final_tempo,
+                final_len,
+                tunning_main,
+                sr,
+                mono,
+                grid,
+            )
+            for layer in layers
+        ]
+        for future in rendered:
+            start, cand_song = future.result()
+            cand_song = match_channels(cand_song, mix)
+            mix[..., start : start + cand_song.shape[-1]] += cand_song
+    mix_peak = peak(mix)
+    if mix_peak > 1:
+        mix /= mix_peak
+    return mix
+
+
+def compose_from_csv(
+    base_song, n_layers, csv_path=None, sr=44100, n_jobs=None, mono=True
+):
+    """
+    Render a mashup of a base loop with its N most mashable candidates
+    :param base_song: The path to the base loop
+    :param n_layers: Number of ranked candidates to stack
+    :param csv_path: The mashability csv, the results written by mashability.main
+    for the base loop if None
+    :param sr: The sample rate
+    :param n_jobs: Number of layers aligned at the same time
+    :param mono: Downmix the files, see compose_mashup
+    :return: The mashup
+    """
+    if csv_path is None:
+        # The result store of the base loop if it exists, else its csv
+        layers = layers_from_rows(read_top_candidates(base_song, n_layers))
+    else:
+        layers = layers_from_csv(csv_path, n_layers)
+    return compose_mashup(base_song, layers, sr=sr, n_jobs=n_jobs, mono=mono)
@@ -0,0 +1,139 @@
+"""
+Analysis context: reusable essentia algorithms and per-track intermediates.
+
+Creating an essentia algorithm is not free, and the same signal is often
+filtered or analysed by several feature functions. An AnalysisContext keeps
+one configured instance per (algorithm, parameters) and a small LRU cache of
+intermediates (decoded signal, equal-loudness filtered signal, onset
+envelope...) per track.
+
+Essentia algorithms are not thread safe, so each thread gets its own default
+context. Cached signals are shared, treat them as read-only.
+
+Arrays are identified by the object, not their content, so a buffer refilled in
+place would get the intermediates of its previous content. The default contexts
+only cache files: each analysis of an array runs in a scoped() context, whose
+array intermediates are dropped with it. A context created by the caller caches
+arrays for as long as it lives, the caller must not change them in place.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def track_key(track):
+    """
+    Key identifying a track for the intermediates cache. Arrays are identified by
+    the object itself, files by their path and on-disk version
+    :param track: The path to the track or numpy array
+    :return: A hashable key
+    """
+    if isinstance(track, np.ndarray):
+        return "array", id(track)
+    path = os.path.abspath(track)
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+class AnalysisContext:
+    """
+    Owner of reusable essentia algorithms and of cached per-track intermediates
+    :param cache_size: Number of files or signals whose intermediates are kept in
+    memory. A decoded file and its signal are two entries
+    :param cache_arrays: Also cache the intermediates of numpy arrays, which must
+    then not be changed in place
+    """
+
+    def __init__(self, cache_size=4, cache_arrays=True):
+        self.cache_size = cache_size
+        self._algorithms = {}
+        self._tracks = OrderedDict()
+        self._arrays = OrderedDict() if cache_arrays else None
+
+    def scoped(self):
+        """
+        A context for one analysis, sharing the algorithms and cached files of
+        this one, with its own cache of array intermediates
+        :return: An AnalysisContext
+        """
+        scoped = AnalysisContext(self.cache_size)
+        scoped._algorithms = self._algorithms
+        scoped._tracks = self._tracks
+        return scoped
+
+    def algorithm(self, name, **params):
+        """
+        A configured essentia algorithm, created on first use and reset on reuse
+        so no filter state leaks from the previous signal
+        :param name: The name of the algorithm in essentia.standard
+        :param params: The parameters of the algorithm
+        :return: The algorithm instance
+        """
+        key = (name, tuple(sorted(params.items())))
+        algorithm = self._algorithms.get(key)
+        if algorithm is None:
+            import essentia.standard as estd
+
+            algorithm = getattr(estd, name)(**params)
+            self._algorithms[key] = algorithm
+        else:
+            algorithm.reset()
+        return algorithm
+
+    def cached(self, track, name, compute):
+        """
+        A per-track intermediate, computed on the first request only
+        :param track: The path to the track or numpy array the value belongs to
+        :param name: Hashable name of the intermediate, including its parameters
+        :param compute: Function without arguments computing the value
+        :return: The value
+        """
+        tracks = self._arrays if isinstance(track, np.ndarray) else self._tracks
+        if self.cache_size <= 0 or tracks is None:
+            return compute()
+        key = track_key(track)
+        entry = tracks.get(key)
+        # Holding on to arrays keeps their id from being reused by another one
+        if entry is None or (isinstance(track, np.ndarray) and entry[0] is not track):
+            entry = (track, {})
+            tracks[key] = entry
+            while len(tracks) > self.cache_size:
+                tracks.popitem(last=False)
+        else:
+            tracks.move_to_end(key)
+        values = entry[1]
+        if name not in values:
+            values[name] = compute()
+        return values[name]
+
+    def clear(self):
+        """Drop the cached intermediates, keeping the algorithm instances"""
+        self._tracks.clear()
+        if self._arrays is not None:
+            self._arrays.clear()
+
+
+_local = threading.local()
+
+
+def default_context():
+    """
+    The analysis context of the calling thread, caching files only
+    :return: An AnalysisContext
+    """
+    context = getattr(_local, "context", None)
+    if context is None:
+        context = _local.context = AnalysisContext(cache_arrays=False)
+    return context
+
+
+def analysis_context(context=None):
+    """
+    The context of one analysis
+    :param context: The context given by the caller, used as is
+    :return: context, or a scope of the default context of the calling thread
+    """
+    return context if context is not None else default_context().scoped()
@@ -0,0 +1,117 @@
+"""
+Precomputed per-track features, so a track is analysed once and scored many times
+"""
+
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+
+from .context import analysis_context
+from .segmentation import (
+    beat_sync_features,
+    chroma_rotations,
+    load_mono,
+    to_analysis_rate,
+    tuning_from_spectrum,
+)
+from .utilities import self_tempo_estimation, tuning_frequency
+
+TUNING_PRESETS = ("fast", "accurate")
+
+
+@dataclass
+class TrackFeatures:
+    """
+    Everything the mashability scoring needs to know about a track
+    :param tempo: The tempo in bpm
+    :param beats: The beat times in seconds
+    :param chroma: The beat synchronous chroma, shape (12, n_beats)
+    :param bands: The beat synchronous 3-band spectrum, shape (3, n_beats)
+    :param duration: The duration of the track in seconds
+    :param tuning: The tuning frequency in Hz, used to match the pitch when mixing
+    """
+
+    tempo: float
+    beats: np.ndarray
+    chroma: np.ndarray
+    bands: np.ndarray
+    duration: float
+    tuning: float = 440.0
+
+    @cached_property
+    def chroma_rotations(self):
+        """
+        The 12 pitch rotations of the chroma, computed once and kept with the
+        features, shape (12, 12, n_beats)
+        """
+        return chroma_rotations(self.chroma)
+
+
+def extract_features(
+    audio,
+    sr=44100,
+    bpm=None,
+    analysis_sr=None,
+    tempo_preset="accurate",
+    context=None,
+    tuning_preset="accurate",
+):
+    """
+    Analyse a track once and keep its features for later scoring
+    :param audio: Path to the song, or numpy array
+    :param sr: The sample rate to load the song at, or of the numpy array
+    :param bpm: Precalculated bpm
+    :param analysis_sr: Lower sample rate for the chroma and tempo analysis, e.g.
+    22050 or 11025. The band energies are always computed at sr
+    :param tempo_preset: "accurate" or "fast", see auto_mashupper.tempo
+    :param context: The AnalysisContext reusing algorithms and intermediates,
+    a scope of the one of the calling thread if None
+    :param tuning_preset: "accurate" runs essentia's TuningFrequencyExtractor,
+    "fast" reads the tuning from the average spectrum of the chroma STFT
+    :return: A TrackFeatures
+    """
+    if tuning_preset not in TUNING_PRESETS:
+        raise ValueError(
+            "Unknown tuning preset %s, use one of %s" % (tuning_preset, TUNING_PRESETS)
+        )
+    context = analysis_context(context)
+    y = load_mono(audio, sr, context)
+    analysis_y, analysis_sr = to_analysis_rate(y, sr, analysis_sr)
+    tempo, beats = self_tempo_estimation(
+        analysis_y, analysis_sr, tempo=bpm, preset=tempo_preset, context=context
+    )
+    chroma, bands, power = beat_sync_features(
+        y,
+        sr,
+        beats,
+        analysis_y=analysis_y,
+        analysis_sr=analysis_sr,
+        context=context,
+    )
+    if tuning_preset == "fast":
+        tuning = tuning_from_spectrum(power, analysis_sr)
+    else:
+        tuning = float(tuning_frequency(y, sr, context))
+    return TrackFeatures(
+        tempo=tempo,
+        beats=beats,
+        chroma=chroma,
+        bands=bands,
+        duration=len(y) / sr,
+        tuning=tuning,
+    )
+
+
+def as_track_features(audio, sr=44100, bpm=None, analysis_sr=None):
+    """
+    Return the features of a track, extracting them unless they already are
+    :param audio: A TrackFeatures, path to the song, or numpy array
+    :param sr: The sample rate to load the song at, or of the numpy array
+    :param bpm: Precalculated bpm
+    :param analysis_sr: Lower sample rate for the chroma and tempo analysis
+    :return: A TrackFeatures
+    """
+    if isinstance(audio, TrackFeatures):
+        return audio
+    return extract_features(audio, sr=sr, bpm=bpm, analysis_sr=analysis_sr)
@@ -1,130 +1,576 @@
-import csv
 import glob
 import os
 import shutil
 import sys
 
 import numpy as np
-from librosa.core import load
-from scipy import signal
-from soundfile import write as write_wav
 
-from .segmentation import get_beat_sync_chroma_and_spectrum
-from .utilities import mix_songs
+from .checkpoint import ScanLog, checkpoint_path
+from .features import TrackFeatures, as_track_features, extract_features
+from .prefilter import (
+    MetadataCache,
+    compatible_songs,
+    features_metadata,
+    metadata_path,
+)
+from .results import (
+    ResultReader,
+    read_top_candidates,
+    results_path,
+    track_row,
+    unknown_tracks,
+    write_results,
+)
+from .segmentation import (
+    FEATURE_DTYPE,
+    as_feature_array,
+    chroma_rotations,
+    load_mono,
+)
+from .utilities import iter_mixes
+
+# Signed pitch shift of the candidate, in semitones down, for each chroma rotation.
+# Rotations above a tritone are shorter going the other way
+PITCH_SHIFTS = np.array([0, 1, 2, 3, 4, 5, 6, -5, -4, -3, -2, -1])
+
+# One row of results, in the column order of the csv
+SCORE_DTYPE = np.dtype(
+    [
+        ("mashability", FEATURE_DTYPE),
+        ("pitch_shift", np.int8),
+        ("beat_offset", np.int32),
+        ("h_contr", FEATURE_DTYPE),
+        ("r_contr", FEATURE_DTYPE),
+    ]
+)
+
+# Number of bases whose rotations are stacked into one matrix product, so the
+# stacked matrix of a 16 beats loop stays around 1.5 MB, within the L2/L3 cache
+BASE_TILE = 64
 
 
 class ShorterException(Exception):
     pass
 
 
-def mashability(base_beat_sync_chroma, base_beat_sync_spec, audio_file_candidate):
+def mashability(
+    base_beat_sync_chroma,
+    base_beat_sync_spec,
+    audio_file_candidate,
+    sr=44100,
+    analysis_sr=None,
+    tempo_preset="accurate",
+    base_rotations=None,
+):
     """
     Calculate the mashability of two songs.
     :param base_beat_sync_chroma: The beat synchronous chroma.
     :param base_beat_sync_spec: The beat synchronous spectrogram.
-    :param audio_file_candidate: The path to the candidate for mashability.
+    :param audio_file_candidate: The path to the candidate for mashability, or its
+    precomputed TrackFeatures.
+    :param sr: The sample rate to load the candidate at.
+    :param analysis_sr: Lower sample rate for the chroma and tempo analysis.
+    :param tempo_preset: "accurate" or "fast" tempo estimation.
+    :param base_rotations: The precomputed chroma rotations of the base song.
     :return: A tuple containing: mashability value, the pitch offset, beat offset.
     """
-    try:
-        y, sr = load(audio_file_candidate)
-    except:
-        raise ShorterException("EOF error")
-    if len(y) / sr < 3:
-        raise ShorterException("Candidate is smaller than 3 seconds")
+    candidate = candidate_features(
+        audio_file_candidate, sr=sr, analysis_sr=analysis_sr, tempo_preset=tempo_preset
+    )
     # 1st step: Calculate harmonic compatibility
-    c_bsc, c_bss = get_beat_sync_chroma_and_spectrum(audio_file_candidate)
-    c_bsc = np.flip(c_bsc)  # Flip to make correlation, no convolution
-    stacked_beat_sync_chroma = np.vstack([c_bsc, c_bsc])
-    conv = signal.convolve2d(
-        stacked_beat_sync_chroma,
+    return beat_sync_mashability(
         base_beat_sync_chroma,
+        base_beat_sync_spec,
+        candidate.chroma,
+        candidate.bands,
+        base_rotations=base_rotations,
     )
+
+
+def candidate_features(
+    audio_file_candidate, sr=44100, analysis_sr=None, tempo_preset="accurate"
+):
+    """
+    Analyse a candidate, rejecting the ones that cannot be decoded or are too short
+    :param audio_file_candidate: The path to the candidate, or its TrackFeatures.
+    :param sr: The sample rate to load the candidate at.
+    :param analysis_sr: Lower sample rate for the chroma and tempo analysis.
+    :param tempo_preset: "accurate" or "fast" tempo estimation.
+    :return: The TrackFeatures of the candidate.
+    """
+    candidate = audio_file_candidate
+    if not isinstance(candidate, TrackFeatures):
+        try:
+            y = load_mono(audio_file_candidate, sr)
+        except:
+            raise ShorterException("EOF error")
+        if len(y) / sr < 3:
+            raise ShorterException("Candidate is smaller than 3 seconds")
+        candidate = extract_features(
+            y, sr=sr, analysis_sr=analysis_sr, tempo_preset=tempo_preset
+        )
+    elif candidate.duration < 3:
+        raise ShorterException("Candidate is smaller than 3 seconds")
+    return candidate
+
+
+def score_features(base_features, cand_features):
+    """
+    Calculate the mashability of two songs from their precomputed features.
+    :param base_features: The TrackFeatures of the base song.
+    :param cand_features: The TrackFeatures of the candidate song.
+    :return: A tuple containing: mashability value, the pitch offset, beat offset,
+    harmonic contribution, spectral contribution
+    """
+    return beat_sync_mashability(
+        base_features.chroma,
+        base_features.bands,
+        cand_features.chroma,
+        cand_features.bands,
+        base_rotations=base_features.chroma_rotations,
+    )
+
+
+def chroma_windows(cand_beat_sync_chroma, n_beats):
+    """
+    Every n_beats long window of a chroma, one flattened window per row
+    :param cand_beat_sync_chroma: The beat synchronous chroma, shape (12, n)
+    :param n_beats: The window length in beats
+    :return: Array of shape (n - n_beats + 1, 12 * n_beats)
+    """
+    windows = np.lib.stride_tricks.sliding_window_view(
+        cand_beat_sync_chroma, n_beats, axis=1
+    )
+    return windows.transpose(1, 0, 2).reshape(windows.shape[1], 12 * n_beats)
+
+
+def spectral_balance(base_band_means, cand_beat_sync_spec, n_beats):
+    """
+    Spectral balance compatibility for every beat offset
+    :param base_band_means: The mean of the base beat synchronous spectrogram
+    over its beats, shape (3,), or (n_bases, 3) for bases of the same length
+    :param cand_beat_sync_spec: The beat synchronous spectrogram of the candidate
+    :param n_beats: The number of beats of the base
+    :return: Array of shape (n_offsets,), or (n_bases, n_offsets)
+    """
+    windows = np.lib.stride_tricks.sliding_window_view(
+        cand_beat_sync_spec, n_beats, axis=1
+    )
+    beta = base_band_means[..., None] + np.mean(windows, axis=2)
+    beta_norm = beta / np.sum(beta, axis=-2, keepdims=True)
+    return 1 - np.std(beta_norm, axis=-2)
+
+
+def harmonic_matrix(base_rotations, cand_beat_sync_chroma):
+    """
+    Unnormalized harmonic compatibility for every pitch rotation and beat offset,
+    as a single matrix product of the base rotations and the candidate windows
+    :param base_rotations: The chroma rotations of the base, shape (12, 12, n_beats)
+    :param cand_beat_sync_chroma: The beat synchronous chroma of the candidate,
+    with at least n_beats beats
+    :return: Array of shape (12, n_offsets), entry (p, k) correlates the base
+    transposed p semitones up with the candidate starting at beat k
+    """
+    n_beats = base_rotations.shape[2]
+    windows = chroma_windows(cand_beat_sync_chroma, n_beats)
+    return base_rotations.reshape(12, 12 * n_beats) @ windows.T
+
+
+def beat_sync_mashability(
+    base_beat_sync_chroma,
+    base_beat_sync_spec,
+    cand_beat_sync_chroma,
+    cand_beat_sync_spec,
+    base_rotations=None,
+):
+    """
+    Calculate the mashability of two songs from their beat synchronous features.
+    All the arithmetic is done in FEATURE_DTYPE, whatever the dtype of the inputs.
+    The pitch shift is signed: positive shifts the candidate down, negative up.
+    :param base_beat_sync_chroma: The beat synchronous chroma of the base song.
+    :param base_beat_sync_spec: The beat synchronous spectrogram of the base song.
+    :param cand_beat_sync_chroma: The beat synchronous chroma of the candidate.
+    :param cand_beat_sync_spec: The beat synchronous spectrogram of the candidate.
+    :param base_rotations: The precomputed chroma rotations of the base, e.g. from
+    its TrackFeatures. Computed from base_beat_sync_chroma if None
+    :return: A tuple containing: mashability value, the pitch offset, beat offset,
+    harmonic contribution, spectral contribution
+    """
+    base_beat_sync_chroma = as_feature_array(base_beat_sync_chroma)
+    base_beat_sync_spec = as_feature_array(base_beat_sync_spec)
+    c_bsc = as_feature_array(cand_beat_sync_chroma)
+    c_bss = as_feature_array(cand_beat_sync_spec)
+    if base_beat_sync_chroma.shape[-1] == 0:
+        raise ValueError("The base song has no complete beat")
+    if c_bsc.shape[1] < base_beat_sync_chroma.shape[1]:
+        raise ShorterException("Candidate song has lesser beats than base song")
+    if base_rotations is None:
+        base_rotations = chroma_rotations(base_beat_sync_chroma)
+
+    # Every pitch rotation against every beat offset in one matrix product
     base_n = np.linalg.norm(base_beat_sync_chroma)
     cand_n = np.linalg.norm(c_bsc)
-    h_mas = conv / (base_n * cand_n)
-    offset = base_beat_sync_chroma.shape[1] - 1
-    h_mas = np.flip(h_mas[11:-11, offset:-offset], axis=0)
-    h_mas_k = np.max(h_mas, axis=0)  # Maximum mashability for each beat displacement
+    h_mas = harmonic_matrix(as_feature_array(base_rotations), c_bsc)
+    h_mas /= base_n * cand_n
 
-    # 3rd step: Calculate Spectral balance compatibility
-    if c_bss.shape[1] >= base_beat_sync_spec.shape[1]:
-        beat_length = base_beat_sync_spec.shape[1]
-        n_max_b_shifts = c_bss.shape[1] - base_beat_sync_spec.shape[1]
-        r_mas_k = np.zeros(n_max_b_shifts + 1)
-        for i in range(n_max_b_shifts + 1):
-            beta = np.mean(base_beat_sync_spec + c_bss[:, i : i + beat_length], axis=1)
-            beta_norm = beta / np.sum(beta)
-            r_mas_k[i] = 1 - np.std(
-                beta_norm
-            )  # Spectral balance for i beat displacement
-    else:
-        raise ShorterException("Candidate song has lesser beats than base song")
-    res_mash = h_mas_k + 0.2 * r_mas_k
+    # 3rd step: Calculate Spectral balance compatibility for every beat displacement
+    r_mas_k = spectral_balance(
+        np.mean(base_beat_sync_spec, axis=1), c_bss, base_beat_sync_spec.shape[1]
+    )
+    return best_offset(h_mas, r_mas_k)
+
+
+def best_offset(h_mas, r_mas_k):
+    """
+    Pick the beat offset with the best combined compatibility
+    :param h_mas: Normalized harmonic compatibility, shape (12, n_offsets)
+    :param r_mas_k: Spectral balance compatibility, shape (n_offsets,)
+    :return: A tuple containing: mashability value, the pitch offset, beat offset,
+    harmonic contribution, spectral contribution
+    """
+    h_mas_k = np.max(h_mas, axis=0)  # Maximum mashability for each beat displacement
+    res_mash = h_mas_k + FEATURE_DTYPE(0.2) * r_mas_k
     b_offset = np.argmax(res_mash)
-    p_shift = np.argmax(h_mas[:, b_offset])
-    if p_shift > 6:
-        p_shift = 12 - p_shift
+    p_shift = PITCH_SHIFTS[np.argmax(h_mas[:, b_offset])]
 
     h_contr = h_mas_k[b_offset]
     r_contr = r_mas_k[b_offset]
     return np.max(res_mash), p_shift, b_offset, h_contr, r_contr
 
 
-def get_mashability(audio1_vector, audio2_vector, bpm1=None, bpm2=None, sr=44100):
+def score_many(base_features, cand_features, tile=BASE_TILE):
+    """
+    Score one candidate against many bases in one pass. Bases with the same number
+    of beats share the candidate windows, and their rotations are stacked so each
+    tile of bases is scored with a single matrix product
+    :param base_features: Sequence of TrackFeatures of the base songs
+    :param cand_features: The TrackFeatures of the candidate
+    :param tile: Maximum number of bases stacked into one matrix product
+    :return: A SCORE_DTYPE array with one row per base. The mashability is NaN for
+    the bases with more beats than the candidate, or with no complete beat
+    """
+    scores = np.zeros(len(base_features), dtype=SCORE_DTYPE)
+    scores["mashability"] = np.nan
+    c_bsc = as_feature_array(cand_features.chroma)
+    c_bss = as_feature_array(cand_features.bands)
+    cand_n = np.linalg.norm(c_bsc)
+    by_length = {}
+    for i, base in enumerate(base_features):
+        n_beats = base.chroma.shape[1]
+        if 0 < n_beats <= c_bsc.shape[1]:
+            by_length.setdefault(n_beats, []).append(i)
+
+    for n_beats, indices in by_length.items():
+        windows = chroma_windows(c_bsc, n_beats)
+        for start in range(0, len(indices), tile):
+            group = indices[start : start + tile]
+            bases = [base_features[i] for i in group]
+            rotations = np.concatenate(
+                [
+                    as_feature_array(base.chroma_rotations).reshape(12, -1)
+                    for base in bases
+                ]
+            )
+            h_mas = (rotations @ windows.T).reshape(len(group), 12, -1)
+            base_n = np.array([np.linalg.norm(base.chroma) for base in bases])
+            h_mas /= (base_n * cand_n).astype(FEATURE_DTYPE)[:, None, None]
+            h_mas_k = np.max(h_mas, axis=1)
+            band_means = np.stack(
+                [np.mean(as_feature_array(base.bands), axis=1) for base in bases]
+            )
+            r_mas_k = spectral_balance(band_means, c_bss, n_beats)
+            res_mash = h_mas_k + FEATURE_DTYPE(0.2) * r_mas_k
+
+            rows = np.arange(len(group))
+            b_offset = np.argmax(res_mash, axis=1)
+            scores["mashability"][group] = res_mash[rows, b_offset]
+            scores["pitch_shift"][group] = PITCH_SHIFTS[
+                np.argmax(h_mas[rows, :, b_offset], axis=1)
+            ]
+            scores["beat_offset"][group] = b_offset
+            scores["h_contr"][group] = h_mas_k[rows, b_offset]
+            scores["r_contr"][group] = r_mas_k[rows, b_offset]
+    return scores
+
+
+class IncrementalScorer:
+    """
+    Scores of one base loop against a library, updated when beats are added to or
+    removed from either end of the base instead of rescoring the library.
+
+    For each candidate, the correlations of the rotated base beats with the
+    candidate beats are summed along the diagonals of the sliding windows: column
+    n_beats + k holds the harmonic correlation of the base starting at candidate
+    beat k, for every k where at least one beat overlaps. Editing a beat at an end
+    of the base adds or subtracts that beat's correlation with the candidate, and
+    the spectral balance windows come from prefix sums of the candidate bands.
+    The sums are kept in float64 so repeated edits do not drift.
+    :param base_features: The TrackFeatures of the base loop
+    :param cand_features: Sequence of TrackFeatures of the candidates
+    """
+
+    def __init__(self, base_features, cand_features):
+        self._cand_chroma = [as_feature_array(c.chroma) for c in cand_features]
+        self._cand_norms = [np.linalg.norm(c) for c in self._cand_chroma]
+        self._band_sums = [
+            np.cumsum(
+                np.pad(as_feature_array(c.bands), ((0, 0), (1, 0))),
+                axis=1,
+                dtype=np.float64,
+            )
+            for c in cand_features
+        ]
+        self._sums = [np.zeros((12, c.shape[1])) for c in self._cand_chroma]
+        self.chroma = np.zeros((12, 0))
+        self.bands = np.zeros((3, 0))
+        self.append(base_features.chroma, base_features.bands)
+
+    def __len__(self):
+        return self.chroma.shape[1]
+
+    def _correlations(self, beat_chroma):
+        """The rotations of one base beat against every beat of each candidate"""
+        rotations = chroma_rotations(beat_chroma[:, None])[..., 0]
+        return [rotations @ chroma for chroma in self._cand_chroma]
+
+    @staticmethod
+    def _as_beats(chroma, bands):
+        chroma = np.asarray(chroma, dtype=np.float64).reshape(12, -1)
+        bands = np.asarray(bands, dtype=np.float64).reshape(3, -1)
+        if chroma.shape[1] != bands.shape[1]:
+            raise ValueError(
+                "Got %d chroma beats and %d band beats"
+                % (chroma.shape[1], bands.shape[1])
+            )
+        return chroma, bands
+
+    def append(self, chroma, bands):
+        """
+        Add beats at the end of the base
+        :param chroma: The beat synchronous chroma of the new beats, shape (12, m)
+        :param bands: The beat synchronous 3-band spectrum of the new beats
+        """
+        chroma, bands = self._as_beats(chroma, bands)
+        for beat in chroma.T:
+            for i, corr in enumerate(self._correlations(beat)):
+                sums = np.pad(self._sums[i], ((0, 0), (1, 0)))
+                sums[:, 1 : corr.shape[1] + 1] += corr
+                self._sums[i] = sums
+        self.chroma = np.hstack([self.chroma, chroma])
+        self.bands = np.hstack([self.bands, bands])
+
+    def prepend(self, chroma, bands):
+        """
+        Add beats at the start of the base
+        :param chroma: The beat synchronous chroma of the new beats, shape (12, m)
+        :param bands: The beat synchronous 3-band spectrum of the new beats
+        """
+        chroma, bands = self._as_beats(chroma, bands)
+        n_beats = len(self)
+        for beat in chroma.T[::-1]:
+            n_beats += 1
+            for i, corr in enumerate(self._correlations(beat)):
+                sums = np.pad(self._sums[i], ((0, 0), (0, 1)))
+                sums[:, n_beats : n_beats + corr.shape[1]] += corr
+                self._sums[i] = sums
+        self.chroma = np.hstack([chroma, self.chroma])
+        self.bands = np.hstack([bands, self.bands])
+
+    def trim(self, start=0, end=0):
+        """
+        Remove beats from the ends of the base
+        :param start: Number of beats removed at the start
+        :param end: Number of beats removed at the end
+        """
+        if start < 0 or end < 0 or start + end > len(self):
+            raise ValueError(
+                "Cannot trim %d and %d beats from a %d beats base"
+                % (start, end, len(self))
+            )
+        for beat in self.chroma[:, len(self) - end :].T[::-1]:
+            for i, corr in enumerate(self._correlations(beat)):
+                sums = self._sums[i][:, 1:]
+                sums[:, : corr.shape[1]] -= corr
+                self._sums[i] = sums
+        n_beats = len(self) - end
+        for beat in self.chroma[:, :start].T:
+            for i, corr in enumerate(self._correlations(beat)):
+                sums = self._sums[i][:, :-1]
+                sums[:, n_beats : n_beats + corr.shape[1] - 1] -= corr[:, :-1]
+                self._sums[i] = sums
+            n_beats -= 1
+        self.chroma = self.chroma[:, start : len(self) - end]
+        self.bands = self.bands[:, start : self.bands.shape[1] - end]
+
+    def scores(self):
+        """
+        Score the current base against every candidate
+        :return: A SCORE_DTYPE array with one row per candidate, the mashability
+        is NaN for the candidates with fewer beats than the base
+        """
+        n_beats = len(self)
+        scores = np.zeros(len(self._sums), dtype=SCORE_DTYPE)
+        scores["mashability"] = np.nan
+        if n_beats == 0:
+            return scores
+        base_n = np.linalg.norm(self.chroma)
+        band_means = np.mean(self.bands, axis=1)
+        for i, (sums, band_sums) in enumerate(zip(self._sums, self._band_sums)):
+            n_cand = band_sums.shape[1] - 1
+            if n_cand < n_beats:
+                continue
+            h_mas = sums[:, n_beats : n_cand + 1] / (base_n * self._cand_norms[i])
+            windows = band_sums[:, n_beats:] - band_sums[:, : n_cand - n_beats + 1]
+            beta = band_means[:, None] + windows / n_beats
+            beta_norm = beta / np.sum(beta, axis=0)
+            r_mas_k = 1 - np.std(beta_norm, axis=0)
+            scores[i] = best_offset(
+                h_mas.astype(FEATURE_DTYPE), r_mas_k.astype(FEATURE_DTYPE)
+            )
+        return scores
+
+
+def write_mashability_results(base_song, songs, scores, tracks=None):
+    """
+    Write the candidates ranked by mashability in the columnar result store of the
+    base song, and export them to a csv named after the base song
+    :param base_song: The path to the base song
+    :param songs: The paths to the candidates
+    :param scores: A SCORE_DTYPE array with one row per candidate, the candidates
+    with a NaN mashability are left out
+    :param tracks: A results.TRACK_DTYPE array with one row per candidate, kept in
+    the store for write_songs_mash
+    """
+    out_files = ["out_loops/%s" % (song.split("/")[-1]) for song in songs]
+    path = results_path(base_song)
+    write_results(path, out_files, scores, tracks)
+    ResultReader(path).to_csv(base_song.split("/")[-1].replace(".mp3", ".csv"))
+
+
+def get_mashability(
+    audio1_vector, audio2_vector, bpm1=None, bpm2=None, sr=44100, analysis_sr=None
+):
     """
     Takes to audio vectors and calculate the mashability
-    :param audio1_vector: Numpy array or similar. Audio of the target excerpt.
-    :param audio2_vector: Numpy array or similar. Audio of the candidate excerpt.
+    :param audio1_vector: Numpy array or similar. Audio of the target excerpt, or its
+    precomputed TrackFeatures.
+    :param audio2_vector: Numpy array or similar. Audio of the candidate excerpt, or
+    its precomputed TrackFeatures.
     :param sr: Samplerate of the audio. Both audio vectors should have the same samplerate
+    :param analysis_sr: Lower sample rate for the chroma and tempo analysis, e.g. 22050
     :return: A tuple containing: mashability value, the pitch offset, beat offset, harmonic contribution,
     spectral contribution
     """
-    c_bsc, c_bss = get_beat_sync_chroma_and_spectrum(audio2_vector, sr=sr, bpm=bpm2)
-    base_beat_sync_chroma, base_beat_sync_spec = get_beat_sync_chroma_and_spectrum(
-        audio1_vector, sr=sr, bpm=bpm1
+    cand_features = as_track_features(
+        audio2_vector, sr=sr, bpm=bpm2, analysis_sr=analysis_sr
     )
-    c_bsc = np.flip(c_bsc)  # Flip to make correlation, no convolution
-    stacked_beat_sync_chroma = np.vstack([c_bsc, c_bsc])
-    conv = signal.convolve2d(
-        stacked_beat_sync_chroma,
-        base_beat_sync_chroma,
+    base_features = as_track_features(
+        audio1_vector, sr=sr, bpm=bpm1, analysis_sr=analysis_sr
     )
-    base_n = np.linalg.norm(base_beat_sync_chroma)
-    cand_n = np.linalg.norm(c_bsc)
-    h_mas = conv / (base_n * cand_n)
-    offset = base_beat_sync_chroma.shape[1] - 1
-    h_mas = np.flip(h_mas[11:-11, offset:-offset], axis=0)
-    h_mas_k = np.max(h_mas, axis=0)  # Maximum mashability for each beat displacement
+    return score_features(base_features, cand_features)
 
-    # 3rd step: Calculate Spectral balance compatibility
-    if c_bss.shape[1] >= base_beat_sync_spec.shape[1]:
-        beat_length = base_beat_sync_spec.shape[1]
-        n_max_b_shifts = c_bss.shape[1] - base_beat_sync_spec.shape[1]
-        r_mas_k = np.zeros(n_max_b_shifts + 1)
-        for i in range(n_max_b_shifts + 1):
-            beta = np.mean(base_beat_sync_spec + c_bss[:, i : i + beat_length], axis=1)
-            beta_norm = beta / np.sum(beta)
-            r_mas_k[i] = 1 - np.std(
-                beta_norm
-            )  # Spectral balance for i beat displacement
-    else:
-        raise ShorterException("Candidate song has lesser beats than base song")
-    res_mash = h_mas_k + 0.2 * r_mas_k
-    b_offset = np.argmax(res_mash)
-    p_shift = np.argmax(h_mas[:, b_offset])
-    if p_shift > 6:
-        p_shift = 12 - p_shift
 
-    h_contr = h_mas_k[b_offset]
-    r_contr = r_mas_k[b_offset]
-    return np.max(res_mash), p_shift, b_offset, h_contr, r_contr
+def library_songs(base_song):
+    """
+    The candidates of a base song
+    :param base_song: The path to the base song
+    :return: The paths of the mp3 files in the directory of the base song
+    """
+    # Search for more mp3 files in the target's directory
+    return glob.glob("%s/*.mp3" % base_song.split("/")[0])
+
+
+def score_candidates(
+    base_features,
+    songs,
+    analysis_sr=None,
+    tempo_preset="accurate",
+    checkpoint=None,
+    retry_failed=False,
+    metadata=None,
+    tracks=None,
+):
+    """
+    Calculate the mashability of each candidate with one base song
+    :param base_features: The TrackFeatures of the base song
+    :param songs: The paths to the candidates
+    :param analysis_sr: Lower sample rate for the chroma and tempo analysis, e.g. 22050
+    :param tempo_preset: "accurate" or "fast" tempo estimation
+    :param checkpoint: A checkpoint.ScanLog. The candidates it holds are not scored
+    again, and the others are appended to it
+    :param retry_failed: Score again the candidates the checkpoint records as
+    skipped
+    :param metadata: A prefilter.MetadataCache receiving the tempo and key of the
+    analysed candidates
+    :param tracks: A results.TRACK_DTYPE array with one row per candidate,
+    receiving the tuning and beats of the analysed candidates
+    :return: A SCORE_DTYPE array with one row per candidate, the mashability is
+    NaN for the skipped candidates
+    """
+    scores = np.zeros(len(songs), dtype=SCORE_DTYPE)
+    scores["mashability"] = np.nan
+    # Calculate mashability for each of the candidate songs
+    # Songs containing less beats than the target one will be discarded
+    for j, cand_song in enumerate(songs):
+        if checkpoint is not None:
+            if cand_song in checkpoint.scores:
+                scores[j] = tuple(checkpoint.scores[cand_song])
+                if tracks is not None and cand_song in checkpoint.tracks:
+                    tracks[j] = tuple(checkpoint.tracks[cand_song])
+                continue
+            if cand_song in checkpoint.errors and not retry_failed:
+                continue
+        try:
+            cand_features = candidate_features(
+                cand_song, analysis_sr=analysis_sr, tempo_preset=tempo_preset
+            )
+            if metadata is not None:
+                metadata.put(cand_song, *features_metadata(cand_features))
+            if tracks is not None:
+                tracks[j] = track_row(cand_features)
+            scores[j] = score_features(base_features, cand_features)
+        except ShorterException as e:
+            print("Skipping song %s, because %s" % (cand_song, str(e)))
+            if checkpoint is not None:
+                checkpoint.record_error(cand_song, str(e))
+            continue
+        if checkpoint is not None:
+            track = None if tracks is None else tracks[j].tolist()
+            checkpoint.record(cand_song, scores[j].tolist(), track)
+    return scores
 
 
-def main(base_song=None):
+def main(
+    base_song=None,
+    analysis_sr=None,
+    tempo_preset="accurate",
+    resume=False,
+    retry_failed=False,
+    tempo_tolerance=None,
+    max_key_shift=None,
+    workers=None,
+    top_k=None,
+    checkpoint=False,
+):
     """
     Main function, takes the name of a song and calculate the mashabilities for each song.
     If -p is used, skip the computation of mashability and goes directly to mix the song
     according to the csv generated during the mashability process.
+    :param analysis_sr: Lower sample rate for the chroma and tempo analysis, e.g. 22050
+    :param tempo_preset: "accurate" or "fast" tempo estimation
+    :param resume: Keep the candidates scored or skipped by a previous scan of the
+    base song with the same settings, as recorded in its checkpoint
+    :param retry_failed: When resuming, score again the skipped candidates
+    :param tempo_tolerance: Skip the candidates whose tempo ratio to the base is
+    further from 1 than this, after half/double time folding. See prefilter
+    :param max_key_shift: Skip the candidates that no pitch shift of at most this
+    many semitones brings to a key compatible with the base. See prefilter
+    :param workers: Stream the candidates through this many worker processes,
+    decoding ahead in I/O threads, instead of scoring them one after the other.
+    See pipeline
+    :param top_k: With workers, only write the top_k best candidates
+    :param checkpoint: Append each candidate to a log as it is scored, so that an
+    interrupted scan can be resumed. Resuming appends to the log too
     """
     if (len(sys.argv)) < 2 and (base_song == None):
         print("Usage: python mashability.py <base_song>")
@@ -133,46 +579,130 @@ def main(base_song=None):
         if base_song == None:
             base_song = sys.argv[1]
     if "-p" not in sys.argv:
-        base_schroma, base_spec = get_beat_sync_chroma_and_spectrum(base_song)
-        songs = glob.glob(
-            "%s/*.mp3" % base_song.split("/")[0]
-        )  # Search for more mp3 files in the target's directory
-        mashabilities = {}
-        valid_songs = []
-        # Calculate mashability for each of the candidate songs
-        # Songs containing less beats than the target one will be discarded
-        for cand_song in songs:
-            try:
-                mashabilities[cand_song] = mashability(
-                    base_schroma, base_spec, cand_song
+        base_features = extract_features(
+            base_song, analysis_sr=analysis_sr, tempo_preset=tempo_preset
+        )
+        if workers is not None:
+            from .pipeline import discover_songs
+
+            songs = discover_songs(base_song)
+        else:
+            songs = library_songs(base_song)
+        metadata = None
+        if tempo_tolerance is not None or max_key_shift is not None:
+            metadata = MetadataCache(
+                metadata_path(base_song),
+                {"sr": 44100, "analysis_sr": analysis_sr, "tempo_preset": tempo_preset},
+            )
+            metadata.put(base_song, *features_metadata(base_features))
+            songs = list(songs)
+            n_songs = len(songs)
+            songs = compatible_songs(
+                base_features,
+                songs,
+                metadata,
+                tempo_tolerance=tempo_tolerance,
+                max_key_shift=max_key_shift,
+            )
+            print("Prefilter kept %d of %d candidates" % (len(songs), n_songs))
+        settings = {
+            "base_song": os.path.basename(base_song),
+            "analysis_sr": analysis_sr,
+            "tempo_preset": tempo_preset,
+        }
+        log = None
+        if checkpoint or resume:
+            log = ScanLog(checkpoint_path(base_song), settings, resume=resume)
+        # Tempos and keys of the analysed candidates are kept, even if interrupted
+        try:
+            if workers is not None:
+                from .pipeline import scan_library
+
+                songs, scores, tracks = scan_library(
+                    base_features,
+                    songs,
+                    k=top_k,
+                    checkpoint=log,
+                    retry_failed=retry_failed,
+                    analysis_sr=analysis_sr,
+                    tempo_preset=tempo_preset,
+                    n_workers=workers,
+                    metadata=metadata,
                 )
-                valid_songs.append(cand_song)
-            except ShorterException as e:
-                print("Skipping song %s, because %s" % (cand_song, str(e)))
-        # Sort all songs according to their mashabilities
-        valid_songs.sort(key=lambda x: mashabilities[x][0], reverse=True)
-        top_10 = valid_songs
+            else:
+                # Tunings and beats of the analysed candidates, for the mixes
+                tracks = unknown_tracks(len(songs))
+                scores = score_candidates(
+                    base_features,
+                    songs,
+                    analysis_sr=analysis_sr,
+                    tempo_preset=tempo_preset,
+                    checkpoint=log,
+                    retry_failed=retry_failed,
+                    metadata=metadata,
+                    tracks=tracks,
+                )
+        finally:
+            if log is not None:
+                log.close()
+            if metadata is not None:
+                metadata.save()
 
         # Write the results of the mashabilities in a csv with the same name as the main loop
-        with open(base_song.split("/")[-1].replace(".mp3", ".csv"), "w") as csvfile:
-            csvfile.write("file,mashability,pitch_shift,beat_offset,h_contr,r_contr\n")
-            for cand_song in top_10:
-                out_file = "out_loops/%s" % (cand_song.split("/")[-1])
-                csvfile.write(
-                    "%s,%s,%s,%s,%s,%s\n"
-                    % (
-                        out_file,
-                        mashabilities[cand_song][0],
-                        mashabilities[cand_song][1],
-                        mashabilities[cand_song][2],
-                        mashabilities[cand_song][3],
-                        mashabilities[cand_song][4],
-                    )
-                )
+        write_mashability_results(base_song, songs, scores, tracks)
+
+
+def main_many(
+    base_songs, songs=None, analysis_sr=None, tempo_preset="accurate", output=None
+):
+    """
+    Calculate the mashabilities of many base songs against the same library in one
+    pass. Each candidate is analysed once and scored against every base
+    :param base_songs: The paths to the base songs
+    :param songs: The paths to the candidates, the mp3 files next to the base songs
+    if None
+    :param analysis_sr: Lower sample rate for the chroma and tempo analysis, e.g. 22050
+    :param tempo_preset: "accurate" or "fast" tempo estimation
+    :param output: Path of a .npz file receiving the whole result matrix. Without
+    it the results of each base song are written as main does
+    :return: A SCORE_DTYPE array of shape (n_bases, n_candidates)
+    """
+    base_features = [
+        extract_features(base_song, analysis_sr=analysis_sr, tempo_preset=tempo_preset)
+        for base_song in base_songs
+    ]
+    if songs is None:
+        folders = dict.fromkeys(base_song.split("/")[0] for base_song in base_songs)
+        songs = [song for folder in folders for song in glob.glob("%s/*.mp3" % folder)]
+    scores = np.zeros((len(base_songs), len(songs)), dtype=SCORE_DTYPE)
+    scores["mashability"] = np.nan
+    tracks = unknown_tracks(len(songs))
+    for j, cand_song in enumerate(songs):
+        try:
+            cand_features = candidate_features(
+                cand_song, analysis_sr=analysis_sr, tempo_preset=tempo_preset
+            )
+        except ShorterException as e:
+            print("Skipping song %s, because %s" % (cand_song, str(e)))
+            continue
+        tracks[j] = track_row(cand_features)
+        scores[:, j] = score_many(base_features, cand_features)
+
+    if output is not None:
+        np.savez(
+            output,
+            bases=np.array(base_songs),
+            candidates=np.array(songs),
+            scores=scores,
+        )
+    else:
+        for base_song, base_scores in zip(base_songs, scores):
+            write_mashability_results(base_song, songs, base_scores, tracks)
+    return scores
 
 
-def write_songs_mash(base_song):
-    # Read the mashabilities results and create the mixes
+def write_songs_mash(base_song, mono=True):
+    # Read the mashabilities results and create the mixes, stereo ones unless mono
     results_dir = "results/mash/%s" % base_song.split("/")[-1].replace(".mp3", "")
     if not os.path.isdir(results_dir):
         try:
@@ -181,29 +711,37 @@ def write_songs_mash(base_song):
             pass
 
         os.mkdir(results_dir)
-    with open(base_song.split("/")[-1].replace(".mp3", ".csv"), "r") as csvfile:
-        csv_reader = csv.DictReader(csvfile)
-        i = 0
-        for row in csv_reader:
-            cand_song = row["file"]
-            pitch_shift = int(row["pitch_shift"])
-            beat_offset = int(row["beat_offset"])
-            mix = mix_songs(base_song, cand_song, beat_offset, pitch_shift)
-            out_file = "%s/%s_MIXED_%s" % (
-                results_dir,
-                row["mashability"],
-                cand_song.split("/")[-1].replace(".mp3", ".wav"),
-            )
-            # Copy the original candidate to the results folder
-            original_cand_copy = "%s/ORIGINAL_%s" % (
-                results_dir,
-                cand_song.split("/")[-1],
-            )
-            shutil.copyfile(cand_song, original_cand_copy)
-            write_wav(out_file, mix, 44100)
-            i += 1
-            if i == 150:
-                break
+    from soundfile import write as write_wav
+
+    rows = read_top_candidates(base_song, 150)
+    # With the tuning and beats found by the scan, only the beats of each candidate
+    # that go over the base are decoded, and neither is estimated again
+    candidates = (
+        (
+            row["file"],
+            int(row["beat_offset"]),
+            int(row["pitch_shift"]),
+            row.get("tuning"),
+            row.get("beats"),
+        )
+        for row in rows
+    )
+    # The base is normalized once and every mix reuses the same buffer
+    for row, mix in zip(rows, iter_mixes(base_song, candidates, mono=mono)):
+        cand_song = row["file"]
+        out_file = "%s/%s_MIXED_%s" % (
+            results_dir,
+            row["mashability"],
+            cand_song.split("/")[-1].replace(".mp3", ".wav"),
+        )
+        # Copy the original candidate to the results folder
+        original_cand_copy = "%s/ORIGINAL_%s" % (
+            results_dir,
+            cand_song.split("/")[-1],
+        )
+        shutil.copyfile(cand_song, original_cand_copy)
+        # soundfile takes the channels last
+        write_wav(out_file, mix.T, 44100)
 
 
 if __name__ == "__main__":
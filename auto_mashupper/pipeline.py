@@ -0,0 +1,327 @@
+"""
+Streaming scan of a library against one base song.
+
+    discover -> decode -> analyse and score -> top-K sink
+     (lazy)    (threads)    (processes)         (heap)
+
+Candidates are listed lazily, decoded ahead by I/O threads while worker processes
+analyse and score the previous ones, and only the k best scores are kept. The
+stages are connected by bounded queues: at most `prefetch` decoded signals wait
+for a worker and at most two jobs per worker are in flight, so the memory of a
+scan does not grow with the size of the library.
+"""
+
+import glob
+import heapq
+import os
+import queue
+import threading
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from .context import AnalysisContext
+from .mashability import (
+    SCORE_DTYPE,
+    ShorterException,
+    candidate_features,
+    score_features,
+)
+from .prefilter import features_metadata
+from .results import track_row, unknown_tracks
+from .segmentation import load_mono
+from .threads import set_threads, threads_per_worker
+
+# Marks the end of the songs of one decoding thread
+_DONE = object()
+
+
+def discover_songs(base_song):
+    """
+    The candidates of a base song, listed as they are found
+    :param base_song: The path to the base song
+    :return: An iterator over the paths of the mp3 files next to the base song
+    """
+    return glob.iglob("%s/*.mp3" % base_song.split("/")[0])
+
+
+class TopK:
+    """
+    The best scores of a scan
+    :param k: Number of candidates kept, all of them if None
+    """
+
+    def __init__(self, k=None):
+        self.k = k
+        # (mashability, -order, song, row, track), the worst kept candidate first
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, order, song, row, track=None):
+        """
+        :param order: The discovery order of the candidate, ties keep the first one
+        :param song: The path to the candidate
+        :param row: Its SCORE_DTYPE row, left out if the mashability is NaN
+        :param track: Its TRACK_DTYPE row if known, only kept with the candidate
+        """
+        if np.isnan(row[0]):
+            return
+        track = None if track is None else tuple(track)
+        item = (float(row[0]), -order, song, tuple(row), track)
+        with self._lock:
+            if self.k is None or len(self._heap) < self.k:
+                heapq.heappush(self._heap, item)
+            elif item > self._heap[0]:
+                heapq.heapreplace(self._heap, item)
+
+    def results(self):
+        """
+        :return: (songs, SCORE_DTYPE array, TRACK_DTYPE array), best first
+        """
+        items = sorted(self._heap, reverse=True)
+        scores = np.array([item[3] for item in items], dtype=SCORE_DTYPE)
+        tracks = unknown_tracks(len(items))
+        for i, item in enumerate(items):
+            if item[4] is not None:
+                tracks[i] = item[4]
+        return [item[2] for item in items], scores, tracks
+
+
+def _put(decoded, item, stop):
+    # Give up when the consumer has stopped reading
+    while not stop.is_set():
+        try:
+            decoded.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def iter_decoded(songs, sr=44100, n_threads=2, prefetch=4):
+    """
+    Decode songs ahead of their use, in I/O threads
+    :param songs: An iterable of (order, path), read by the threads as they need
+    :param sr: The sample rate to load the songs at
+    :param n_threads: Number of decoding threads
+    :param prefetch: Number of decoded signals waiting to be used
+    :return: A generator of (order, path, mono signal or None, reason it is None),
+    in the order they are decoded
+    """
+    decoded = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    listing = iter(songs)
+    lock = threading.Lock()
+
+    def decode():
+        # No cache, the signal is handed over and never decoded again
+        context = AnalysisContext(cache_size=0)
+        try:
+            while not stop.is_set():
+                with lock:
+                    item = next(listing, None)
+                if item is None:
+                    break
+                order, song = item
+                try:
+                    y, reason = load_mono(song, sr, context), None
+                except Exception:
+                    y, reason = None, "EOF error"
+                _put(decoded, (order, song, y, reason), stop)
+        except BaseException as e:
+            _put(decoded, e, stop)
+        _put(decoded, _DONE, stop)
+
+    decoders = [threading.Thread(target=decode, daemon=True) for _ in range(n_threads)]
+    for decoder in decoders:
+        decoder.start()
+    try:
+        running = n_threads
+        while running:
+            item = decoded.get()
+            if item is _DONE:
+                running -= 1
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                yield item
+    finally:
+        stop.set()
+        for decoder in decoders:
+            decoder.join()
+
+
+def _score_signal(base_features, y, sr, analysis_sr, tempo_preset):
+    """
+    Analyse a decoded candidate and score it, in a worker process
+    :return: (SCORE_DTYPE row as a tuple or None, reason it is None, (tempo, key),
+    TRACK_DTYPE row as a tuple)
+    """
+    cand_features = candidate_features(
+        y, sr=sr, analysis_sr=analysis_sr, tempo_preset=tempo_preset
+    )
+    metadata = features_metadata(cand_features)
+    track = track_row(cand_features)
+    try:
+        row = score_features(base_features, cand_features)
+    except ShorterException as e:
+        return None, str(e), metadata, track
+    return np.array(tuple(row), dtype=SCORE_DTYPE).tolist(), None, metadata, track
+
+
+def worker_context():
+    """
+    The multiprocessing context of the worker processes. Forked while the decoding
+    threads run, workers could inherit locks held by them, so they are started by
+    a fork server, or spawned where there is none, e.g. on Windows
+    :return: A multiprocessing context
+    """
+    import multiprocessing
+
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def _completed(in_flight, return_when):
+    done, _ = wait(in_flight, return_when=return_when)
+    for future in sorted(done, key=lambda future: in_flight[future][0]):
+        order, song = in_flight.pop(future)
+        try:
+            result = future.result()
+        except ShorterException as e:
+            yield order, song, None, str(e), None, None
+        else:
+            yield (order, song) + result
+
+
+def stream_scores(
+    base_features,
+    songs,
+    sr=44100,
+    analysis_sr=None,
+    tempo_preset="accurate",
+    n_workers=None,
+    n_io_threads=2,
+    prefetch=None,
+    executor=None,
+):
+    """
+    Score candidates as they are decoded
+    :param base_features: The TrackFeatures of the base song
+    :param songs: An iterable of (order, path) of the candidates
+    :param sr: The sample rate to load the candidates at
+    :param analysis_sr: Lower sample rate for the chroma and tempo analysis
+    :param tempo_preset: "accurate" or "fast" tempo estimation
+    :param n_workers: Number of worker processes, one per core if None
+    :param n_io_threads: Number of decoding threads
+    :param prefetch: Number of decoded candidates waiting for a worker, two per
+    worker if None
+    :param executor: An executor running the analyses, a process pool of
+    n_workers if None. It is not shut down
+    :return: A generator of (order, path, SCORE_DTYPE row as a tuple or None,
+    reason the candidate was skipped, (tempo, key) and TRACK_DTYPE row of the
+    analysed candidates)
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    prefetch = prefetch or 2 * n_workers
+    pool = None
+    if executor is None:
+        from concurrent.futures import ProcessPoolExecutor
+
+        pool = executor = ProcessPoolExecutor(
+            n_workers,
+            mp_context=worker_context(),
+            initializer=set_threads,
+            initargs=(threads_per_worker(n_workers),),
+        )
+    # Computed once, the rotations travel with the features to the workers
+    base_features.chroma_rotations
+    in_flight = {}
+    try:
+        for order, song, y, reason in iter_decoded(
+            songs, sr=sr, n_threads=n_io_threads, prefetch=prefetch
+        ):
+            if y is None:
+                yield order, song, None, reason, None, None
+                continue
+            future = executor.submit(
+                _score_signal, base_features, y, sr, analysis_sr, tempo_preset
+            )
+            in_flight[future] = (order, song)
+            del y
+            if len(in_flight) >= 2 * n_workers:
+                yield from _completed(in_flight, FIRST_COMPLETED)
+        while in_flight:
+            yield from _completed(in_flight, ALL_COMPLETED)
+    finally:
+        for future in in_flight:
+            future.cancel()
+        if pool is not None:
+            pool.shutdown()
+
+
+def scan_library(
+    base_features,
+    songs,
+    k=None,
+    checkpoint=None,
+    retry_failed=False,
+    metadata=None,
+    **options,
+):
+    """
+    Calculate the mashability of a stream of candidates with one base song, keeping
+    the best ones only
+    :param base_features: The TrackFeatures of the base song
+    :param songs: An iterable of the paths to the candidates, e.g. discover_songs
+    :param k: Number of candidates kept, all of them if None
+    :param checkpoint: A checkpoint.ScanLog. The candidates it holds are not scored
+    again, and the others are appended to it
+    :param retry_failed: Score again the candidates the checkpoint records as
+    skipped
+    :param metadata: A prefilter.MetadataCache receiving the tempo and key of the
+    analysed candidates
+    :param options: The stage options of stream_scores
+    :return: (songs, SCORE_DTYPE array, TRACK_DTYPE array) of the k best
+    candidates, best first
+    """
+    sink = TopK(k)
+    # Listed by the decoding threads, the sink is only fed by this one
+    resumed = queue.SimpleQueue()
+
+    def pending():
+        for order, song in enumerate(songs):
+            if checkpoint is not None:
+                if song in checkpoint.scores:
+                    resumed.put((order, song))
+                    continue
+                if song in checkpoint.errors and not retry_failed:
+                    continue
+            yield order, song
+
+    def push_resumed():
+        while True:
+            try:
+                order, song = resumed.get_nowait()
+            except queue.Empty:
+                return
+            sink.push(order, song, checkpoint.scores[song], checkpoint.tracks.get(song))
+
+    results = stream_scores(base_features, pending(), **options)
+    for order, song, row, reason, track_metadata, track in results:
+        push_resumed()
+        if metadata is not None and track_metadata is not None:
+            metadata.put(song, *track_metadata)
+        if row is None:
+            print("Skipping song %s, because %s" % (song, reason))
+            if checkpoint is not None:
+                checkpoint.record_error(song, reason)
+            continue
+        if checkpoint is not None:
+            checkpoint.record(song, row, track)
+        sink.push(order, song, row, track)
+    push_resumed()
+    return sink.results()
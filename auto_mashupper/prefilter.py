@@ -0,0 +1,319 @@
+"""
+Tempo and key prefilter of library scans.
+
+The tempo and key of each track are kept in a metadata cache, an .npz file with
+one entry per track path, invalidated when the file changes. The cache is filled
+from the TrackFeatures the scans compute anyway, so no track is analysed twice:
+candidates missing from it are scored, and filtered out by later scans. The
+cached tracks are sorted by key then tempo in a TrackIndex, built once per cache
+and kept up to date with the tracks put since, so keeping the candidates
+compatible with a base is a few binary searches instead of a pass over the
+library. Only the cache entries of the matched tracks are read, and an edited
+track is analysed again when its cached tempo and key match:
+    tempo: within a tolerance of the base tempo, or of half or double of it
+    key: a shift of at most max_key_shift semitones brings the candidate to the
+    key of the base, its relative, or a fifth above or below
+
+The tempo is the one of the features and the key comes from the Krumhansl-Kessler
+profiles correlated with the average beat synchronous chroma of the track.
+"""
+
+import json
+import os
+
+import numpy as np
+
+# Default tolerance on the tempo ratio, after half/double time folding
+TEMPO_TOLERANCE = 0.08
+
+# Krumhansl-Kessler key profiles, from the tonic up
+MAJOR_PROFILE = np.array(
+    [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
+)
+MINOR_PROFILE = np.array(
+    [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
+)
+
+# Keys are coded as the tonic pitch class, plus 12 for minor keys
+N_KEYS = 24
+
+
+def key_profiles():
+    """
+    :return: The profiles of the 24 keys, shape (24, 12), row k is key k
+    """
+    pitch_classes = np.arange(12)
+    rotations = (pitch_classes[None, :] - pitch_classes[:, None]) % 12
+    return np.vstack([MAJOR_PROFILE[rotations], MINOR_PROFILE[rotations]])
+
+
+def estimate_key(chroma_summary):
+    """
+    The key best matching the average chroma of a track
+    :param chroma_summary: The chroma averaged over the track, 12 values from C
+    :return: The key code, tonic pitch class plus 12 for minor keys
+    """
+    profiles = key_profiles()
+    profiles = profiles - profiles.mean(axis=1, keepdims=True)
+    summary = np.asarray(chroma_summary, dtype=np.float64)
+    summary = summary - summary.mean()
+    correlations = (
+        profiles
+        @ summary
+        / (np.linalg.norm(profiles, axis=1) * np.linalg.norm(summary) + 1e-12)
+    )
+    return int(np.argmax(correlations))
+
+
+def compatible_keys(key, max_key_shift=0):
+    """
+    The keys of the candidates that mix with a base key
+    :param key: The key code of the base
+    :param max_key_shift: Semitones the candidates can be pitch shifted by
+    :return: A sorted list of key codes
+    """
+    tonic, minor = key % 12, key // 12
+    # Relative minor or major, then the fifths above and below in the same mode
+    relative = (tonic + 3) % 12 if minor else (tonic + 9) % 12 + 12
+    targets = [
+        key,
+        relative,
+        (tonic + 7) % 12 + 12 * minor,
+        (tonic + 5) % 12 + 12 * minor,
+    ]
+    shifts = range(-max_key_shift, max_key_shift + 1)
+    return sorted(
+        {
+            (target % 12 + shift) % 12 + 12 * (target // 12)
+            for target in targets
+            for shift in shifts
+        }
+    )
+
+
+def tempo_ranges(tempo, tempo_tolerance=TEMPO_TOLERANCE):
+    """
+    The tempo ranges of the candidates that mix with a base tempo
+    :param tempo: The tempo of the base in bpm
+    :param tempo_tolerance: Tolerance on the tempo ratio, None for any tempo
+    :return: A list of (lowest, highest) bpm, at half, same and double time
+    """
+    if tempo_tolerance is None:
+        return [(-np.inf, np.inf)]
+    return [
+        (factor * tempo * (1 - tempo_tolerance), factor * tempo * (1 + tempo_tolerance))
+        for factor in (0.5, 1, 2)
+    ]
+
+
+class TrackIndex:
+    """
+    Tracks sorted by key then tempo
+    :param songs: The paths to the tracks
+    :param tempos: Their tempo in bpm
+    :param keys: Their key code
+    """
+
+    def __init__(self, songs, tempos, keys):
+        tempos = np.asarray(tempos, dtype=np.float64)
+        keys = np.asarray(keys, dtype=np.int8)
+        order = np.lexsort((tempos, keys))
+        self.songs = [songs[i] for i in order]
+        self.tempos = tempos[order]
+        self.keys = keys[order]
+        # Rows of key k are key_starts[k]:key_starts[k + 1]
+        self.key_starts = np.searchsorted(self.keys, np.arange(N_KEYS + 1))
+
+    def __len__(self):
+        return len(self.songs)
+
+    def query(
+        self, tempo, key=None, tempo_tolerance=TEMPO_TOLERANCE, max_key_shift=None
+    ):
+        """
+        The tracks compatible with a base
+        :param tempo: The tempo of the base in bpm
+        :param key: The key code of the base
+        :param tempo_tolerance: Tolerance on the tempo ratio, after half/double
+        time folding. None for any tempo
+        :param max_key_shift: Semitones the candidates can be pitch shifted by to
+        reach a key compatible with the base. None for any key
+        :return: The paths of the compatible tracks, sorted by key then tempo
+        """
+        if key is None or max_key_shift is None:
+            keys = range(N_KEYS)
+        else:
+            keys = compatible_keys(key, max_key_shift)
+        ranges = tempo_ranges(tempo, tempo_tolerance)
+        rows = []
+        for k in keys:
+            start, end = self.key_starts[k], self.key_starts[k + 1]
+            tempos = self.tempos[start:end]
+            for low, high in ranges:
+                rows.append(
+                    np.arange(
+                        start + np.searchsorted(tempos, low, side="left"),
+                        start + np.searchsorted(tempos, high, side="right"),
+                    )
+                )
+        # Folded ranges overlap for large tolerances
+        rows = np.unique(np.concatenate(rows))
+        return [self.songs[i] for i in rows]
+
+
+def metadata_path(base_song):
+    """
+    Path of the metadata cache of the library of a base song
+    :param base_song: The path to the base song
+    :return: The path of the cache, named after the library folder
+    """
+    return base_song.split("/")[0] + ".metadata.npz"
+
+
+def features_metadata(features):
+    """
+    The tempo and key of a track, from its features
+    :param features: The TrackFeatures of the track
+    :return: (tempo, key code)
+    """
+    return float(features.tempo), estimate_key(np.mean(features.chroma, axis=1))
+
+
+class MetadataCache:
+    """
+    Tempo and key of tracks, kept on disk between scans
+    :param path: The path of the .npz cache
+    :param settings: A dict of the analysis settings, a cache written with other
+    settings is discarded
+    """
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = settings
+        # Path: (mtime_ns, size, tempo, key)
+        self._entries = {}
+        # TrackIndex of the entries, built by the first query
+        self._index = None
+        # Tracks put since the index was built, looked up apart from it
+        self._changed = set()
+        if os.path.exists(path):
+            with np.load(path) as cache:
+                if json.loads(str(cache["settings"])) == settings:
+                    columns = ("songs", "mtime_ns", "size", "tempo", "key")
+                    for song, *entry in zip(
+                        *(cache[name].tolist() for name in columns)
+                    ):
+                        self._entries[song] = tuple(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, song):
+        return song in self._entries
+
+    def get(self, song):
+        """
+        :param song: The path to a track
+        :return: Its (tempo, key code), None if it is not cached or has changed
+        """
+        entry = self._entries.get(song)
+        if entry is None:
+            return None
+        stat = os.stat(song)
+        if entry[:2] != (stat.st_mtime_ns, stat.st_size):
+            return None
+        return entry[2:]
+
+    def put(self, song, tempo, key):
+        stat = os.stat(song)
+        self._entries[song] = (stat.st_mtime_ns, stat.st_size, tempo, key)
+        if self._index is not None:
+            self._changed.add(song)
+
+    def index(self, songs):
+        """
+        :param songs: The paths to some cached tracks
+        :return: A TrackIndex of them
+        """
+        entries = [self._entries[song] for song in songs]
+        return TrackIndex(
+            list(songs),
+            [entry[2] for entry in entries],
+            [entry[3] for entry in entries],
+        )
+
+    def query(
+        self, tempo, key=None, tempo_tolerance=TEMPO_TOLERANCE, max_key_shift=None
+    ):
+        """
+        The cached tracks compatible with a base, see TrackIndex.query. The files
+        are not checked, the tracks are matched on the tempo and key they had
+        when they were put
+        :return: The paths of the compatible tracks
+        """
+        # Rebuilt once the tracks put since are a good part of the library
+        if self._index is None or 4 * len(self._changed) > len(self._index):
+            self._index = self.index(self._entries)
+            self._changed = set()
+        options = dict(tempo_tolerance=tempo_tolerance, max_key_shift=max_key_shift)
+        matched = [
+            song
+            for song in self._index.query(tempo, key, **options)
+            if song not in self._changed
+        ]
+        if self._changed:
+            matched += self.index(self._changed).query(tempo, key, **options)
+        return matched
+
+    def save(self):
+        """Write the cache, readers see either the old one or the new one"""
+        entries = list(self._entries.values())
+        columns = {
+            name: np.array([entry[i] for entry in entries], dtype=dtype)
+            for i, (name, dtype) in enumerate(
+                [
+                    ("mtime_ns", np.int64),
+                    ("size", np.int64),
+                    ("tempo", np.float64),
+                    ("key", np.int8),
+                ]
+            )
+        }
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                settings=json.dumps(self.settings),
+                songs=np.array(list(self._entries), dtype=str),
+                **columns,
+            )
+        os.replace(tmp_path, self.path)
+
+
+def compatible_songs(
+    base_features,
+    songs,
+    cache,
+    tempo_tolerance=TEMPO_TOLERANCE,
+    max_key_shift=None,
+):
+    """
+    The candidates whose tempo and key are compatible with a base song
+    :param base_features: The TrackFeatures of the base song
+    :param songs: The paths to the candidates
+    :param cache: The MetadataCache of the library
+    :param tempo_tolerance: Tolerance on the tempo ratio, after half/double time
+    folding. None for any tempo
+    :param max_key_shift: Semitones the candidates can be pitch shifted by to
+    reach a key compatible with the base. None for any key
+    :return: The compatible candidates, in the order of songs. Candidates missing
+    from the cache are kept, so the scan analyses them and fills the cache
+    """
+    tempo, key = features_metadata(base_features)
+    # Matched tracks that changed since are kept too, the scan analyses them again
+    kept = set(
+        cache.query(
+            tempo, key, tempo_tolerance=tempo_tolerance, max_key_shift=max_key_shift
+        )
+    )
+    return [song for song in songs if song in kept or song not in cache]
@@ -0,0 +1,237 @@
+"""
+Columnar binary store for mashability results.
+
+The results of a base song are kept in a directory next to its csv, with one
+.npy file per column:
+    mashability.npy, pitch_shift.npy, beat_offset.npy, h_contr.npy, r_contr.npy
+    file_offsets.npy, files.bin: the candidate paths as UTF-8 bytes, row i is
+    files.bin[file_offsets[i]:file_offsets[i + 1]]
+    tuning.npy, first_beat.npy, beat_period.npy, n_beats.npy: optional, the
+    tuning and the regular beat grid of the candidates found by the scan
+
+Rows are ranked by mashability. Columns are memory mapped on read, so a top-K
+or a filter only touches the columns it uses and the paths it returns, instead
+of parsing the whole csv.
+"""
+
+import csv
+import itertools
+import os
+
+import numpy as np
+
+RESULT_SUFFIX = ".scores"
+
+# Same columns and dtypes as mashability.SCORE_DTYPE, without importing the
+# analysis stack to read results
+COLUMNS = ("mashability", "pitch_shift", "beat_offset", "h_contr", "r_contr")
+
+# What the scan found about each candidate, so the mixes neither estimate its
+# tempo and tuning again nor decode more of it than the beats they use. The beat
+# grids of the analysis are regular, first_beat + beat_period * np.arange(n_beats)
+TRACK_DTYPE = np.dtype(
+    [
+        ("tuning", np.float32),
+        ("first_beat", np.float64),
+        ("beat_period", np.float64),
+        ("n_beats", np.int32),
+    ]
+)
+TRACK_COLUMNS = TRACK_DTYPE.names
+
+
+def track_row(features):
+    """
+    :param features: The TrackFeatures of a candidate
+    :return: Its TRACK_DTYPE row, as a tuple
+    """
+    beats = np.asarray(features.beats, dtype=np.float64)
+    first_beat = float(beats[0]) if len(beats) else 0.0
+    beat_period = 0.0
+    if len(beats) > 1:
+        beat_period = float(beats[-1] - beats[0]) / (len(beats) - 1)
+    return (float(features.tuning), first_beat, beat_period, len(beats))
+
+
+def unknown_tracks(n):
+    """
+    :param n: The number of candidates
+    :return: A TRACK_DTYPE array of n candidates with no tuning nor beats
+    """
+    tracks = np.zeros(n, dtype=TRACK_DTYPE)
+    tracks["tuning"] = np.nan
+    return tracks
+
+
+def results_path(base_song):
+    """
+    Path of the result store of a base song, next to the csv of mashability.main
+    :param base_song: The path to the base song
+    :return: The path of the result directory
+    """
+    return base_song.split("/")[-1].replace(".mp3", "") + RESULT_SUFFIX
+
+
+def write_results(path, files, scores, tracks=None):
+    """
+    Rank results by mashability and write them as one .npy file per column
+    :param path: The result directory, created if needed
+    :param files: The candidate path of each row
+    :param scores: A structured array with the COLUMNS fields, one row per file.
+    Rows with a NaN mashability are left out
+    :param tracks: A TRACK_DTYPE array with one row per file, or None if the
+    tunings and beats of the candidates are unknown
+    """
+    valid = np.flatnonzero(~np.isnan(scores["mashability"]))
+    # Stable, so equally mashable candidates keep their discovery order
+    ranked = valid[np.argsort(-scores["mashability"][valid], kind="stable")]
+    scores = scores[ranked]
+    files = [files[i] for i in ranked]
+    os.makedirs(path, exist_ok=True)
+    for name in COLUMNS:
+        np.save(os.path.join(path, name + ".npy"), np.ascontiguousarray(scores[name]))
+    for name in TRACK_COLUMNS:
+        track_path = os.path.join(path, name + ".npy")
+        if tracks is not None:
+            np.save(track_path, np.ascontiguousarray(tracks[name][ranked]))
+        elif os.path.exists(track_path):
+            # Left by a previous scan, the rows are not the same anymore
+            os.remove(track_path)
+    encoded = [f.encode("utf-8") for f in files]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(f) for f in encoded], out=offsets[1:])
+    np.save(os.path.join(path, "file_offsets.npy"), offsets)
+    with open(os.path.join(path, "files.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+
+
+class ResultReader:
+    """
+    Lazy reader of a result directory written by write_results
+    :param path: The result directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._columns = {}
+        self._offsets = np.load(os.path.join(path, "file_offsets.npy"), mmap_mode="r")
+        self.has_tracks = os.path.exists(os.path.join(path, "tuning.npy"))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def column(self, name):
+        """
+        A memory mapped column
+        :param name: One of COLUMNS, or of TRACK_COLUMNS if has_tracks
+        :return: The column, as a read-only array
+        """
+        names = COLUMNS + TRACK_COLUMNS if self.has_tracks else COLUMNS
+        if name not in names:
+            raise KeyError("Unknown column %s, use one of %s" % (name, names))
+        if name not in self._columns:
+            self._columns[name] = np.load(
+                os.path.join(self.path, name + ".npy"), mmap_mode="r"
+            )
+        return self._columns[name]
+
+    def files(self, rows):
+        """
+        The candidate paths of some rows, only those bytes are read
+        :param rows: The row indices
+        :return: A list of paths
+        """
+        paths = []
+        with open(os.path.join(self.path, "files.bin"), "rb") as f:
+            for row in rows:
+                start, end = self._offsets[row], self._offsets[row + 1]
+                f.seek(start)
+                paths.append(f.read(end - start).decode("utf-8"))
+        return paths
+
+    def select(self, min_mashability=None, pitch_shifts=None, max_abs_pitch=None):
+        """
+        Rows matching some filters, in ranking order
+        :param min_mashability: Keep the rows with at least this mashability
+        :param pitch_shifts: Keep the rows with one of these pitch shifts
+        :param max_abs_pitch: Keep the rows shifted by at most this many semitones
+        :return: The row indices
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if min_mashability is not None:
+            mask &= self.column("mashability") >= min_mashability
+        if pitch_shifts is not None:
+            mask &= np.isin(self.column("pitch_shift"), pitch_shifts)
+        if max_abs_pitch is not None:
+            mask &= np.abs(self.column("pitch_shift")) <= max_abs_pitch
+        return np.flatnonzero(mask)
+
+    def top_k(self, k, **filters):
+        """
+        The k most mashable rows matching the filters of select
+        :param k: The number of rows
+        :param filters: Keyword arguments of select
+        :return: A list of dicts with a "file" key and one key per column, like
+        the rows of the csv
+        """
+        # Rows are stored ranked, the first matching rows are the best ones
+        if filters:
+            rows = self.select(**filters)[:k]
+        else:
+            rows = np.arange(min(k, len(self)))
+        return self.rows(rows)
+
+    def rows(self, rows):
+        """
+        Materialise some rows
+        :param rows: The row indices
+        :return: A list of dicts with a "file" key and one numpy scalar per column.
+        If has_tracks, a "tuning" and the "beats" times of the candidate in seconds
+        are added, None for the candidates whose tuning is unknown
+        """
+        values = [self.column(name)[rows] for name in COLUMNS]
+        result = [
+            dict(zip(("file",) + COLUMNS, row))
+            for row in zip(self.files(rows), *values)
+        ]
+        if self.has_tracks:
+            tracks = [self.column(name)[rows] for name in TRACK_COLUMNS]
+            for row, (tuning, first_beat, beat_period, n_beats) in zip(
+                result, zip(*tracks)
+            ):
+                known = not np.isnan(tuning)
+                row["tuning"] = float(tuning) if known else None
+                row["beats"] = (
+                    first_beat + beat_period * np.arange(n_beats) if known else None
+                )
+        return result
+
+    def to_csv(self, csv_path, chunk=65536):
+        """
+        Export the results to a csv with the columns written by mashability.main
+        :param csv_path: The path of the csv
+        :param chunk: Number of rows read at once
+        """
+        with open(csv_path, "w") as csvfile:
+            csvfile.write(",".join(("file",) + COLUMNS) + "\n")
+            for start in range(0, len(self), chunk):
+                rows = np.arange(start, min(start + chunk, len(self)))
+                values = [self.column(name)[rows] for name in COLUMNS]
+                for row in zip(self.files(rows), *values):
+                    csvfile.write("%s,%s,%s,%s,%s,%s\n" % row)
+
+
+def read_top_candidates(base_song, k):
+    """
+    The k most mashable candidates of a base song, from its result store if it
+    exists or else from its csv
+    :param base_song: The path to the base song
+    :param k: The number of candidates
+    :return: A list of dicts with the file, pitch_shift, beat_offset... of each
+    candidate, see ResultReader.rows. Values read from the csv are strings
+    """
+    path = results_path(base_song)
+    if os.path.isdir(path):
+        return ResultReader(path).top_k(k)
+    with open(base_song.split("/")[-1].replace(".mp3", ".csv"), "r") as csvfile:
+        return list(itertools.islice(csv.DictReader(csvfile), k))
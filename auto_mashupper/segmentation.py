@@ -1,18 +1,45 @@
 import sys
 
-import essentia.standard as std
-import matplotlib.pyplot as plt
 import numpy as np
-import scipy.stats as st
+import scipy.fft
 from librosa import core, feature
-from madmom.features.downbeats import DBNDownBeatTrackingProcessor as downbeattrack
-from madmom.features.downbeats import RNNDownBeatProcessor as beatrnn
-from scipy.spatial.distance import cdist
 
+# essentia, madmom, matplotlib and scipy.stats are imported where they are used,
+# so importing this module for the beat synchronous features stays cheap
+from . import threads
+from .chroma import N_FFT, ChromaEngine
+from .context import analysis_context, default_context
 from .utilities import self_tempo_estimation
 
 eps = np.finfo(float).eps
 
+# Every beat synchronous feature is handed around in this dtype
+FEATURE_DTYPE = np.float32
+
+# Sample rates essentia's EqualLoudness filter is defined for
+EQUAL_LOUDNESS_RATES = (8000, 16000, 32000, 44100, 48000)
+
+
+def as_feature_array(x):
+    """
+    Cast a feature array to FEATURE_DTYPE, without copying if it already is
+    :param x: The feature array
+    :return: The feature array as FEATURE_DTYPE
+    """
+    return np.asarray(x, dtype=FEATURE_DTYPE)
+
+
+def chroma_rotations(chroma):
+    """
+    The 12 pitch rotations of a beat synchronous chroma
+    :param chroma: The beat synchronous chroma, shape (12, n_beats)
+    :return: Array of shape (12, 12, n_beats), rotation p is the chroma
+    transposed p semitones up
+    """
+    chroma = as_feature_array(chroma)
+    pitch_classes = np.arange(12)
+    return chroma[(pitch_classes[None, :] - pitch_classes[:, None]) % 12]
+
 
 def hz_to_pitch(hz_spectrums, sr):
     """
@@ -28,40 +55,176 @@ def hz_to_pitch(hz_spectrums, sr):
             int(12 * np.log2(int(sr / 2) / 440)) + 57
         )  # sr/2 is the maximum
         for freq in range(1, len(hz_spectrum)):
-            pitch_spectrum[int(12 * np.log2(freq_scale[freq] + eps / 440)) + 57] += (
-                hz_spectrum[freq]
-            )
+            pitch_spectrum[
+                int(12 * np.log2(freq_scale[freq] + eps / 440)) + 57
+            ] += hz_spectrum[freq]
         pitch_spectrums.append(pitch_spectrum / max(pitch_spectrum))
     return np.array(pitch_spectrums).transpose()
 
 
-def get_beat_sync_chroma_and_spectrum(audio, sr=None, bpm=None):
+def load_mono(audio, sr=44100, context=None):
+    """
+    Load a song as a mono float32 signal
+    :param audio: Path to the song, or numpy array
+    :param sr: The sample rate to load the song at
+    :param context: The AnalysisContext caching the decoded signal
+    :return: The mono signal
+    """
+    if not isinstance(audio, np.ndarray):
+        import essentia.standard as std
+
+        context = context or default_context()
+        return context.cached(
+            audio,
+            ("mono", sr),
+            lambda: std.MonoLoader(filename=audio, sampleRate=sr)(),  # type: ignore
+        )
+    return np.asarray(audio, dtype=np.float32)
+
+
+def to_analysis_rate(y, sr, analysis_sr=None):
+    """
+    Resample a signal to the rate chroma and tempo are analysed at
+    :param y: The mono signal
+    :param sr: The sample rate of the signal
+    :param analysis_sr: The analysis sample rate, None keeps the signal rate
+    :return: (y, sr) at the analysis rate
+    """
+    if analysis_sr is None or analysis_sr == sr:
+        return y, sr
+    return core.resample(y, orig_sr=sr, target_sr=analysis_sr), analysis_sr
+
+
+def equal_loudness(y, sr, context=None):
+    """
+    Apply the essentia equal-loudness filter at any sample rate
+    :param y: The mono signal
+    :param sr: The sample rate of the signal
+    :param context: The AnalysisContext owning the filter
+    :return: The filtered signal
+    """
+    context = context or default_context()
+    if sr in EQUAL_LOUDNESS_RATES:
+        return context.algorithm("EqualLoudness", sampleRate=sr)(y)
+    # The filter is only defined for a few rates, go through the closest one
+    filter_sr = min(EQUAL_LOUDNESS_RATES, key=lambda rate: abs(rate - sr))
+    eql_y = context.algorithm("EqualLoudness", sampleRate=filter_sr)(
+        core.resample(y, orig_sr=sr, target_sr=filter_sr)
+    )
+    return core.resample(eql_y, orig_sr=filter_sr, target_sr=sr)
+
+
+def filtered_signal(y, sr, context=None):
+    """
+    The equal-loudness filtered signal, computed once per track and context
+    :param y: The mono signal
+    :param sr: The sample rate of the signal
+    :param context: The AnalysisContext caching the filtered signal
+    :return: The filtered signal
+    """
+    context = context or default_context()
+    return context.cached(
+        y, ("equal_loudness", sr), lambda: equal_loudness(y, sr, context)
+    )
+
+
+def get_beat_sync_chroma_and_spectrum(
+    audio, sr=None, bpm=None, analysis_sr=None, context=None
+):
     """
     Returns the beat_sync_chroma and the beat_sync_spectrums
     :param audio: Path to the song, or numpy array
-    :param rate: Sample rate in case the audio param is numpy array
+    :param sr: Sample rate to load the song at, or of the numpy array. 44100 if None
     :param bpm: Precalculated bpm
+    :param analysis_sr: Lower sample rate for the chroma and tempo analysis, e.g.
+    22050 or 11025. The band energies are always computed at sr
+    :param context: The AnalysisContext reusing algorithms and intermediates
     :return: (beat_sync_chroma, beat_sync_spec)
     """
-    sr = 44100
-    if not isinstance(audio, np.ndarray):
-        y = std.MonoLoader(filename=audio, samplerate=44100)()  # type: ignore
-    else:
-        y = audio
-    eql_y = std.EqualLoudness()(y)  # type: ignore
-    tempo, framed_dbn = self_tempo_estimation(y, sr, tempo=bpm)
+    sr = sr or 44100
+    context = analysis_context(context)
+    y = load_mono(audio, sr, context)
+    analysis_y, analysis_sr = to_analysis_rate(y, sr, analysis_sr)
+    tempo, framed_dbn = self_tempo_estimation(
+        analysis_y, analysis_sr, tempo=bpm, context=context
+    )
+    return beat_sync_chroma_and_spectrum(
+        y,
+        sr,
+        framed_dbn,
+        analysis_y=analysis_y,
+        analysis_sr=analysis_sr,
+        context=context,
+    )
+
+
+def beat_sync_chroma_and_spectrum(
+    y, sr, beats, analysis_y=None, analysis_sr=None, context=None
+):
+    """
+    Returns the beat_sync_chroma and the beat_sync_spectrums for a given beat grid
+    :param y: The mono signal
+    :param sr: The sample rate of the signal
+    :param beats: The beat times in seconds
+    :param analysis_y: The signal to compute the chroma from, y if None
+    :param analysis_sr: The sample rate of analysis_y
+    :param context: The AnalysisContext caching the filtered signal
+    :return: (beat_sync_chroma, beat_sync_spec)
+    """
+    chromas, bands, _ = beat_sync_features(
+        y, sr, beats, analysis_y, analysis_sr, context
+    )
+    return chromas, bands
+
+
+def beat_sync_features(y, sr, beats, analysis_y=None, analysis_sr=None, context=None):
+    """
+    Returns the beat synchronous chroma and spectrums, and the average power
+    spectrum of the chroma STFT for tuning estimation. The chroma is pooled from
+    one STFT of the whole analysis signal, see ChromaEngine
+    :param y: The mono signal
+    :param sr: The sample rate of the signal
+    :param beats: The beat times in seconds
+    :param analysis_y: The signal to compute the chroma from, y if None
+    :param analysis_sr: The sample rate of analysis_y
+    :param context: The AnalysisContext caching the filtered signal
+    :return: (beat_sync_chroma, beat_sync_spec, mean_power), mean_power has
+    N_FFT // 2 + 1 bins at analysis_sr
+    """
+    if analysis_y is None:
+        analysis_y, analysis_sr = y, sr
+    eql_y = filtered_signal(y, sr, context)
+    framed_dbn = beats
     if framed_dbn.shape[0] % 4 == 0:
         framed_dbn = np.append(framed_dbn, np.array(len(y) / sr))
+    chromas, mean_power = ChromaEngine(analysis_sr).beat_sync_chroma(
+        analysis_y, framed_dbn
+    )
+    chromas = as_feature_array(chromas)
+    return chromas, beat_sync_bands(eql_y, sr, framed_dbn), mean_power
+
+
+def beat_sync_bands(eql_y, sr, framed_dbn):
+    """
+    The energy of three frequency bands between beats, from one FFT per beat
+    with the FFT threads of threads.set_threads
+    :param eql_y: The equal loudness filtered signal
+    :param sr: The sample rate of the signal
+    :param framed_dbn: The beat boundaries in seconds
+    :return: Array containing energy in band1, band2, band3, shape (3, n_beats)
+    """
     band1 = (0, 220)
     band2 = (220, 1760)
     band3 = (1760, sr / 2)
     band1list = []
     band2list = []
     band3list = []
-    chromas = []
     for i in range(1, len(framed_dbn)):
         fft_eq = abs(
-            np.fft.fft(eql_y[int(framed_dbn[i - 1] * sr) : int(framed_dbn[i] * sr)])
+            scipy.fft.fft(
+                eql_y[int(framed_dbn[i - 1] * sr) : int(framed_dbn[i] * sr)],
+                workers=threads.fft_workers(),
+            )
         )
         freqs = np.fft.fftfreq(len(fft_eq), 1 / sr)
         band1list.append(
@@ -100,97 +263,71 @@ def get_beat_sync_chroma_and_spectrum(audio, sr=None, bpm=None):
                 )
             )
         )
-        stft = abs(core.stft(y[int(framed_dbn[i - 1] * sr) : int(framed_dbn[i] * sr)]))
-        chroma = np.mean(feature.chroma_stft(y=None, S=stft**2), axis=1)
-        chromas.append(chroma)
-    chromas = np.array(chromas).transpose()
     band1list = np.array(band1list).transpose()
     band2list = np.array(band2list).transpose()
     band3list = np.array(band3list).transpose()
-    return (chromas, np.vstack([band1list, band2list, band3list]))
+    return as_feature_array(np.vstack([band1list, band2list, band3list]))
 
 
-def get_beat_sync_spectrums(audio):
+def tuning_from_spectrum(power, sr, n_fft=N_FFT, fmin=250, fmax=4000, ref=440.0):
+    """
+    Fast tuning estimation from an average power spectrum. The deviation of the
+    spectral peaks from the equal tempered grid is averaged on the circle, each
+    peak weighted by its magnitude
+    :param power: The average power spectrum, n_fft // 2 + 1 bins
+    :param sr: The sample rate of the spectrum
+    :param n_fft: The FFT size of the spectrum
+    :param fmin: Lowest peak frequency used, lower peaks are poorly resolved
+    :param fmax: Highest peak frequency used
+    :param ref: The reference frequency of the grid
+    :return: The tuning frequency in Hz, ref if no peak is found
+    """
+    magnitude = np.log(np.sqrt(power) + eps)
+    left, center, right = magnitude[:-2], magnitude[1:-1], magnitude[2:]
+    bins = np.arange(1, len(power) - 1)
+    freqs = bins * sr / n_fft
+    is_peak = (center > left) & (center >= right) & (freqs > fmin) & (freqs < fmax)
+    if not np.any(is_peak):
+        return ref
+    left, center, right = left[is_peak], center[is_peak], right[is_peak]
+    # Parabolic interpolation of the peaks on the log magnitude
+    denominator = left - 2 * center + right
+    shift = np.where(denominator != 0, 0.5 * (left - right) / denominator, 0)
+    peak_freqs = (bins[is_peak] + shift) * sr / n_fft
+    semitones = 12 * np.log2(peak_freqs / ref)
+    weights = np.sqrt(power[1:-1][is_peak])
+    deviation = np.angle(np.sum(weights * np.exp(2j * np.pi * semitones))) / (2 * np.pi)
+    return float(ref * np.exp2(deviation / 12))
+
+
+def get_beat_sync_spectrums(audio, sr=44100, context=None):
     """
     Returns a beat-sync 3-energy-band spectrogram
     :param audio: Path to the song
+    :param sr: The sample rate to load the song at
+    :param context: The AnalysisContext reusing algorithms and intermediates
     :return: Array containing energy in band1, band2, band3
     """
-    y, sr = core.load(audio, sr=44100)
-    eql_y = std.EqualLoudness()(y)  # type: ignore
-    tempo, framed_dbn = self_tempo_estimation(y, sr)
+    context = analysis_context(context)
+    y = load_mono(audio, sr, context)
+    eql_y = filtered_signal(y, sr, context)
+    tempo, framed_dbn = self_tempo_estimation(y, sr, context=context)
     np.append(framed_dbn, np.array(len(y) / sr))
-    band1 = (0, 220)
-    band2 = (220, 1760)
-    band3 = (1760, sr / 2)
-    band1list = []
-    band2list = []
-    band3list = []
-    for i in range(1, len(framed_dbn)):
-        fft_eq = abs(
-            np.fft.fft(eql_y[int(framed_dbn[i - 1] * sr) : int(framed_dbn[i] * sr)])
-        )
-        freqs = np.fft.fftfreq(len(fft_eq), 1 / sr)
-        band1list.append(
-            np.sqrt(
-                np.mean(
-                    sum(
-                        fft_eq[
-                            np.where(np.logical_and(freqs > band1[0], freqs < band1[1]))
-                        ]
-                        ** 2
-                    )
-                )
-            )
-        )
-        band2list.append(
-            np.sqrt(
-                np.mean(
-                    sum(
-                        fft_eq[
-                            np.where(np.logical_and(freqs > band2[0], freqs < band2[1]))
-                        ]
-                        ** 2
-                    )
-                )
-            )
-        )
-        band3list.append(
-            np.sqrt(
-                np.mean(
-                    sum(
-                        fft_eq[
-                            np.where(np.logical_and(freqs > band3[0], freqs < band3[1]))
-                        ]
-                        ** 2
-                    )
-                )
-            )
-        )
+    return beat_sync_bands(eql_y, sr, framed_dbn)
 
-    band1list = np.array(band1list).transpose()
-    band2list = np.array(band2list).transpose()
-    band3list = np.array(band3list).transpose()
-    return np.vstack([band1list, band2list, band3list])
 
-
-def get_beat_sync_chroma(audio):
+def get_beat_sync_chroma(audio, sr=44100):
     """
-    Get a beat synchronous chroma
+    Get a beat synchronous chroma, pooled from one STFT of the whole track with
+    the shared filterbank, as beat_sync_features does
     :param audio: The path to the audio file
+    :param sr: The sample rate to analyse at, 22050 or 11025 are enough for chroma
     :return: A beat synchronous chroma
     """
-    y, sr = core.load(audio, sr=44100)
+    y, sr = core.load(audio, sr=sr)
     tempo, framed_dbn = self_tempo_estimation(y, sr)
-    np.append(framed_dbn, np.array(len(y) / sr))
-    # Calculate chroma semitone spectrum
-    chromas = []
-    for i in range(1, len(framed_dbn)):
-        stft = abs(core.stft(y[int(framed_dbn[i - 1] * sr) : int(framed_dbn[i] * sr)]))
-        chroma = np.mean(feature.chroma_stft(y=None, S=stft**2), axis=1)
-        chromas.append(chroma)
-    chromas = np.array(chromas).transpose()
-    return chromas
+    chromas, _ = ChromaEngine(sr).beat_sync_chroma(y, framed_dbn)
+    return as_feature_array(chromas)
 
 
 def get_dbeat_sync_chroma(audio):
@@ -199,6 +336,10 @@ def get_dbeat_sync_chroma(audio):
     :param audio: The path to the audio file
     :return: A downbeat synchronous chroma
     """
+    import matplotlib.pyplot as plt
+    from madmom.features.downbeats import DBNDownBeatTrackingProcessor as downbeattrack
+    from madmom.features.downbeats import RNNDownBeatProcessor as beatrnn
+
     y, sr = core.load(audio, sr=44100)
     tempo, beats = self_tempo_estimation(y, sr)
     np.append(beats, np.array(len(y) / sr))
@@ -241,6 +382,8 @@ def get_dbeat_sync_chroma(audio):
 
 def gkern(kernlen=21, nsig=3):
     """Returns a 2D Gaussian kernel."""
+    import scipy.stats as st
+
     x = np.linspace(-nsig, nsig, kernlen + 1)
     kern1d = np.diff(st.norm.cdf(x))
     kern2d = np.outer(kern1d, kern1d)
@@ -279,6 +422,9 @@ def slidekernelthroughdiagonal(kernel, matrix):
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    from scipy.spatial.distance import cdist
+
     if len(sys.argv) == 2:
         chromas, semitones, downbeats, tempo = get_beat_sync_chroma(sys.argv[1])
         plt.figure()
@@ -0,0 +1,389 @@
+"""
+Local asyncio job server for mashability queries and mixes.
+
+Jobs are sent as JSON over HTTP:
+    POST /score {"base": <path>, "candidate": <path>}
+    POST /mix {"base": <path>, "candidate": <path>, "beat_offset": <int>,
+               "pitch_shift": <int>, "output": <path>}
+    GET /metrics
+
+The CPU work runs in a process pool. Track analyses are cached and concurrent
+requests for the same track share a single analysis.
+"""
+
+import asyncio
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from .context import track_key
+from .threads import THREADS_ENV, set_threads, threads_per_worker
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    422: "Unprocessable Entity",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+def analyze_track(path):
+    """
+    Compute the features of a track, run inside the pool
+    :param path: The path to the track
+    :return: A TrackFeatures
+    """
+    from .features import extract_features
+
+    return extract_features(path)
+
+
+def score_tracks(base_features, cand_features):
+    """
+    Score a candidate against a base from their features, run inside the pool
+    :param base_features: The TrackFeatures of the base track
+    :param cand_features: The TrackFeatures of the candidate track
+    :return: A tuple containing: mashability value, the pitch offset, beat offset,
+    harmonic contribution, spectral contribution
+    """
+    from .mashability import score_features
+
+    return score_features(base_features, cand_features)
+
+
+def render_mix(
+    base,
+    candidate,
+    beat_offset,
+    pitch_shift,
+    output,
+    base_features=None,
+    cand_features=None,
+):
+    """
+    Mix a candidate over a base and write it to disk, run inside the pool
+    :param base: The path to the base track
+    :param candidate: The path to the candidate track
+    :param beat_offset: The beat offset
+    :param pitch_shift: The pitch shift
+    :param output: The path of the wav file to write
+    :param base_features: The TrackFeatures of the base track, its tuning is
+    estimated if None
+    :param cand_features: The TrackFeatures of the candidate track. With them only
+    the beats of the candidate that go over the base are decoded, and its tempo
+    and tuning are not estimated
+    :return: The path of the written file
+    """
+    from soundfile import write as write_wav
+
+    from .utilities import mix_songs
+
+    known = {}
+    if base_features is not None:
+        known["tunning_main"] = base_features.tuning
+    if cand_features is not None:
+        known["tunning_cand"] = cand_features.tuning
+        known["cand_beats"] = cand_features.beats
+    mix = mix_songs(base, candidate, beat_offset, pitch_shift, **known)
+    write_wav(output, mix, 44100)
+    return output
+
+
+def error_status(error):
+    """
+    HTTP status of a failed job. The analysis modules are only imported here, so
+    the server process itself starts without them
+    :param error: The exception raised by the job
+    :return: The HTTP status code
+    """
+    from .mashability import ShorterException
+
+    if isinstance(error, ShorterException):
+        return 422
+    if isinstance(error, FileNotFoundError):
+        return 404
+    return 500
+
+
+class MashabilityServer:
+    """
+    Asyncio HTTP server that offloads analysis, scoring and mixing to an executor
+    :param host: The host to bind, localhost by default
+    :param port: The port to bind, 0 picks a free one
+    :param executor: Executor for the CPU work, a ProcessPoolExecutor by default
+    :param max_workers: Number of jobs running in the executor at the same time
+    :param threads: BLAS and FFT threads of each process of the default executor,
+    AUTOMASHUPPER_THREADS or the cores shared between the processes if None
+    :param max_pending: Number of accepted jobs above which new ones are rejected
+    :param cache_size: Number of track analyses kept in memory
+    :param analyze: Function computing the features of a track
+    :param score: Function scoring two tracks from their features
+    :param mix: Function rendering a mix to disk
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        executor=None,
+        max_workers=None,
+        threads=None,
+        max_pending=64,
+        cache_size=1024,
+        analyze=analyze_track,
+        score=score_tracks,
+        mix=render_mix,
+    ):
+        self.host = host
+        self.port = port
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.threads = (
+            threads
+            or int(os.environ.get(THREADS_ENV, 0))
+            or threads_per_worker(self.max_workers)
+        )
+        self.max_pending = max_pending
+        self.cache_size = cache_size
+        self._own_executor = executor is None
+        self._executor = executor
+        self._analyze = analyze
+        self._score = score
+        self._mix = mix
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._slots = None
+        self._server = None
+        self._pending = 0
+        self._running = 0
+        self.stats = {
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "deduplicated": 0,
+        }
+
+    def metrics(self):
+        """
+        :return: A dict with the queue depth, running jobs and counters
+        """
+        return dict(
+            self.stats,
+            queue_depth=self._pending - self._running,
+            running=self._running,
+            pending=self._pending,
+            max_pending=self.max_pending,
+            cached_features=len(self._cache),
+            inflight_analyses=len(self._inflight),
+        )
+
+    async def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=set_threads,
+                initargs=(self.threads,),
+            )
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    async def _run_cpu(self, func, *args):
+        async with self._slots:
+            self._running += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, func, *args)
+            finally:
+                self._running -= 1
+
+    async def features(self, path):
+        """
+        Get the features of a track, from the cache or by analysing it once
+        even when several requests ask for it at the same time
+        :param path: The path to the track
+        :return: The features computed by the analyze function
+        """
+        key = track_key(path)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.stats["cache_hits"] += 1
+            return self._cache[key]
+        if key in self._inflight:
+            self.stats["deduplicated"] += 1
+            return await asyncio.shield(self._inflight[key])
+        self.stats["cache_misses"] += 1
+        task = asyncio.ensure_future(self._analyze_uncached(key, path))
+        self._inflight[key] = task
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._inflight.pop(key, None)
+
+    def cached_features(self, path):
+        """
+        Get the features of a track if they are cached, without analysing it
+        :param path: The path to the track
+        :return: The features computed by the analyze function, or None
+        """
+        key = track_key(path)
+        if key not in self._cache:
+            return None
+        self._cache.move_to_end(key)
+        self.stats["cache_hits"] += 1
+        return self._cache[key]
+
+    async def _analyze_uncached(self, key, path):
+        features = await self._run_cpu(self._analyze, path)
+        self._cache[key] = features
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return features
+
+    async def score(self, base, candidate):
+        base_features, cand_features = await asyncio.gather(
+            self.features(base), self.features(candidate)
+        )
+        mash, p_shift, b_offset, h_contr, r_contr = await self._run_cpu(
+            self._score, base_features, cand_features
+        )
+        return {
+            "file": candidate,
+            "mashability": float(mash),
+            "pitch_shift": int(p_shift),
+            "beat_offset": int(b_offset),
+            "h_contr": float(h_contr),
+            "r_contr": float(r_contr),
+        }
+
+    async def mix(self, base, candidate, beat_offset, pitch_shift, output):
+        # Tracks scored before keep their tuning and beats for the mix
+        output = await self._run_cpu(
+            self._mix,
+            base,
+            candidate,
+            int(beat_offset),
+            int(pitch_shift),
+            output,
+            self.cached_features(base),
+            self.cached_features(candidate),
+        )
+        return {"output": output}
+
+    async def _job(self, coro):
+        if self._pending >= self.max_pending:
+            coro.close()
+            self.stats["rejected"] += 1
+            return 503, {"error": "Too many pending jobs"}
+        self._pending += 1
+        try:
+            result = await coro
+        except Exception as e:
+            self.stats["failed"] += 1
+            return error_status(e), {"error": str(e)}
+        finally:
+            self._pending -= 1
+        self.stats["completed"] += 1
+        return 200, result
+
+    async def _dispatch(self, method, target, body):
+        if method == "GET" and target == "/metrics":
+            return 200, self.metrics()
+        if method != "POST" or target not in ("/score", "/mix"):
+            return 404, {"error": "Unknown endpoint %s %s" % (method, target)}
+        try:
+            params = json.loads(body or b"{}")
+            if target == "/score":
+                coro = self.score(params["base"], params["candidate"])
+            else:
+                coro = self.mix(
+                    params["base"],
+                    params["candidate"],
+                    params.get("beat_offset", 0),
+                    params.get("pitch_shift", 0),
+                    params["output"],
+                )
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {"error": "Invalid job: %s" % e}
+        return await self._job(coro)
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+        except (ValueError, asyncio.IncompleteReadError):
+            status, payload = 400, {"error": "Malformed request"}
+        else:
+            status, payload = await self._dispatch(method, target, body)
+        data = json.dumps(payload).encode()
+        head = (
+            "HTTP/1.1 %d %s\r\n"
+            "Content-Type: application/json\r\n"
+            "Content-Length: %d\r\n"
+            "Connection: close\r\n" % (status, HTTP_REASONS[status], len(data))
+        )
+        if status == 503:
+            head += "Retry-After: 1\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+def serve(host="127.0.0.1", port=8765, workers=None, max_pending=64, threads=None):
+    """
+    Run a MashabilityServer until interrupted
+    :param host: The host to bind
+    :param port: The port to bind
+    :param workers: Number of worker processes
+    :param threads: BLAS and FFT threads of each worker process
+    :param max_pending: Number of accepted jobs above which new ones are rejected
+    """
+    server = MashabilityServer(
+        host=host,
+        port=port,
+        max_workers=workers,
+        threads=threads,
+        max_pending=max_pending,
+    )
+
+    async def run():
+        await server.start()
+        print("Serving mashability jobs on http://%s:%d" % (server.host, server.port))
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
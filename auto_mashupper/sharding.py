@@ -0,0 +1,259 @@
+"""
+Sharded mashability scans through a shared directory.
+
+The candidates are split into shards by a hash of their path, so every process
+computes the same partition without talking to the others. Workers, on one
+machine or on several nodes mounting the same directory, claim shards by
+creating lock files, write the scores of each shard they finish, and any of
+them can merge the finished shards into the ranked results of the base song:
+    manifest.json: the base song and the number of shards of the scan
+    shard-0007.lock: shard 7 is claimed, by the host and pid written inside
+    shard-0007.npz: the candidates of shard 7 and their scores, shard 7 is done
+
+Locks are created with O_CREAT | O_EXCL, which is atomic on local file systems
+and on NFSv3 and later. Scoring a shard always gives the same file, so a shard
+scored twice after a stale lock was taken over is harmless.
+"""
+
+import hashlib
+import json
+import os
+import re
+import socket
+import time
+
+import numpy as np
+
+from .features import extract_features
+from .mashability import library_songs, score_candidates, write_mashability_results
+
+MANIFEST = "manifest.json"
+
+
+def shard_of(song, n_shards):
+    """
+    The shard of a candidate
+    :param song: The path to the candidate, as listed by every worker
+    :param n_shards: The number of shards
+    :return: The shard index
+    """
+    digest = hashlib.sha1(song.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % n_shards
+
+
+def partition(songs, n_shards):
+    """
+    Split candidates into shards, whatever order they were listed in
+    :param songs: The paths to the candidates
+    :param n_shards: The number of shards
+    :return: A list with the sorted candidates of each shard
+    """
+    shards = [[] for _ in range(n_shards)]
+    for song in sorted(songs):
+        shards[shard_of(song, n_shards)].append(song)
+    return shards
+
+
+def owner():
+    """The host and pid written in the locks of this process"""
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+def owner_token():
+    """The host and pid of this process, as a part of a file name on any system"""
+    host = re.sub(r"[^A-Za-z0-9._-]", "_", socket.gethostname())
+    return "%s-%d" % (host, os.getpid())
+
+
+class ShardQueue:
+    """
+    The shards of a scan, claimed through lock files in a shared directory
+    :param work_dir: The shared work directory
+    :param n_shards: The number of shards
+    :param stale_after: Seconds after which the lock of an unfinished shard is
+    considered left by a crashed worker and can be claimed again. Never if None
+    """
+
+    def __init__(self, work_dir, n_shards, stale_after=None):
+        self.work_dir = work_dir
+        self.n_shards = n_shards
+        self.stale_after = stale_after
+
+    @classmethod
+    def open(cls, work_dir, base_song, n_shards=None, stale_after=None):
+        """
+        Open the scan of a base song, starting it if it is the first worker
+        :param work_dir: The shared work directory, created if needed
+        :param base_song: The path to the base song
+        :param n_shards: The number of shards, read from the scan if None
+        :param stale_after: See ShardQueue
+        :return: A ShardQueue
+        """
+        os.makedirs(work_dir, exist_ok=True)
+        path = os.path.join(work_dir, MANIFEST)
+        base = os.path.basename(base_song)
+        if n_shards is not None:
+            if n_shards < 1:
+                raise ValueError("A scan needs at least one shard")
+            try:
+                with open(path, "x") as f:
+                    json.dump({"base_song": base, "n_shards": n_shards}, f)
+            except FileExistsError:
+                pass
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            raise ValueError("No scan in %s, give the number of shards" % work_dir)
+        if manifest["base_song"] != base or n_shards not in (
+            None,
+            manifest["n_shards"],
+        ):
+            raise ValueError(
+                "%s holds a scan of %s in %d shards"
+                % (work_dir, manifest["base_song"], manifest["n_shards"])
+            )
+        return cls(work_dir, manifest["n_shards"], stale_after)
+
+    def _path(self, shard, extension):
+        return os.path.join(self.work_dir, "shard-%04d.%s" % (shard, extension))
+
+    def is_done(self, shard):
+        return os.path.exists(self._path(shard, "npz"))
+
+    def pending(self):
+        """
+        :return: The shards that are not done yet, claimed or not
+        """
+        return [shard for shard in range(self.n_shards) if not self.is_done(shard)]
+
+    def claim(self):
+        """
+        Claim a shard for this process
+        :return: The shard index, None when every shard is claimed or done
+        """
+        for shard in self.pending():
+            if self._lock(shard) and not self.is_done(shard):
+                return shard
+        return None
+
+    def _lock(self, shard):
+        path = self._path(shard, "lock")
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self._is_stale(path):
+                return False
+            try:
+                # Only one of the workers finding the stale lock wins the rename
+                os.rename(path, "%s.stale-%s" % (path, owner_token()))
+            except FileNotFoundError:
+                return False
+            return self._lock(shard)
+        with os.fdopen(fd, "w") as f:
+            f.write(owner())
+        return True
+
+    def _is_stale(self, path):
+        if self.stale_after is None:
+            return False
+        try:
+            return time.time() - os.path.getmtime(path) > self.stale_after
+        except FileNotFoundError:
+            return False
+
+    def complete(self, shard, songs, scores):
+        """
+        Write the results of a shard, which marks it as done
+        :param shard: The shard index
+        :param songs: The paths to the candidates of the shard
+        :param scores: Their SCORE_DTYPE scores
+        """
+        path = self._path(shard, "npz")
+        tmp_path = "%s.%s.tmp" % (path, owner_token())
+        with open(tmp_path, "wb") as f:
+            np.savez(f, songs=np.array(songs, dtype=str), scores=scores)
+        # Readers see either no results or all of them
+        os.replace(tmp_path, path)
+
+    def load(self, shard):
+        """
+        Read the results of a finished shard
+        :param shard: The shard index
+        :return: (list of candidate paths, SCORE_DTYPE scores)
+        """
+        with np.load(self._path(shard, "npz")) as results:
+            return list(results["songs"]), results["scores"]
+
+
+def scan_shards(
+    base_song,
+    work_dir,
+    n_shards=None,
+    songs=None,
+    analysis_sr=None,
+    tempo_preset="accurate",
+    stale_after=None,
+):
+    """
+    Work on the sharded scan of a base song until no shard is left to claim. Any
+    number of processes can run it on the same work directory
+    :param base_song: The path to the base song
+    :param work_dir: The shared work directory
+    :param n_shards: The number of shards, for the first worker of a scan
+    :param songs: The paths to the candidates, the mp3 files next to the base song
+    if None. Every worker must list the same candidates
+    :param analysis_sr: Lower sample rate for the chroma and tempo analysis
+    :param tempo_preset: "accurate" or "fast" tempo estimation
+    :param stale_after: Seconds after which an unfinished shard can be claimed
+    again, see ShardQueue
+    :return: The shards scored by this worker
+    """
+    queue = ShardQueue.open(work_dir, base_song, n_shards, stale_after)
+    shards = partition(
+        library_songs(base_song) if songs is None else songs, queue.n_shards
+    )
+    base_features = None
+    done = []
+    shard = queue.claim()
+    while shard is not None:
+        # Workers that find nothing left to claim skip the analysis
+        if base_features is None:
+            base_features = extract_features(
+                base_song, analysis_sr=analysis_sr, tempo_preset=tempo_preset
+            )
+        scores = score_candidates(
+            base_features,
+            shards[shard],
+            analysis_sr=analysis_sr,
+            tempo_preset=tempo_preset,
+        )
+        queue.complete(shard, shards[shard], scores)
+        done.append(shard)
+        shard = queue.claim()
+    return done
+
+
+def merge_shards(base_song, work_dir):
+    """
+    Merge the finished shards of a scan into the results of the base song, as
+    mashability.main writes them
+    :param base_song: The path to the base song
+    :param work_dir: The shared work directory
+    :return: (list of candidate paths, SCORE_DTYPE scores), in shard order
+    """
+    queue = ShardQueue.open(work_dir, base_song)
+    pending = queue.pending()
+    if pending:
+        raise RuntimeError(
+            "%d of %d shards are not done yet: %s"
+            % (len(pending), queue.n_shards, pending[:10])
+        )
+    songs, scores = [], []
+    for shard in range(queue.n_shards):
+        shard_songs, shard_scores = queue.load(shard)
+        songs += shard_songs
+        scores.append(shard_scores)
+    scores = np.concatenate(scores)
+    write_mashability_results(base_song, songs, scores)
+    return songs, scores
@@ -0,0 +1,237 @@
+"""
+Tempo and beat grid estimation sharing a single onset envelope.
+
+Two presets are available:
+    fast: tempo from the autocorrelation of the onset envelope only
+    accurate: the Percival / Zapata ensemble arbitrated by LoopBpmConfidence
+
+Both presets compute the onset envelope once and use it to phase-align the
+beat grid, so the first beat is not assumed to be at 0 seconds.
+"""
+
+import numpy as np
+import scipy.fft
+from librosa import core, onset
+
+from .context import default_context
+from .threads import fft_workers
+
+HOP_LENGTH = 512
+MIN_BPM = 30
+MAX_BPM = 300
+TEMPO_PRESETS = ("fast", "accurate")
+
+
+def onset_envelope(y, sr, hop_length=HOP_LENGTH):
+    """
+    Onset strength envelope of a signal
+    :param y: The audio signal
+    :param sr: The sample rate of the signal
+    :param hop_length: The hop between envelope frames, in samples
+    :return: The onset envelope, one value per frame
+    """
+    return onset.onset_strength(
+        y=np.asarray(y, dtype=np.float32), sr=sr, hop_length=hop_length
+    )
+
+
+def tempo_candidates(
+    envelope,
+    sr,
+    hop_length=HOP_LENGTH,
+    min_bpm=MIN_BPM,
+    max_bpm=MAX_BPM,
+    n_candidates=3,
+):
+    """
+    Tempo candidates from the peaks of the onset envelope autocorrelation,
+    weighted by a log-normal prior centered at 120 bpm
+    :param envelope: The onset envelope
+    :param sr: The sample rate of the signal
+    :param hop_length: The hop between envelope frames, in samples
+    :param min_bpm: The slowest tempo considered
+    :param max_bpm: The fastest tempo considered
+    :param n_candidates: Maximum number of candidates returned
+    :return: (bpms, scores), best candidate first
+    """
+    fps = sr / hop_length
+    envelope = envelope - np.mean(envelope)
+    n = len(envelope)
+    spectrum = scipy.fft.rfft(envelope, 2 * n, workers=fft_workers())
+    acf = scipy.fft.irfft(spectrum * np.conj(spectrum), 2 * n, workers=fft_workers())
+    acf = acf[:n]
+    min_lag = max(1, int(np.floor(fps * 60 / max_bpm)))
+    max_lag = min(n - 2, int(np.ceil(fps * 60 / min_bpm)))
+    if max_lag <= min_lag:
+        return np.array([]), np.array([])
+    lags = np.arange(min_lag, max_lag + 1)
+    strength = acf[lags - 1], acf[lags], acf[lags + 1]
+    is_peak = (strength[1] >= strength[0]) & (strength[1] > strength[2])
+    is_peak &= strength[1] > 0
+    left, center, right = (s[is_peak] for s in strength)
+    # Parabolic interpolation of the peak position
+    denominator = left - 2 * center + right
+    shift = np.where(denominator != 0, 0.5 * (left - right) / denominator, 0)
+    bpms = 60 * fps / (lags[is_peak] + shift)
+    scores = center * np.exp(-0.5 * np.log2(bpms / 120) ** 2)
+    order = np.argsort(scores)[::-1][:n_candidates]
+    return bpms[order], scores[order]
+
+
+def beat_phase(envelope, sr, tempo, hop_length=HOP_LENGTH):
+    """
+    Time of the first beat, the offset whose beat comb collects the most onsets
+    :param envelope: The onset envelope
+    :param sr: The sample rate of the signal
+    :param tempo: The tempo in bpm
+    :param hop_length: The hop between envelope frames, in samples
+    :return: The time of the first beat in seconds, smaller than one beat
+    """
+    fps = sr / hop_length
+    period = fps * 60 / tempo
+    n = len(envelope)
+    if n == 0:
+        return 0.0
+    phases = np.arange(max(1, int(round(period))))
+    ticks = np.arange(int(n / period) + 1) * period
+    frames = np.rint(phases[:, None] + ticks[None, :]).astype(int)
+    comb = np.where(frames < n, envelope[np.minimum(frames, n - 1)], 0).sum(axis=1)
+    return float(phases[np.argmax(comb)] / fps)
+
+
+def beat_grid(duration, tempo, phase=0.0):
+    """
+    Regular beat grid
+    :param duration: The duration of the signal in seconds
+    :param tempo: The tempo in bpm
+    :param phase: The time of the first beat in seconds
+    :return: An array of beat times in seconds
+    """
+    return np.arange(phase, duration, 60 / tempo)
+
+
+class BeatGrid:
+    """
+    Conversions between beats and samples along the beat times of a track. Beats
+    are counted from the first beat, fractional beats are interpolated between
+    beat times and beats outside the grid are extrapolated with its median period
+    :param beats: The beat times in seconds, in increasing order
+    :param sr: The sample rate of the signal the grid applies to
+    :param tempo: The tempo in bpm, only used for grids of fewer than two beats
+    """
+
+    def __init__(self, beats, sr, tempo=None):
+        self.beats = np.asarray(beats, dtype=float).reshape(-1)
+        self.sr = sr
+        if len(self.beats) >= 2:
+            self.period = float(np.median(np.diff(self.beats)))
+        elif tempo is not None and MIN_BPM <= tempo <= MAX_BPM:
+            self.period = 60 / tempo
+            if not len(self.beats):
+                self.beats = np.zeros(1)
+        else:
+            raise ValueError("A beat grid needs two beats, or one beat and a tempo")
+
+    def __len__(self):
+        return len(self.beats)
+
+    def beat_to_time(self, beat):
+        """
+        :param beat: Beat index, or array of them, possibly fractional
+        :return: The time of the beat in seconds
+        """
+        beat = np.asarray(beat, dtype=float)
+        last = len(self.beats) - 1
+        inside = np.interp(beat, np.arange(len(self.beats)), self.beats)
+        before = self.beats[0] + beat * self.period
+        after = self.beats[-1] + (beat - last) * self.period
+        return np.where(beat < 0, before, np.where(beat > last, after, inside))
+
+    def beat_to_sample(self, beat):
+        """
+        :param beat: Beat index, or array of them, possibly fractional
+        :return: The sample of the beat, as an int or an int array
+        """
+        samples = np.rint(self.beat_to_time(beat) * self.sr).astype(int)
+        return samples if samples.ndim else int(samples)
+
+    def slice_beats(self, y, start, n_beats):
+        """
+        The part of a signal covering some beats, as a view
+        :param y: The signal, mono or of shape (n_channels, n_samples)
+        :param start: The first beat, possibly fractional
+        :param n_beats: The number of beats, possibly fractional
+        :return: The slice of y along its last axis, clipped to the signal
+        """
+        first, last = np.clip(
+            self.beat_to_sample([start, start + n_beats]), 0, y.shape[-1]
+        )
+        return y[..., first:last]
+
+
+def zapata14bpm(y, sr=44100, context=None):
+    # BeatTrackerMultiFeature only works at 44100 Hz
+    if sr != 44100:
+        y = core.resample(y, orig_sr=sr, target_sr=44100)
+    essentia_beat = (context or default_context()).algorithm("BeatTrackerMultiFeature")
+    mean_tick_distance = np.mean(np.diff(essentia_beat(y)[0]))
+    return 60 / mean_tick_distance
+
+
+def ensemble_tempo(y, sr, context=None):
+    """
+    Tempo from the Percival and Zapata estimators, keeping the one
+    LoopBpmConfidence trusts the most
+    :param y: The audio signal
+    :param sr: The sample rate of the signal
+    :param context: The AnalysisContext owning the essentia algorithms
+    :return: The tempo in bpm
+    """
+    context = context or default_context()
+    confidence_estimator = context.algorithm("LoopBpmConfidence", sampleRate=sr)
+    percivalbpm = int(context.algorithm("PercivalBpmEstimator", sampleRate=sr)(y))
+    try:
+        zapatabpm = int(zapata14bpm(y, sr, context))
+    except Exception:
+        return percivalbpm
+    confidence_zapata = confidence_estimator(y, zapatabpm)
+    confidence_percival = confidence_estimator(y, percivalbpm)
+    if confidence_percival >= confidence_zapata:
+        return percivalbpm
+    return zapatabpm
+
+
+def estimate_tempo(y, sr, tempo=None, preset="accurate", envelope=None, context=None):
+    """
+    Estimate the tempo and a phase-aligned beat grid
+    :param y: The audio signal
+    :param sr: The sample rate of the signal
+    :param tempo: Precalculated bpm, only the beat phase is estimated then
+    :param preset: "fast" or "accurate"
+    :param envelope: Precomputed onset envelope of y, with HOP_LENGTH
+    :param context: The AnalysisContext reusing algorithms and intermediates
+    :return: An array containing tempo, and an array of beats (in seconds)
+    """
+    if preset not in TEMPO_PRESETS:
+        raise ValueError(
+            "Unknown tempo preset %s, use one of %s" % (preset, TEMPO_PRESETS)
+        )
+    if len(y) == 0:
+        raise ValueError("Cannot estimate the tempo of an empty signal")
+    if tempo is not None and not MIN_BPM <= tempo <= MAX_BPM:
+        raise ValueError("Tempo %s is outside [%s, %s]" % (tempo, MIN_BPM, MAX_BPM))
+    context = context or default_context()
+    if envelope is None:
+        envelope = context.cached(
+            y, ("onset_envelope", sr), lambda: onset_envelope(y, sr)
+        )
+    if tempo is None:
+        if preset == "fast":
+            bpms, _ = tempo_candidates(envelope, sr)
+            if not len(bpms):
+                raise ValueError("Signal too short to estimate the tempo")
+            tempo = float(bpms[0])
+        else:
+            tempo = ensemble_tempo(y, sr, context)
+    phase = beat_phase(envelope, sr, tempo)
+    return tempo, beat_grid(len(y) / sr, tempo, phase)
@@ -0,0 +1,154 @@
+"""
+Thread counts of the BLAS and FFT libraries.
+
+NumPy's BLAS starts one thread per core in every process, so a pool of N worker
+processes runs N times more threads than there are cores. The threads of each
+process are set, by priority, with:
+    set_threads(n), or the --threads flag of the CLI
+    the AUTOMASHUPPER_THREADS environment variable
+The BLAS thread count goes through threadpoolctl when it is installed, and
+through the OpenMP/OpenBLAS/MKL variables inherited by child processes started
+afterwards. FFTs of the feature and correlation paths run through scipy.fft with
+fft_workers() threads, one unless configured.
+
+benchmark_splits times a job with every split of the cores between processes
+and threads, to pick the best one on a machine.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+THREADS_ENV = "AUTOMASHUPPER_THREADS"
+
+# Read by the BLAS and OpenMP runtimes when they are loaded
+BLAS_ENV = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+
+_fft_workers = None
+
+
+def fft_workers():
+    """
+    :return: The number of threads of each FFT, for the workers argument of
+    scipy.fft
+    """
+    if _fft_workers is not None:
+        return _fft_workers
+    return int(os.environ.get(THREADS_ENV, 1))
+
+
+def set_threads(n_threads=None):
+    """
+    Set the BLAS and FFT threads of this process and of the processes it starts.
+    Can be used as the initializer of a process pool
+    :param n_threads: Threads per process, read from AUTOMASHUPPER_THREADS if None
+    :return: The thread count, None if nothing was set
+    """
+    global _fft_workers
+    if n_threads is None:
+        if THREADS_ENV not in os.environ:
+            return None
+        n_threads = int(os.environ[THREADS_ENV])
+    if n_threads < 1:
+        raise ValueError("A process needs at least one thread, not %d" % n_threads)
+    for name in (THREADS_ENV,) + BLAS_ENV:
+        os.environ[name] = str(n_threads)
+    _fft_workers = n_threads
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        # Only the processes started from now on get the limit
+        pass
+    else:
+        threadpool_limits(n_threads, user_api="blas")
+    return n_threads
+
+
+def threads_per_worker(n_workers, n_cores=None):
+    """
+    Threads of each worker so that a pool uses every core once
+    :param n_workers: Number of worker processes
+    :param n_cores: Number of cores, all of them if None
+    :return: The thread count, at least one
+    """
+    return max(1, (n_cores or os.cpu_count() or 1) // n_workers)
+
+
+def stft(y, **kwargs):
+    """
+    librosa's STFT, whose FFTs run on scipy.fft, with fft_workers() threads
+    :param y: The signal
+    :param kwargs: Arguments of librosa.stft
+    :return: The complex STFT
+    """
+    import librosa
+    import scipy.fft
+
+    with scipy.fft.set_workers(fft_workers()):
+        return librosa.stft(y, **kwargs)
+
+
+def splits(n_cores=None):
+    """
+    Every way of running n_cores threads in total, as processes times threads
+    :param n_cores: Number of cores, all of them if None
+    :return: A list of (processes, threads)
+    """
+    n_cores = n_cores or os.cpu_count() or 1
+    return [(p, n_cores // p) for p in range(1, n_cores + 1) if n_cores % p == 0]
+
+
+def benchmark_splits(job, items, n_cores=None, repeat=1):
+    """
+    Time a job with each split of the cores between processes and threads
+    :param job: A picklable function taking one item
+    :param items: The items the job is mapped over, at least as many as cores
+    :param n_cores: Number of cores, all of them if None
+    :param repeat: Runs of each split, the fastest one is kept
+    :return: A list of (processes, threads, seconds), fastest first
+    """
+    timings = []
+    for n_processes, n_threads in splits(n_cores):
+        with ProcessPoolExecutor(
+            n_processes, initializer=set_threads, initargs=(n_threads,)
+        ) as executor:
+            # Start every worker before timing
+            list(executor.map(time.sleep, [0] * n_processes))
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(executor.map(job, items))
+                best = min(best, time.perf_counter() - start)
+        timings.append((n_processes, n_threads, best))
+    return sorted(timings, key=lambda timing: timing[2])
+
+
+def analysis_job(item, duration=30, sr=22050):
+    """
+    Benchmark job. Analyses a track like mashability.main, or for an integer item
+    the chroma STFT of a noise signal seeded by it, correlated with every
+    rotation of a base chroma
+    :param item: The path to a track or a seed
+    :return: A number, to keep the result alive
+    """
+    if isinstance(item, str):
+        from .features import extract_features
+
+        return float(extract_features(item).tempo)
+    import numpy as np
+
+    from .chroma import ChromaEngine
+    from .segmentation import chroma_rotations
+
+    rng = np.random.default_rng(item)
+    y = rng.standard_normal(duration * sr).astype(np.float32)
+    engine = ChromaEngine(sr)
+    chroma = engine.chroma(engine.power(y))
+    rotations = chroma_rotations(rng.random((12, 64)))
+    return float((rotations.transpose(0, 2, 1).reshape(-1, 12) @ chroma).max())
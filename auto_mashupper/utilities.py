@@ -1,8 +1,19 @@
-import essentia.standard as estd
 import numpy as np
 from librosa import core
 
-from .utilities_pyrb import change_tempo, frequency_multiply
+from .context import default_context
+from .tempo import BeatGrid, estimate_tempo, zapata14bpm
+from .utilities_pyrb import change_tempo, stretch_and_shift
+
+# Audio buffers are decoded, processed and mixed in this dtype
+AUDIO_DTYPE = np.float32
+
+# Audio decoded before and after the beats of a candidate region, in seconds
+REGION_MARGIN = 0.1
+
+# Length differences after a stretch up to this many samples (about 6 ms at
+# 44.1 kHz) are trimmed or zero padded instead of resampled
+LENGTH_TOLERANCE = 256
 
 
 def match_target_amplitude(sound, target_dBFS=0):
@@ -10,37 +21,19 @@ def match_target_amplitude(sound, target_dBFS=0):
     return sound.apply_gain(change_in_dBFS)
 
 
-def zapata14bpm(y):
-    essentia_beat = estd.BeatTrackerMultiFeature()  # type: ignore
-    mean_tick_distance = np.mean(np.diff(essentia_beat(y)[0]))
-    return 60 / mean_tick_distance
-
-
-def self_tempo_estimation(y, sr, tempo=None):
+def self_tempo_estimation(y, sr, tempo=None, preset="accurate", context=None):
     """
     A function to calculate tempo based on a confidence measure
     :param y: The audio signal to which calculate the tempo
     :param sr: The sample rate of the signal
     :param tempo: Precalculated bpm
-    :return: An array containing tempo, and an array of beats (in seconds)
-    """
-    if tempo is None:
-        confidence_estimator = estd.LoopBpmConfidence(sampleRate=sr)  # type: ignore
-        percivalbpm = int(estd.PercivalBpmEstimator(sampleRate=sr)(y))  # type: ignore
-        try:
-            zapatabpm = int(zapata14bpm(y))
-        except Exception:
-            tempo = percivalbpm
-        else:
-            confidence_zapata = confidence_estimator(y, zapatabpm)
-            confidence_percival = confidence_estimator(y, percivalbpm)
-            if confidence_percival >= confidence_zapata:
-                tempo = percivalbpm
-            else:
-                tempo = zapatabpm
-    sec_beat = 60 / tempo
-    beats = np.arange(0, len(y) / sr, sec_beat)
-    return tempo, beats
+    :param preset: "accurate" for the Percival/Zapata ensemble, "fast" for the
+    onset autocorrelation only
+    :param context: The AnalysisContext reusing algorithms and intermediates
+    :return: An array containing tempo, and an array of beats (in seconds),
+    phase-aligned with the onsets
+    """
+    return estimate_tempo(y, sr, tempo=tempo, preset=preset, context=context)
 
 
 def rotate_audio(audio, sr, n_beats):
@@ -49,23 +42,26 @@ def rotate_audio(audio, sr, n_beats):
     :param audio: The audio signal to rotate
     :param sr: The sample rate
     :param n_beats: Number of beats to rotate the audio
-    :return:
+    :return: The rotated signal
     """
-    tempo, _ = self_tempo_estimation(audio, sr)
-    samples_rotation = tempo * sr
-    n_rotations = int(samples_rotation * n_beats)
+    tempo, beats = self_tempo_estimation(audio, sr)
+    grid = BeatGrid(beats, sr, tempo)
+    n_rotations = grid.beat_to_sample(n_beats) - grid.beat_to_sample(0)
     return np.roll(audio, n_rotations)
 
 
-def adjust_tempo(song, final_tempo):
+def adjust_tempo(song, final_tempo, sr=44100):
     """
     Adjust audio to the desired tempo
-    :param song: The song which tempo should be adjusted
+    :param song: The song which tempo should be adjusted, mono or of shape
+    (n_channels, n_samples)
     :param final_tempo:
+    :param sr: The sample rate of the song
     :return:
     """
-    actual_tempo, _ = self_tempo_estimation(song, 44100)
-    song = change_tempo(song, 44100, actual_tempo, final_tempo)
+    actual_tempo, _ = self_tempo_estimation(to_mono(song), sr)
+    # Rubberband stretches every channel in one pass, with the channels last
+    song = change_tempo(song.T, sr, actual_tempo, final_tempo).T
     """
     stretch_factor = final_tempo/actual_tempo
     if stretch_factor != 1:
@@ -115,60 +111,332 @@ def stretch(x, factor, nfft=2048):
     return core.istft(stft_new.transpose())
 
 
-def mix_songs(main_song, cand_song, beat_offset, pitch_shift):
+def load_song(song, sr=44100, copy=True, mono=True):
     """
-    Mixes two loops with a given beat_offset and a pitch_shift (applied to the candidate song)
-    :param main_song: The path to the main loop or numpy array
-    :param cand_song: The path to the candidate loop or numpy array
-    :param beat_offset: The beat offset
+    Load a song for mixing
+    :param song: The path to the song or numpy array
+    :param sr: The sample rate to load the song at
+    :param copy: Copy a numpy array given by the caller, so the result can be
+    modified in place. With False an AUDIO_DTYPE array is returned as is, and must
+    be treated as read-only. A decoded file is never copied
+    :param mono: Downmix a decoded file. Without it a multichannel file has shape
+    (n_channels, n_samples). Arrays are taken as they are
+    :return: The signal as AUDIO_DTYPE
+    """
+    if isinstance(song, str):
+        song, _ = core.load(song, sr=sr, mono=mono)
+        copy = False
+    # Assume it's already a numpy array
+    if copy:
+        return np.array(song, dtype=AUDIO_DTYPE)
+    return np.asarray(song, dtype=AUDIO_DTYPE)
+
+
+def load_region(song, sr=44100, offset=0.0, duration=None, mono=True):
+    """
+    Decode part of a song only. Formats soundfile reads (WAV, FLAC, OGG, MP3...)
+    are seeked to the offset without decoding what comes before, the others go
+    through librosa with the same offset and duration
+    :param song: The path to the song
+    :param sr: The sample rate to load the song at
+    :param offset: The start of the region in seconds
+    :param duration: The duration of the region in seconds, until the end if None
+    :param mono: Downmix the region, see load_song
+    :return: The region as AUDIO_DTYPE
+    """
+    import soundfile as sf
+
+    try:
+        file_sr = sf.info(song).samplerate
+    except RuntimeError:
+        y, _ = core.load(song, sr=sr, mono=mono, offset=offset, duration=duration)
+        return np.asarray(y, dtype=AUDIO_DTYPE)
+    start = int(round(offset * file_sr))
+    frames = -1 if duration is None else int(round(duration * file_sr))
+    y, _ = sf.read(song, start=start, frames=frames, dtype="float32", always_2d=True)
+    # Channels first like librosa, and 1-D for mono files
+    y = y.T
+    if mono or y.shape[0] == 1:
+        y = to_mono(y)
+    if file_sr != sr:
+        y = core.resample(y, orig_sr=file_sr, target_sr=sr)
+    return np.asarray(y, dtype=AUDIO_DTYPE)
+
+
+def load_candidate_region(cand_song, sr, beat_offset, n_beats, cand_beats, mono=True):
+    """
+    Load a candidate for align_candidate. A file whose beat times are known is
+    only decoded around the beats that go over the main loop
+    :param cand_song: The path to the candidate or numpy array
+    :param sr: The sample rate to load the candidate at
+    :param beat_offset: The beat of the candidate the main loop starts on
+    :param n_beats: The number of beats of the main loop
+    :param cand_beats: The beat times of the candidate in seconds, or None
+    :param mono: Downmix the candidate, see load_song
+    :return: (signal, beat times relative to the start of the signal)
+    """
+    in_grid = cand_beats is not None and beat_offset + n_beats < len(cand_beats)
+    if not isinstance(cand_song, str) or not in_grid:
+        # Offsets running past the last beat may count the beats around
+        return load_song(cand_song, sr, copy=False, mono=mono), cand_beats
+    grid = BeatGrid(cand_beats, sr)
+    start, end = grid.beat_to_time([beat_offset, beat_offset + n_beats])
+    # On a sample, so the beat times stay aligned with the decoded samples
+    offset = np.floor(max(start - REGION_MARGIN, 0) * sr) / sr
+    y = load_region(cand_song, sr, offset, end + REGION_MARGIN - offset, mono)
+    return y, grid.beats - offset
+
+
+def to_mono(y):
+    """
+    Downmix a signal for analysis
+    :param y: A mono signal, or a multichannel one of shape (n_channels, n_samples)
+    :return: The mono signal, y itself if it already is
+    """
+    return y if y.ndim == 1 else np.mean(y, axis=0, dtype=y.dtype)
+
+
+def match_channels(y, like):
+    """
+    Give a signal the channels of another one
+    :param y: A mono signal, or a multichannel one of shape (n_channels, n_samples)
+    :param like: The signal whose channels are matched
+    :return: y downmixed if like is mono or has other channels, and a mono signal
+    broadcast (not copied) to the channels of like
+    """
+    if y.ndim > 1 and (like.ndim == 1 or y.shape[0] != like.shape[0]):
+        y = to_mono(y)
+    if y.ndim == 1 and like.ndim > 1:
+        y = np.broadcast_to(y, (like.shape[0], len(y)))
+    return y
+
+
+def peak(y):
+    """
+    :param y: An audio signal
+    :return: The absolute peak of the signal, 1 for a silent one
+    """
+    # max and min do not allocate a temporary like abs would
+    y_peak = max(y.max(), -y.min()) if y.size else 0
+    return y_peak if y_peak > 0 else 1
+
+
+def tuning_frequency(y, sr=44100, context=None):
+    """
+    Mean tuning frequency of a signal
+    :param y: The mono signal
+    :param sr: The sample rate of the signal. Essentia's extractor has no sample
+    rate parameter, so other rates are resampled to 44100 Hz
+    :param context: The AnalysisContext owning the extractor
+    :return: The tuning frequency in Hz
+    """
+    if sr != 44100:
+        y = core.resample(y, orig_sr=sr, target_sr=44100)
+    extractor = (context or default_context()).algorithm("TuningFrequencyExtractor")
+    return np.mean(extractor(y))
+
+
+def fit_length(y, length, max_denominator=1000):
+    """
+    Bring a stretched signal to an exact length. Small residuals are trimmed or
+    zero padded, larger ones are resampled with a polyphase filter at the closest
+    rational ratio
+    :param y: The signal, mono or of shape (n_channels, n_samples)
+    :param length: The number of samples
+    :param max_denominator: Largest up or down factor of the polyphase filter
+    :return: The signal as AUDIO_DTYPE, with exactly length samples
+    """
+    n = y.shape[-1]
+    if n and abs(n - length) > LENGTH_TOLERANCE:
+        from fractions import Fraction
+
+        from scipy.signal import resample_poly
+
+        ratio = Fraction(length, n).limit_denominator(max_denominator)
+        y = resample_poly(y, ratio.numerator, ratio.denominator, axis=-1)
+        n = y.shape[-1]
+    if n >= length:
+        return np.asarray(y[..., :length], dtype=AUDIO_DTYPE)
+    padding = [(0, 0)] * (y.ndim - 1) + [(0, length - n)]
+    return np.pad(np.asarray(y, dtype=AUDIO_DTYPE), padding)
+
+
+def align_candidate(
+    cand_song,
+    beat_offset,
+    pitch_shift,
+    final_tempo,
+    final_len,
+    tunning_main,
+    sr=44100,
+    tunning_cand=None,
+    cand_beats=None,
+    mono=True,
+):
+    """
+    Cut the beats of a candidate that go over the main loop, then stretch and
+    pitch shift them so they match it
+    :param cand_song: The path to the candidate, or its signal, mono or of shape
+    (n_channels, n_samples)
+    :param beat_offset: The beat of the candidate the main loop starts on
     :param pitch_shift: The pitch shift
-    :return: The resulting signal of the audio mixing with sr=44100
-    """
-    sr = 44100
-
-    # Handle both file paths and numpy arrays
-    if isinstance(main_song, str):
-        main_song, _ = core.load(main_song, sr=sr, mono=True)
-    else:
-        # Assume it's already a numpy array
-        main_song = np.array(main_song)
-
-    if isinstance(cand_song, str):
-        cand_song, _ = core.load(cand_song, sr=sr, mono=True)
-    else:
-        # Assume it's already a numpy array
-        cand_song = np.array(cand_song)
-    # Make everything mono
-    final_tempo, _ = self_tempo_estimation(main_song, sr)
-    final_len = len(main_song)
-
-    beat_sr = final_tempo / (60 * sr)  # Number of samples per beat
-    cand_song = cand_song[
-        int(beat_offset * beat_sr) : int(beat_offset * beat_sr + final_len)
-    ]
+    :param final_tempo: The tempo of the main loop
+    :param final_len: The length of the main loop in samples
+    :param tunning_main: The tuning frequency of the main loop
+    :param sr: The sample rate
+    :param tunning_cand: The tuning frequency of the candidate, e.g. from its
+    TrackFeatures. Estimated on the cut candidate if None
+    :param cand_beats: The beat times of the candidate in seconds, e.g. from its
+    TrackFeatures. Estimated if None, otherwise only the needed region of a file
+    is decoded
+    :param mono: Downmix the candidate if it is a file
+    :return: The candidate signal with the channels of cand_song, final_len
+    samples long
+    """
+    # As many candidate beats as the main loop lasts, only those are stretched
+    n_beats = final_len / sr * final_tempo / 60
+    cand_song, cand_beats = load_candidate_region(
+        cand_song, sr, beat_offset, n_beats, cand_beats, mono
+    )
+    cand_tempo = None
+    if cand_beats is None:
+        cand_tempo, cand_beats = self_tempo_estimation(to_mono(cand_song), sr)
+    grid = BeatGrid(cand_beats, sr, cand_tempo)
+    start = beat_offset
+    cut = grid.slice_beats(cand_song, start, n_beats)
+    if cut.shape[-1] == 0:
+        # Past the end of the candidate, its beats are counted around as a loop's
+        start = beat_offset % len(grid)
+        cut = grid.slice_beats(cand_song, start, n_beats)
+    cand_song = cut
+    if cand_song.shape[-1] == 0:
+        raise ValueError("The beat offset is past the end of the candidate")
+    # The tempo comes from the beats, a cut clipped by the end of the candidate
+    # keeps it and leaves silence at the end of the loop
+    span = grid.beat_to_sample(start + n_beats) - grid.beat_to_sample(start)
+    ratio = final_len / span
     # cand_song = effects.pitch_shift(cand_song, sr, -pitch_shift)
-    tunning = np.mean(estd.TuningFrequencyExtractor()(cand_song))  # type: ignore
-    tunning_main = np.mean(estd.TuningFrequencyExtractor()(main_song))  # type: ignore
-    cand_song = adjust_tempo(cand_song, final_tempo)
+    tunning = tunning_cand or tuning_frequency(to_mono(cand_song), sr)
     factor_tuning = tunning / tunning_main
     pitch_factor = factor_tuning * np.exp2(-pitch_shift / 12)
-    cand_song = frequency_multiply(cand_song, 44100, pitch_factor)
-    cand_song = core.resample(
-        cand_song,
-        orig_sr=44100,
-        target_sr=44100 / cand_song.shape[0] * main_song.shape[0],
-    )
-    try:
-        aux = np.zeros(main_song.shape[0])
-        aux[: cand_song.shape[0]] = cand_song
-        cand_song = aux
-    except ValueError:
-        aux = np.zeros(cand_song.shape[0])
-        aux[: main_song.shape[0]] = main_song
-        main_song = aux
-    cand_song = cand_song.astype("float32")
+    # A single rubberband pass stretches the cut straight to the length of the
+    # main loop and shifts its pitch, so no resample changes the pitch afterwards
+    n_samples = min(final_len, int(round(cand_song.shape[-1] * ratio)))
+    cand_song = stretch_and_shift(cand_song.T, sr, ratio, pitch_factor).T
+    cand_song = fit_length(cand_song, n_samples)
+    if n_samples < final_len:
+        padding = [(0, 0)] * (cand_song.ndim - 1) + [(0, final_len - n_samples)]
+        cand_song = np.pad(cand_song, padding)
+    return cand_song
+
+
+def iter_mixes(main_song, candidates, sr=44100, out=None, tunning_main=None, mono=True):
+    """
+    Mix several candidates over the same main loop. The main loop is loaded and
+    analysed once, and every mix is written in place into a preallocated buffer.
+    The main loop and the candidates are only read, so arrays given by the caller
+    are never copied: besides the output of align_candidate, the only audio sized
+    allocation is the buffer when out is None
+    :param main_song: The path to the main loop or numpy array, mono or of shape
+    (n_channels, n_samples)
+    :param candidates: Iterable of (cand_song, beat_offset, pitch_shift), followed
+    by the tuning frequency and the beat times of the candidate when known, see
+    align_candidate
+    :param sr: The sample rate to load the songs at, or of the numpy arrays
+    :param out: Optional array of shape (n_candidates,) + main_song.shape receiving
+    the mixes. Without it a single buffer is reused, so each yielded mix is only
+    valid until the next one
+    :param tunning_main: The tuning frequency of the main loop, estimated if None
+    :param mono: Downmix the files. Without it the mixes keep the channels of the
+    main loop, the analysis runs on a downmix
+    :return: A generator of mixes, each with the shape of the main loop
+    """
+    main_song = load_song(main_song, sr, copy=False, mono=mono)
+    analysis_song = to_mono(main_song)
+    final_tempo, _ = self_tempo_estimation(analysis_song, sr)
+    tunning_main = tunning_main or tuning_frequency(analysis_song, sr)
+    final_len = main_song.shape[-1]
     # main_song_replaygain = estd.ReplayGain()(main_song)
     # cand_song = estd.EqloudLoader(replayGain=main_song_replaygain)(cand_song)
-    cand_song = cand_song / max(cand_song)
-    main_song = main_song / max(main_song)
-    return cand_song * 0.5 + main_song * 0.5
+    main_gain = 0.5 / peak(main_song)
+    buffer = np.empty(main_song.shape, dtype=AUDIO_DTYPE) if out is None else None
+    for i, (cand_song, beat_offset, pitch_shift, *known) in enumerate(candidates):
+        cand_song = align_candidate(
+            cand_song,
+            beat_offset,
+            pitch_shift,
+            final_tempo,
+            final_len,
+            tunning_main,
+            sr,
+            *known,
+            mono=mono,
+        )
+        cand_song = match_channels(cand_song, main_song)
+        mix = buffer if out is None else out[i]
+        n = min(final_len, cand_song.shape[-1])
+        mix[..., :n] = cand_song[..., :n]
+        mix[..., n:] = 0
+        # 0.5 * cand / peak(cand) + main_gain * main, without scaling a copy of main
+        mix *= 0.5 / peak(mix) / main_gain
+        mix += main_song
+        mix *= main_gain
+        yield mix
+
+
+def render_mixes(
+    main_song, candidates, sr=44100, out=None, tunning_main=None, mono=True
+):
+    """
+    Render N mixes of the same main loop into one array
+    :param main_song: The path to the main loop or numpy array
+    :param candidates: Sequence of (cand_song, beat_offset, pitch_shift), followed
+    by the tuning frequency and the beat times of the candidate when known
+    :param sr: The sample rate to load the songs at, or of the numpy arrays
+    :param out: Optional preallocated array of shape
+    (n_candidates,) + main_song.shape
+    :param tunning_main: The tuning frequency of the main loop, estimated if None
+    :param mono: Downmix the files, see iter_mixes
+    :return: Array of shape (n_candidates,) + main_song.shape with one mix per row
+    """
+    main_song = load_song(main_song, sr, copy=False, mono=mono)
+    candidates = list(candidates)
+    if out is None:
+        out = np.empty((len(candidates),) + main_song.shape, dtype=AUDIO_DTYPE)
+    for _ in iter_mixes(
+        main_song, candidates, sr, out=out, tunning_main=tunning_main, mono=mono
+    ):
+        pass
+    return out
+
+
+def mix_songs(
+    main_song,
+    cand_song,
+    beat_offset,
+    pitch_shift,
+    sr=44100,
+    tunning_main=None,
+    tunning_cand=None,
+    mono=True,
+    cand_beats=None,
+):
+    """
+    Mixes two loops with a given beat_offset and a pitch_shift (applied to the candidate song)
+    :param main_song: The path to the main loop or numpy array
+    :param cand_song: The path to the candidate loop or numpy array
+    :param beat_offset: The beat offset
+    :param pitch_shift: The pitch shift
+    :param sr: The sample rate to load the songs at, or of the numpy arrays
+    :param tunning_main: The tuning frequency of the main loop, e.g. the tuning of
+    its TrackFeatures. Estimated if None
+    :param tunning_cand: The tuning frequency of the candidate. Estimated if None
+    :param mono: Downmix the files. Without it the mix keeps the channels of the
+    main loop, with shape (n_channels, n_samples)
+    :param cand_beats: The beat times of the candidate in seconds. Estimated if None
+    :return: The resulting signal of the audio mixing at sample rate sr
+    """
+    candidate = (cand_song, beat_offset, pitch_shift, tunning_cand, cand_beats)
+    return render_mixes(
+        main_song, [candidate], sr, tunning_main=tunning_main, mono=mono
+    )[0]
@@ -86,3 +86,44 @@ def frequency_multiply(y, sr, X, rbargs=None):
     rbargs.setdefault("--frequency", X)
 
     return pyrb.__rubberband(y, sr, **rbargs)
+
+
+def stretch_and_shift(y, sr, ratio, X, rbargs=None):
+    """Stretch an audio time series and multiply its frequencies in one pass.
+    The equivalent of the --time <ratio> and -f <X> options together.
+
+    Parameters
+    ----------
+    y : np.ndarray [shape=(n,) or (n, c)]
+        Audio time series, either single or multichannel
+
+    sr : int > 0
+        Sampling rate of `y`
+
+    ratio : float > 0
+        Stretch to `ratio` times the original duration
+
+    X : float
+        Shift magnitudes in spectrum by X
+
+    rbargs
+        Additional keyword parameters for rubberband
+
+        See `rubberband -h` for details.
+
+    Returns
+    -------
+    y_stretch : np.ndarray
+        time-stretched and frequency-multiplied audio
+    """
+
+    if ratio <= 0:
+        raise ValueError("ratio must be strictly positive")
+
+    if rbargs is None:
+        rbargs = dict()
+
+    rbargs.setdefault("--time", ratio)
+    rbargs.setdefault("--frequency", X)
+
+    return pyrb.__rubberband(y, sr, **rbargs)
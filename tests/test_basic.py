@@ -217,3 +217,55 @@ class TestIntegration:
         """Test full mashup generation workflow"""
         # This would test the complete generation workflow
         pass
+
+
+def import_profile(module):
+    """
+    Import a module in a fresh interpreter with -X importtime
+    :return: (cumulative import time of the module in microseconds, imported names)
+    """
+    import subprocess
+    import sys
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % module],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times[module], set(times)
+
+
+class TestImportTime:
+    """Test that importing the package does not pull the analysis stack"""
+
+    HEAVY = {"essentia", "librosa", "madmom", "matplotlib", "scipy.stats"}
+
+    @pytest.mark.parametrize(
+        "module", ["auto_mashupper", "auto_mashupper.cli", "auto_mashupper.server"]
+    )
+    def test_light_modules(self, module):
+        """Test that the package, the CLI and the job server import no audio stack"""
+        cumulative, imported = import_profile(module)
+
+        assert not imported & self.HEAVY
+        # Generous bound, a few ms on a laptop
+        assert cumulative < 1_000_000
+
+    def test_beat_sync_features_skip_plotting_and_downbeats(self):
+        """Test that the beat-sync feature path does not import madmom or matplotlib"""
+        try:
+            import librosa  # noqa: F401
+        except ImportError as e:
+            pytest.skip(f"Feature dependencies not available: {e}")
+
+        _, imported = import_profile("auto_mashupper.features")
+
+        assert "auto_mashupper.segmentation" in imported
+        assert not imported & {"essentia", "madmom", "matplotlib", "scipy.stats"}
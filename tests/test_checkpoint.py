@@ -0,0 +1,78 @@
+"""
+Tests for the checkpoints of mashability scans
+"""
+
+import pytest
+
+SETTINGS = {"base_song": "base.mp3", "analysis_sr": None, "tempo_preset": "accurate"}
+
+
+class TestScanLog:
+    """Test appending to and resuming from a scan log"""
+
+    def test_resume_reads_the_last_records(self, tmp_path):
+        """Test that a resumed log holds the last record of each candidate"""
+        try:
+            from auto_mashupper.checkpoint import ScanLog
+
+            path = str(tmp_path / "base.scan.jsonl")
+            with ScanLog(path, SETTINGS, sync_every=2) as log:
+                log.record("loops/a.mp3", (0.5, 1, 3, 0.4, 0.9), (440.5, 0.1, 0.5, 16))
+                log.record("loops/b.mp3", (0.1, 0, 0, 0.1, 0.1), (442.0, 0.0, 0.4, 9))
+                log.record_error("loops/b.mp3", "EOF error")
+                log.record_error("loops/c.mp3", "EOF error")
+                log.record("loops/c.mp3", (0.25, -2, 0, 0.5, 0.5))
+                # Appended records are not kept in memory
+                assert log.scores == log.tracks == log.errors == {}
+
+            resumed = ScanLog(path, SETTINGS, resume=True)
+            resumed.close()
+            fresh = ScanLog(path, SETTINGS)
+            fresh.close()
+
+            assert resumed.scores == {
+                "loops/a.mp3": [0.5, 1, 3, 0.4, 0.9],
+                "loops/c.mp3": [0.25, -2, 0, 0.5, 0.5],
+            }
+            assert resumed.errors == {"loops/b.mp3": "EOF error"}
+            assert resumed.tracks == {"loops/a.mp3": [440.5, 0.1, 0.5, 16]}
+            assert fresh.scores == {} and fresh.errors == {}
+
+        except ImportError as e:
+            pytest.skip(f"Checkpoint dependencies not available: {e}")
+
+    def test_resume_drops_a_torn_record(self, tmp_path):
+        """Test that a record cut short by a crash is dropped and overwritten"""
+        try:
+            from auto_mashupper.checkpoint import ScanLog
+
+            path = tmp_path / "base.scan.jsonl"
+            with ScanLog(str(path), SETTINGS) as log:
+                log.record("loops/a.mp3", (0.5, 1, 3, 0.4, 0.9))
+            with open(path, "a") as f:
+                f.write('{"song": "loops/b.mp3", "sco')
+
+            with ScanLog(str(path), SETTINGS, resume=True) as log:
+                assert list(log.scores) == ["loops/a.mp3"]
+                log.record_error("loops/b.mp3", "EOF error")
+
+            with ScanLog(str(path), SETTINGS, resume=True) as log:
+                assert log.errors == {"loops/b.mp3": "EOF error"}
+            assert len(path.read_text().splitlines()) == 3
+
+        except ImportError as e:
+            pytest.skip(f"Checkpoint dependencies not available: {e}")
+
+    def test_resume_checks_the_settings(self, tmp_path):
+        """Test that a scan does not resume from the log of another one"""
+        try:
+            from auto_mashupper.checkpoint import ScanLog
+
+            path = str(tmp_path / "base.scan.jsonl")
+            ScanLog(path, SETTINGS).close()
+
+            with pytest.raises(ValueError):
+                ScanLog(path, dict(SETTINGS, analysis_sr=22050), resume=True)
+
+        except ImportError as e:
+            pytest.skip(f"Checkpoint dependencies not available: {e}")
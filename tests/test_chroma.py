@@ -0,0 +1,180 @@
+"""
+Tests for the whole-track chroma engine
+"""
+
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def filterbanks(monkeypatch):
+    """An empty filterbank cache, restored afterwards"""
+    from auto_mashupper import chroma
+
+    monkeypatch.setattr(chroma, "_filterbanks", {})
+    monkeypatch.delenv("AUTOMASHUPPER_FILTERBANK_CACHE", raising=False)
+    return chroma
+
+
+def tone(frequency, seconds=4, sr=22050):
+    t = np.arange(int(seconds * sr)) / sr
+    return (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+class TestFilterbank:
+    """Test building and sharing chroma filterbanks"""
+
+    def test_filterbank_is_built_once(self, filterbanks):
+        """Test that a filterbank is librosa's, built once and read-only"""
+        try:
+            from librosa import filters
+
+            filterbank = filterbanks.chroma_filterbank(22050, 2048, tuning=-0.004)
+
+            np.testing.assert_allclose(
+                filterbank, filters.chroma(sr=22050, n_fft=2048, tuning=0.0)
+            )
+            assert filterbank.dtype == np.float32
+            assert not filterbank.flags.writeable
+            assert filterbanks.chroma_filterbank(22050, 2048, 0.0) is filterbank
+            assert filterbanks.chroma_filterbank(22050, 2048, 0.1) is not filterbank
+
+        except ImportError as e:
+            pytest.skip(f"Chroma dependencies not available: {e}")
+
+    def test_filterbank_is_shared_through_the_cache_dir(self, filterbanks, tmp_path):
+        """Test that another process finds the filterbank in the cache directory"""
+        try:
+            built = filterbanks.chroma_filterbank(44100, 4096, 0.25, str(tmp_path))
+            assert (tmp_path / "chroma-44100-4096-+0.25.npy").exists()
+
+            # A fresh process only has the directory
+            filterbanks._filterbanks.clear()
+            with patch("librosa.filters.chroma") as build:
+                loaded = filterbanks.chroma_filterbank(44100, 4096, 0.25, str(tmp_path))
+
+            build.assert_not_called()
+            np.testing.assert_array_equal(loaded, built)
+
+        except ImportError as e:
+            pytest.skip(f"Chroma dependencies not available: {e}")
+
+
+class TestChromaEngine:
+    """Test the chroma of whole tracks pooled into beats"""
+
+    @pytest.mark.dependency
+    def test_frames_match_chroma_stft(self, filterbanks):
+        """Test the frame chroma against librosa's chroma_stft"""
+        try:
+            from librosa import feature
+
+            rng = np.random.default_rng(0)
+            y = rng.standard_normal(22050 * 2).astype(np.float32)
+            engine = filterbanks.ChromaEngine(22050, tuning=0.0)
+            power = engine.power(y)
+
+            np.testing.assert_allclose(
+                engine.chroma(power),
+                feature.chroma_stft(S=power, sr=22050, tuning=0.0),
+                rtol=1e-4,
+                atol=1e-6,
+            )
+
+        except ImportError as e:
+            pytest.skip(f"Chroma dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_beats_pool_their_frames(self, filterbanks):
+        """Test that each beat averages the frames centred in it"""
+        try:
+            y = np.concatenate([tone(440.0, 2), tone(261.63, 2)])
+            engine = filterbanks.ChromaEngine(22050, tuning=0.0)
+            boundaries = np.arange(0, 4.5, 0.5)
+
+            chroma, mean_power = engine.beat_sync_chroma(y, boundaries)
+
+            assert chroma.shape == (12, 8)
+            assert list(np.argmax(chroma, axis=0)) == [9] * 4 + [0] * 4
+            assert mean_power.shape == (1025,)
+            frames = engine.chroma(engine.power(y))
+            # Frame 44 is the first one centred after 1 second
+            np.testing.assert_allclose(
+                chroma[:, 2], frames[:, 44:65].mean(axis=1), rtol=1e-5
+            )
+
+        except ImportError as e:
+            pytest.skip(f"Chroma dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_public_chroma_shares_the_engine(self, filterbanks, tmp_path):
+        """Test that get_beat_sync_chroma pools like beat_sync_features"""
+        try:
+            import soundfile
+            from librosa import filters
+
+            from auto_mashupper import segmentation
+
+            y = np.concatenate([tone(440.0, 2), tone(261.63, 2)])
+            path = str(tmp_path / "track.wav")
+            soundfile.write(path, y, 22050)
+            # Not a multiple of 4, beat_sync_features keeps the boundaries as is
+            beats = np.arange(0, 3.5, 0.5)
+
+            estimate = patch.object(
+                segmentation, "self_tempo_estimation", return_value=(120.0, beats)
+            )
+            with estimate:
+                with patch.object(filters, "chroma", wraps=filters.chroma) as build:
+                    chroma = segmentation.get_beat_sync_chroma(path, sr=22050)
+                    expected, _, _ = segmentation.beat_sync_features(y, 22050, beats)
+
+            assert chroma.shape == (12, 6)
+            np.testing.assert_allclose(chroma, expected, rtol=1e-5, atol=1e-6)
+            assert build.call_count == 1
+
+        except ImportError as e:
+            pytest.skip(f"Chroma dependencies not available: {e}")
+
+    def test_beat_frames_at_the_edges(self, filterbanks):
+        """Test beats past the end of the signal and shorter than a hop"""
+        starts, ends = filterbanks.beat_frames(
+            [0.0, 0.5, 0.501, 1.0, 9.0], 22050, n_frames=44
+        )
+
+        np.testing.assert_array_equal(starts, [0, 22, 22, 43])
+        np.testing.assert_array_equal(ends, [22, 23, 44, 44])
+
+
+@pytest.mark.slow
+@pytest.mark.dependency
+class TestChromaPerformance:
+    """Test the cost of the chroma engine"""
+
+    def test_whole_track_beats_per_beat_stfts(self, filterbanks):
+        """Test that a track takes one STFT and one filterbank, whatever its beats"""
+        try:
+            from librosa import feature, filters
+
+            y = np.random.default_rng(1).standard_normal(22050 * 30)
+            y = y.astype(np.float32)
+            boundaries = np.arange(0, 30, 0.5)
+
+            stft = filterbanks.threads.stft
+            with patch.object(filterbanks.threads, "stft", wraps=stft) as stfts:
+                with patch.object(filters, "chroma", wraps=filters.chroma) as build:
+                    with patch.object(feature, "chroma_stft") as chroma_stft:
+                        engine = filterbanks.ChromaEngine(22050)
+                        chroma, _ = engine.beat_sync_chroma(y, boundaries)
+                        filterbanks.ChromaEngine(22050).beat_sync_chroma(y, boundaries)
+
+            assert chroma.shape == (12, len(boundaries) - 1)
+            # One STFT per track, and the filterbank is shared between tracks
+            assert stfts.call_count == 2
+            assert build.call_count == 1
+            chroma_stft.assert_not_called()
+
+        except ImportError as e:
+            pytest.skip(f"Chroma dependencies not available: {e}")
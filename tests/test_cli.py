@@ -3,7 +3,7 @@ Tests for CLI functionality
 """
 
 import pytest
-from unittest.mock import patch
+from unittest.mock import DEFAULT, patch
 
 
 class TestCLICommands:
@@ -77,6 +77,73 @@ class TestCLIMashabilityCommand:
             captured = capsys.readouterr()
             assert "dependencies not available" in captured.err.lower()
 
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            ["a/base.mp3", "a/other.mp3", "--tempo-tolerance", "0.08"],
+            ["a/base.mp3", "-o", "scores.npz", "--max-key-shift", "2"],
+            ["a/base.mp3", "--work-dir", "scan", "--tempo-tolerance", "0.08"],
+            ["a/base.mp3", "a/other.mp3", "--workers", "4"],
+            ["a/base.mp3", "--work-dir", "scan", "--workers", "4", "--top-k", "9"],
+            ["a/base.mp3", "a/other.mp3", "--checkpoint"],
+            ["a/base.mp3", "--work-dir", "scan", "--resume"],
+            ["a/base.mp3", "--work-dir", "scan", "--merge", "--retry-failed"],
+            ["a/base.mp3", "-o", "scores.npz", "--resume"],
+        ],
+    )
+    def test_flags_of_single_scans_are_rejected(self, argv, capsys):
+        """Test that flags which would be ignored are an error"""
+        from auto_mashupper.cli import main
+
+        with patch("sys.argv", ["automashupper", "mashability"] + argv):
+            with patch.multiple(
+                "auto_mashupper.mashability", main=DEFAULT, main_many=DEFAULT
+            ) as mains:
+                with pytest.raises(SystemExit) as excinfo:
+                    main()
+
+        assert excinfo.value.code == 1
+        assert "only apply to the scan of one base song" in capsys.readouterr().err
+        mains["main"].assert_not_called()
+        mains["main_many"].assert_not_called()
+
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            ["a/base.mp3", "--merge"],
+            ["a/base.mp3", "--shards", "64"],
+            ["a/base.mp3", "a/other.mp3", "--stale-after", "600"],
+        ],
+    )
+    def test_flags_of_sharded_scans_are_rejected(self, argv, capsys):
+        """Test that shard flags without --work-dir are an error"""
+        from auto_mashupper.cli import main
+
+        with patch("sys.argv", ["automashupper", "mashability"] + argv):
+            with patch.multiple(
+                "auto_mashupper.mashability", main=DEFAULT, main_many=DEFAULT
+            ) as mains:
+                with pytest.raises(SystemExit) as excinfo:
+                    main()
+
+        assert excinfo.value.code == 1
+        assert "only apply to a sharded scan" in capsys.readouterr().err
+        mains["main"].assert_not_called()
+        mains["main_many"].assert_not_called()
+
+    @patch("sys.argv", ["automashupper", "mashability", "a/base.mp3", "--top-k", "9"])
+    def test_top_k_takes_workers(self, capsys):
+        """Test that --top-k without the streaming scan is an error"""
+        from auto_mashupper.cli import main
+
+        with patch("auto_mashupper.mashability.main") as scan:
+            with pytest.raises(SystemExit) as excinfo:
+                main()
+
+        assert excinfo.value.code == 1
+        assert "--top-k takes --workers" in capsys.readouterr().err
+        scan.assert_not_called()
+
 
 class TestCLIGenerateCommand:
     """Test generate CLI command"""
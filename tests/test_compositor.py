@@ -0,0 +1,199 @@
+"""
+Tests for the multi-song mashup compositor
+"""
+
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+
+
+def fake_align(
+    cand_song, beat_offset, pitch_shift, final_tempo, final_len, *args, **kwargs
+):
+    """Stand-in for the rubberband based alignment"""
+    return cand_song[beat_offset : beat_offset + final_len]
+
+
+@pytest.fixture
+def songs():
+    rng = np.random.default_rng(0)
+    base = rng.random(44100) - 0.5
+    cands = [rng.random(50000) - 0.5 for _ in range(3)]
+    return base, cands
+
+
+def compose(*args, **kwargs):
+    from auto_mashupper.compositor import compose_mashup
+
+    with patch.multiple(
+        "auto_mashupper.compositor",
+        align_candidate=fake_align,
+        self_tempo_estimation=MagicMock(return_value=(120, None)),
+    ):
+        return compose_mashup(*args, **kwargs)
+
+
+class TestComposeMashup:
+    """Test stacking layers over a base loop"""
+
+    @pytest.mark.dependency
+    def test_layers_are_summed_with_gain_and_placement(self, songs):
+        """Test that each layer lands at its start beat with its gain"""
+        try:
+            from auto_mashupper.compositor import Layer
+            from auto_mashupper.utilities import peak
+
+            base, cands = songs
+            layers = [
+                Layer(cands[0], gain=0.2),
+                Layer(cands[1], beat_offset=10, gain=0.3, start_beat=1),
+            ]
+
+            mix = compose(base, layers, base_gain=0.5)
+
+            start = 22050  # One beat at 120 bpm
+            expected = 0.5 * base / peak(base)
+            expected += 0.2 * cands[0][:44100] / peak(cands[0][:44100])
+            second = cands[1][10 : 10 + 44100 - start]
+            expected[start:] += 0.3 * second / peak(second)
+            assert mix.shape == base.shape
+            assert mix.dtype == np.float32
+            np.testing.assert_allclose(mix, expected, rtol=1e-5, atol=1e-6)
+
+        except ImportError as e:
+            pytest.skip(f"Compositor dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_layers_start_on_the_beats_of_the_base(self, songs):
+        """Test that start beats follow the base beats, not its first sample"""
+        try:
+            from auto_mashupper.compositor import Layer, compose_mashup
+            from auto_mashupper.utilities import peak
+
+            base, cands = songs
+            # The first beat of the base comes 0.1 s in, at 120 bpm
+            beats = 0.1 + 0.5 * np.arange(2)
+            layers = [
+                Layer(cands[0], gain=0.2),
+                Layer(cands[1], gain=0.3, start_beat=1),
+            ]
+
+            with patch.multiple(
+                "auto_mashupper.compositor",
+                align_candidate=fake_align,
+                self_tempo_estimation=MagicMock(return_value=(120, beats)),
+            ):
+                mix = compose_mashup(base, layers, base_gain=0.5)
+
+            first, start = 4410, 4410 + 22050
+            expected = 0.5 * base / peak(base)
+            layer = cands[0][: 44100 - first]
+            expected[first:] += 0.2 * layer / peak(layer)
+            layer = cands[1][: 44100 - start]
+            expected[start:] += 0.3 * layer / peak(layer)
+            np.testing.assert_allclose(mix, expected, rtol=1e-5, atol=1e-6)
+
+        except ImportError as e:
+            pytest.skip(f"Compositor dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_stereo_base_keeps_its_channels(self, songs):
+        """Test that a stereo base gets mono layers on both channels"""
+        try:
+            from auto_mashupper.compositor import Layer
+            from auto_mashupper.utilities import peak
+
+            base, cands = songs
+            base = np.stack([base, np.roll(base, 100)])
+            layers = [Layer(c, gain=0.2) for c in cands[:2]]
+
+            mix = compose(base, layers, base_gain=0.5)
+
+            assert mix.shape == base.shape
+            base_part = 0.5 * base / peak(base)
+            np.testing.assert_allclose(
+                mix[0] - mix[1], base_part[0] - base_part[1], atol=1e-6
+            )
+
+        except ImportError as e:
+            pytest.skip(f"Compositor dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_parallel_rendering_matches_serial(self, songs):
+        """Test that rendering layers in parallel gives the same mix"""
+        try:
+            from auto_mashupper.compositor import Layer
+
+            base, cands = songs
+            layers = [Layer(c, beat_offset=i) for i, c in enumerate(cands)]
+
+            serial = compose(base, layers, n_jobs=1)
+            parallel = compose(base, layers, n_jobs=3)
+
+            np.testing.assert_array_equal(serial, parallel)
+            assert np.max(np.abs(parallel)) <= 1
+
+        except ImportError as e:
+            pytest.skip(f"Compositor dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_layers_from_csv(self, tmp_path):
+        """Test reading the top ranked candidates of a mashability csv"""
+        try:
+            from auto_mashupper.compositor import layers_from_csv
+
+            csv_path = tmp_path / "base.csv"
+            csv_path.write_text(
+                "file,mashability,pitch_shift,beat_offset,h_contr,r_contr\n"
+                "out_loops/a.mp3,0.9,2,4,0.7,0.9\n"
+                "out_loops/b.mp3,0.8,-1,0,0.6,0.9\n"
+                "out_loops/c.mp3,0.7,0,8,0.5,0.9\n"
+            )
+
+            layers = layers_from_csv(str(csv_path), 2)
+
+            assert [layer.song for layer in layers] == [
+                "out_loops/a.mp3",
+                "out_loops/b.mp3",
+            ]
+            assert layers[0].pitch_shift == 2
+            assert layers[0].beat_offset == 4
+            assert layers[1].gain is None
+
+        except ImportError as e:
+            pytest.skip(f"Compositor dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_layers_from_the_result_store(self, tmp_path):
+        """Test that the layers keep the tunings and beats found by the scan"""
+        try:
+            from auto_mashupper.compositor import layers_from_rows
+            from auto_mashupper.mashability import SCORE_DTYPE
+            from auto_mashupper.results import (
+                TRACK_DTYPE,
+                ResultReader,
+                write_results,
+            )
+
+            path = str(tmp_path / "base.scores")
+            scores = np.array(
+                [(0.8, -1, 0, 0.6, 0.9), (0.9, 2, 4, 0.7, 0.9)], dtype=SCORE_DTYPE
+            )
+            tracks = np.array(
+                [(440.0, 0.1, 0.5, 16), (443.0, 0.2, 0.6, 12)], dtype=TRACK_DTYPE
+            )
+            write_results(path, ["out_loops/b.mp3", "out_loops/a.mp3"], scores, tracks)
+
+            layers = layers_from_rows(ResultReader(path).top_k(2))
+
+            assert [layer.song for layer in layers] == [
+                "out_loops/a.mp3",
+                "out_loops/b.mp3",
+            ]
+            assert layers[0].tuning == 443.0
+            np.testing.assert_allclose(layers[0].beats, 0.2 + np.arange(12) * 0.6)
+            assert len(layers[1].beats) == 16
+
+        except ImportError as e:
+            pytest.skip(f"Compositor dependencies not available: {e}")
@@ -4,7 +4,7 @@ Tests for mashability functions
 
 import pytest
 import numpy as np
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 
 class TestMashabilityCore:
@@ -125,3 +125,599 @@ class TestMashabilityErrorHandling:
 
         except ImportError as e:
             pytest.skip(f"Mashability dependencies not available: {e}")
+
+
+class TestFeaturePrecision:
+    """Test that the compact feature dtype does not change the ranking"""
+
+    @staticmethod
+    def _random_features(rng, n_beats):
+        chroma = rng.random((12, n_beats))
+        spec = rng.random((3, n_beats)) * 100
+        return chroma, spec
+
+    def _rank(self, base, candidates, cast):
+        from auto_mashupper.mashability import beat_sync_mashability
+
+        scores = [
+            beat_sync_mashability(cast(base[0]), cast(base[1]), cast(c), cast(s))
+            for c, s in candidates
+        ]
+        order = sorted(range(len(scores)), key=lambda i: scores[i][0], reverse=True)
+        return order, scores
+
+    def test_float32_features_keep_ranking(self):
+        """Test that float32 and float64 features produce the same top results"""
+        try:
+            rng = np.random.default_rng(0)
+            base = self._random_features(rng, 8)
+            candidates = [self._random_features(rng, 32) for _ in range(20)]
+
+            order64, scores64 = self._rank(base, candidates, np.float64)
+            order32, scores32 = self._rank(base, candidates, np.float32)
+
+            assert order32[:5] == order64[:5]
+            for s32, s64 in zip(scores32, scores64):
+                assert s32[0].dtype == np.float32
+                assert s32[1:3] == s64[1:3]
+                assert s32[0] == pytest.approx(s64[0], rel=1e-4)
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+
+class TestTrackFeatures:
+    """Test scoring from precomputed TrackFeatures"""
+
+    @staticmethod
+    def _features(rng, n_beats):
+        from auto_mashupper.features import TrackFeatures
+
+        return TrackFeatures(
+            tempo=120,
+            beats=np.arange(n_beats) * 0.5,
+            chroma=rng.random((12, n_beats)),
+            bands=rng.random((3, n_beats)),
+            duration=n_beats * 0.5,
+        )
+
+    def test_get_mashability_accepts_features(self):
+        """Test that get_mashability skips the analysis for TrackFeatures"""
+        try:
+            from auto_mashupper import get_mashability, score_features
+
+            rng = np.random.default_rng(2)
+            base = self._features(rng, 8)
+            cand = self._features(rng, 32)
+
+            with patch("auto_mashupper.features.extract_features") as extract:
+                result = get_mashability(base, cand)
+                extract.assert_not_called()
+
+            assert result == score_features(base, cand)
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+    def test_mashability_accepts_candidate_features(self):
+        """Test that mashability scores a precomputed candidate"""
+        try:
+            from auto_mashupper.mashability import (
+                ShorterException,
+                mashability,
+                score_features,
+            )
+
+            rng = np.random.default_rng(3)
+            base = self._features(rng, 8)
+            cand = self._features(rng, 32)
+
+            assert mashability(base.chroma, base.bands, cand) == score_features(
+                base, cand
+            )
+            with pytest.raises(ShorterException):
+                mashability(base.chroma, base.bands, self._features(rng, 4))
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_extract_features(self):
+        """Test extracting TrackFeatures from an audio array"""
+        try:
+            from auto_mashupper import extract_features
+
+            audio = np.random.default_rng(4).random(44100 * 4)
+            features = extract_features(audio, bpm=120)
+
+            assert features.tempo == 120
+            assert features.duration == pytest.approx(4)
+            assert features.chroma.shape[0] == 12
+            assert features.bands.shape[0] == 3
+            assert features.chroma.shape[1] == features.bands.shape[1]
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+
+class TestSampleRates:
+    """Test that the caller's sample rate and the analysis rate are honoured"""
+
+    @staticmethod
+    def _chord(sr, seconds=6):
+        """A C major chord"""
+        t = np.arange(int(sr * seconds)) / sr
+        return sum(np.sin(2 * np.pi * f * t) for f in (261.63, 329.63, 392.0)) / 3
+
+    @pytest.mark.dependency
+    @pytest.mark.parametrize("sr", [44100, 48000])
+    def test_beat_grid_follows_sample_rate(self, sr):
+        """Test that a 48 kHz array gets the same beat grid as a 44.1 kHz one"""
+        try:
+            from auto_mashupper import extract_features
+
+            features = extract_features(self._chord(sr), sr=sr, bpm=120)
+
+            assert features.duration == pytest.approx(6)
+            assert features.chroma.shape[1] == 12
+            assert features.bands.shape == (3, 12)
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    @pytest.mark.parametrize("analysis_sr", [22050, 11025])
+    def test_low_analysis_rate_keeps_chroma(self, analysis_sr):
+        """Test that a lower analysis rate finds the same pitch classes"""
+        try:
+            from auto_mashupper import extract_features
+
+            audio = self._chord(44100)
+            full = extract_features(audio, bpm=120)
+            low = extract_features(audio, bpm=120, analysis_sr=analysis_sr)
+
+            assert low.chroma.shape == full.chroma.shape
+            assert low.bands.shape == full.bands.shape
+            top_full = set(np.argsort(full.chroma.mean(axis=1))[-3:])
+            top_low = set(np.argsort(low.chroma.mean(axis=1))[-3:])
+            assert top_full == top_low == {0, 4, 7}
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+
+class TestTuning:
+    """Test the tuning frequency stored with the features"""
+
+    @staticmethod
+    def _melody(ref, sr=44100, seconds=8):
+        """Harmonic notes tuned to the reference frequency ref"""
+        t = np.arange(int(sr * seconds)) / sr
+        y = np.zeros_like(t)
+        notes = [0, 4, 7, 12, -5, 2, 9, 5]
+        step = len(t) // len(notes)
+        for k, note in enumerate(notes):
+            part = slice(k * step, (k + 1) * step)
+            for h in range(1, 6):
+                y[part] += np.sin(2 * np.pi * ref * 2 ** (note / 12) * h * t[part]) / h
+        return 0.2 * y
+
+    @pytest.mark.dependency
+    @pytest.mark.parametrize("ref", [432, 440, 446])
+    def test_fast_tuning_from_chroma_stft(self, ref):
+        """Test that the fast preset reads the tuning without the essentia extractor"""
+        try:
+            from auto_mashupper import extract_features
+            from auto_mashupper import features as features_module
+
+            with patch.object(features_module, "tuning_frequency") as extractor:
+                features = extract_features(
+                    self._melody(ref), bpm=120, tuning_preset="fast"
+                )
+                extractor.assert_not_called()
+
+            assert features.tuning == pytest.approx(ref, abs=1.5)
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_accurate_tuning_and_presets(self):
+        """Test the essentia tuning preset and unknown presets"""
+        try:
+            from auto_mashupper import extract_features
+
+            features = extract_features(self._melody(440), bpm=120)
+
+            assert 430 < features.tuning < 450
+            with pytest.raises(ValueError):
+                extract_features(self._melody(440), bpm=120, tuning_preset="exact")
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_tuning_at_other_sample_rates(self):
+        """Test that signals at 48 kHz are resampled for the essentia extractor"""
+        try:
+            from auto_mashupper.context import AnalysisContext
+            from auto_mashupper.utilities import tuning_frequency
+
+            y = self._melody(446, sr=48000).astype(np.float32)
+            tuning = tuning_frequency(y, 48000, AnalysisContext())
+
+            # Read as 44.1 kHz, the signal would be tuned to 410 Hz
+            assert 436 < tuning < 456
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+
+class TestPitchShift:
+    """Test the rotation based harmonic scoring"""
+
+    @pytest.mark.dependency
+    def test_harmonic_matrix_matches_brute_force(self):
+        """Test that the matrix product scores every rotation and beat offset"""
+        try:
+            from auto_mashupper.mashability import harmonic_matrix
+            from auto_mashupper.segmentation import chroma_rotations
+
+            rng = np.random.default_rng(5)
+            base = rng.random((12, 4)).astype(np.float32)
+            cand = rng.random((12, 9)).astype(np.float32)
+
+            result = harmonic_matrix(chroma_rotations(base), cand)
+
+            expected = [
+                [
+                    np.sum(np.roll(base, p, axis=0) * cand[:, k : k + 4])
+                    for k in range(6)
+                ]
+                for p in range(12)
+            ]
+            np.testing.assert_allclose(result, expected, rtol=1e-5)
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    @pytest.mark.parametrize("semitones", [2, 5, -2, -5, 6])
+    def test_pitch_shift_keeps_direction(self, semitones):
+        """Test that a transposed candidate is shifted back the right way"""
+        try:
+            from auto_mashupper.mashability import beat_sync_mashability
+
+            rng = np.random.default_rng(6)
+            base = rng.random((12, 8))
+            spec = rng.random((3, 8))
+            # The candidate is the base transposed semitones up
+            cand = np.roll(base, semitones, axis=0)
+
+            _, p_shift, b_offset, _, _ = beat_sync_mashability(base, spec, cand, spec)
+
+            assert p_shift == semitones
+            assert b_offset == 0
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+    def test_rotations_kept_with_features(self):
+        """Test that the base rotations are computed once per TrackFeatures"""
+        try:
+            from auto_mashupper.mashability import score_features
+
+            rng = np.random.default_rng(7)
+            base = TestTrackFeatures._features(rng, 8)
+            cands = [TestTrackFeatures._features(rng, 16) for _ in range(3)]
+
+            with patch(
+                "auto_mashupper.features.chroma_rotations",
+                wraps=lambda chroma: np.stack(
+                    [np.roll(chroma, p, axis=0) for p in range(12)]
+                ),
+            ) as rotations:
+                for cand in cands:
+                    score_features(base, cand)
+
+            assert rotations.call_count == 1
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+
+class TestScoreMany:
+    """Test scoring a library against many bases in one pass"""
+
+    @pytest.mark.dependency
+    def test_score_many_matches_pairwise_scores(self):
+        """Test that stacked tiles of bases give the pairwise scores"""
+        try:
+            from auto_mashupper.mashability import score_features, score_many
+
+            rng = np.random.default_rng(8)
+            bases = [TestTrackFeatures._features(rng, n) for n in [8, 16, 8, 40, 8]]
+            cand = TestTrackFeatures._features(rng, 32)
+
+            scores = score_many(bases, cand, tile=2)
+
+            # The 40 beats base does not fit in the candidate
+            assert np.isnan(scores["mashability"][3])
+            for base, row in zip(bases[:3] + bases[4:], np.delete(scores, 3)):
+                expected = score_features(base, cand)
+                np.testing.assert_allclose(
+                    [row[name] for name in row.dtype.names], expected, rtol=1e-5
+                )
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    @pytest.mark.parametrize("output", [None, "scores.npz"])
+    def test_main_many_analyses_candidates_once(self, tmp_path, monkeypatch, output):
+        """Test that each candidate is analysed once for all the bases"""
+        try:
+            import auto_mashupper.mashability as mashability_module
+
+            rng = np.random.default_rng(9)
+            monkeypatch.chdir(tmp_path)
+            bases = ["loops/base_a.mp3", "loops/base_b.mp3"]
+            songs = ["loops/cand_%d.mp3" % i for i in range(3)]
+            features = {
+                path: TestTrackFeatures._features(rng, 8 if "base" in path else 16)
+                for path in bases + songs
+            }
+
+            def analyse(path, **kwargs):
+                return features[path]
+
+            with patch.multiple(
+                mashability_module,
+                extract_features=MagicMock(side_effect=analyse),
+                candidate_features=MagicMock(side_effect=analyse),
+            ):
+                scores = mashability_module.main_many(bases, songs, output=output)
+                assert mashability_module.candidate_features.call_count == len(songs)
+
+            assert scores.shape == (2, 3)
+            if output is None:
+                rows = (tmp_path / "base_b.csv").read_text().splitlines()
+                assert rows[0] == (
+                    "file,mashability,pitch_shift,beat_offset,h_contr,r_contr"
+                )
+                assert len(rows) == 4
+                assert float(rows[1].split(",")[1]) == np.nanmax(
+                    scores["mashability"][1]
+                )
+                assert (tmp_path / "base_b.scores" / "mashability.npy").exists()
+            else:
+                stored = np.load(tmp_path / output)
+                assert list(stored["candidates"]) == songs
+                np.testing.assert_array_equal(stored["scores"], scores)
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+
+class TestCheckpoints:
+    """Test resuming an interrupted scan"""
+
+    @pytest.mark.dependency
+    def test_main_resumes_after_a_crash(self, tmp_path, monkeypatch):
+        """Test that a resumed scan only scores the candidates left"""
+        try:
+            import auto_mashupper.mashability as mashability_module
+            from auto_mashupper.features import TrackFeatures
+            from auto_mashupper.results import read_top_candidates
+
+            monkeypatch.chdir(tmp_path)
+            monkeypatch.setattr("sys.argv", ["automashupper"])
+            songs = ["loops/cand_%d.mp3" % i for i in range(5)]
+            crash = {"loops/cand_3.mp3"}
+
+            def analyse(cand_song, **kwargs):
+                if cand_song in crash:
+                    raise RuntimeError("Killed")
+                if cand_song == "loops/cand_1.mp3":
+                    raise mashability_module.ShorterException("EOF error")
+                i = songs.index(cand_song)
+                return TrackFeatures(
+                    tempo=i,
+                    beats=np.arange(8) * 0.5,
+                    chroma=None,
+                    bands=None,
+                    duration=4.0,
+                    tuning=440.0 + i,
+                )
+
+            def score(base_features, cand_features):
+                i = cand_features.tempo
+                return (0.1 * i + 0.05, i - 2, i, 0.1 * i, 0.5)
+
+            def scan(**kwargs):
+                mashability_module.main("loops/base.mp3", **kwargs)
+                return [call.args[0] for call in analyser.call_args_list]
+
+            analyser = MagicMock(side_effect=analyse)
+            with patch.multiple(
+                mashability_module,
+                extract_features=MagicMock(),
+                library_songs=MagicMock(return_value=songs),
+                candidate_features=analyser,
+                score_features=score,
+            ):
+                with pytest.raises(RuntimeError):
+                    scan(checkpoint=True)
+                crash.clear()
+                analyser.reset_mock()
+                assert scan(resume=True) == songs[3:]
+                analyser.reset_mock()
+                assert scan(resume=True, retry_failed=True) == songs[1:2]
+
+            rows = (tmp_path / "base.csv").read_text().splitlines()
+            assert [row.split(",")[0] for row in rows[1:]] == [
+                "out_loops/cand_4.mp3",
+                "out_loops/cand_3.mp3",
+                "out_loops/cand_2.mp3",
+                "out_loops/cand_0.mp3",
+            ]
+            assert rows[1].split(",")[1:4] == ["0.45", "2", "4"]
+            # Resumed candidates keep the tuning and beats of their analysis
+            stored = read_top_candidates("loops/base.mp3", 4)
+            assert [row["tuning"] for row in stored] == [444.0, 443.0, 442.0, 440.0]
+            np.testing.assert_allclose(stored[3]["beats"], np.arange(8) * 0.5)
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+
+class TestIncrementalScorer:
+    """Test rescoring a library when the base loop is edited"""
+
+    @staticmethod
+    def _expected(chroma, bands, candidates):
+        from auto_mashupper.features import TrackFeatures
+        from auto_mashupper.mashability import score_many
+
+        base = TrackFeatures(
+            tempo=120, beats=None, chroma=chroma, bands=bands, duration=0
+        )
+        return np.concatenate([score_many([base], cand) for cand in candidates])
+
+    @staticmethod
+    def _assert_scores(scores, expected):
+        assert np.array_equal(
+            np.isnan(scores["mashability"]), np.isnan(expected["mashability"])
+        )
+        valid = ~np.isnan(expected["mashability"])
+        for name in scores.dtype.names:
+            np.testing.assert_allclose(
+                scores[name][valid], expected[name][valid], rtol=1e-4, atol=1e-5
+            )
+
+    @pytest.mark.dependency
+    def test_edits_match_full_rescoring(self):
+        """Test that trimmed and extended bases score like freshly analysed ones"""
+        try:
+            from auto_mashupper.mashability import IncrementalScorer
+
+            rng = np.random.default_rng(10)
+            base = TestTrackFeatures._features(rng, 16)
+            candidates = [TestTrackFeatures._features(rng, n) for n in [40, 18, 64]]
+            extra = TestTrackFeatures._features(rng, 6)
+            scorer = IncrementalScorer(base, candidates)
+            self._assert_scores(
+                scorer.scores(), self._expected(base.chroma, base.bands, candidates)
+            )
+
+            scorer.trim(start=3, end=2)
+            scorer.append(extra.chroma[:, :4], extra.bands[:, :4])
+            scorer.prepend(extra.chroma[:, 4:], extra.bands[:, 4:])
+            chroma = np.hstack(
+                [extra.chroma[:, 4:], base.chroma[:, 3:-2], extra.chroma[:, :4]]
+            )
+            bands = np.hstack(
+                [extra.bands[:, 4:], base.bands[:, 3:-2], extra.bands[:, :4]]
+            )
+
+            # 17 beats, the 18 beats candidate still fits
+            assert len(scorer) == 17
+            self._assert_scores(
+                scorer.scores(), self._expected(chroma, bands, candidates)
+            )
+
+            scorer.append(extra.chroma[:, :2], extra.bands[:, :2])
+            assert np.isnan(scorer.scores()["mashability"][1])
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_edits_only_correlate_edited_beats(self):
+        """Test that an edit correlates the edited beats only"""
+        try:
+            import auto_mashupper.mashability as mashability_module
+
+            rng = np.random.default_rng(11)
+            base = TestTrackFeatures._features(rng, 16)
+            candidates = [TestTrackFeatures._features(rng, 32) for _ in range(3)]
+            scorer = mashability_module.IncrementalScorer(base, candidates)
+
+            with patch.object(
+                mashability_module,
+                "chroma_rotations",
+                wraps=mashability_module.chroma_rotations,
+            ) as rotations:
+                scorer.trim(end=1)
+                scorer.append(base.chroma[:, :2], base.bands[:, :2])
+
+            assert rotations.call_count == 3
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+    def test_invalid_edits(self):
+        """Test trimming too many beats and mismatched new beats"""
+        try:
+            from auto_mashupper.mashability import IncrementalScorer
+
+            rng = np.random.default_rng(12)
+            base = TestTrackFeatures._features(rng, 4)
+            scorer = IncrementalScorer(base, [TestTrackFeatures._features(rng, 8)])
+
+            with pytest.raises(ValueError):
+                scorer.trim(start=3, end=2)
+            with pytest.raises(ValueError):
+                scorer.append(base.chroma[:, :2], base.bands[:, :1])
+            scorer.trim(start=4)
+            assert np.isnan(scorer.scores()["mashability"]).all()
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
+
+
+class TestWriteSongsMash:
+    """Test mixing the top candidates of a scan"""
+
+    def test_mixes_get_the_tunings_and_beats_of_the_scan(self, tmp_path, monkeypatch):
+        """Test that the candidates are mixed with what the scan found about them"""
+        try:
+            import auto_mashupper.mashability as mashability_module
+            from auto_mashupper.results import TRACK_DTYPE, results_path, write_results
+
+            monkeypatch.chdir(tmp_path)
+            (tmp_path / "results").mkdir()
+            (tmp_path / "out_loops").mkdir()
+            files = ["out_loops/a.mp3", "out_loops/b.mp3"]
+            for path in files:
+                (tmp_path / path).write_bytes(b"ID3")
+            scores = np.array(
+                [(0.9, 2, 4, 0.7, 0.9), (0.8, -1, 0, 0.6, 0.9)],
+                dtype=mashability_module.SCORE_DTYPE,
+            )
+            tracks = np.array(
+                [(441.0, 0.1, 0.5, 16), (np.nan, 0.0, 0.0, 0)], dtype=TRACK_DTYPE
+            )
+            write_results(results_path("loops/base.mp3"), files, scores, tracks)
+            mixed = []
+
+            def iter_mixes(base_song, candidates, mono=True):
+                for candidate in candidates:
+                    mixed.append(candidate)
+                    yield np.zeros(8, dtype=np.float32)
+
+            with patch.object(mashability_module, "iter_mixes", iter_mixes):
+                mashability_module.write_songs_mash("loops/base.mp3")
+
+            assert [candidate[:3] for candidate in mixed] == [
+                ("out_loops/a.mp3", 4, 2),
+                ("out_loops/b.mp3", 0, -1),
+            ]
+            assert mixed[0][3] == 441.0
+            np.testing.assert_allclose(mixed[0][4], 0.1 + np.arange(16) * 0.5)
+            # Estimated when mixing, the scan did not analyse it
+            assert mixed[1][3:] == (None, None)
+            assert len(list((tmp_path / "results/mash/base").iterdir())) == 4
+
+        except ImportError as e:
+            pytest.skip(f"Mashability dependencies not available: {e}")
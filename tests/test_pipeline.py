@@ -0,0 +1,290 @@
+"""
+Tests for the streaming scan pipeline
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+
+
+def fake_load(song, sr=44100, context=None):
+    """A signal whose first sample is the number in the file name"""
+    if "broken" in song:
+        raise RuntimeError("Cannot decode")
+    return np.full(4, float(song.split(".")[0]), dtype=np.float32)
+
+
+def fake_features(y, **kwargs):
+    """Candidates have their number as tempo, number 13 is too short"""
+    from auto_mashupper.features import TrackFeatures
+    from auto_mashupper.mashability import ShorterException
+
+    if y[0] == 13:
+        raise ShorterException("Candidate is smaller than 3 seconds")
+    return TrackFeatures(
+        tempo=float(y[0]),
+        beats=np.arange(9) * 0.5,
+        chroma=np.ones((12, 8)),
+        bands=np.ones((3, 8)),
+        duration=4.0,
+    )
+
+
+def fake_score(base_features, cand_features):
+    """Candidates score their number modulo 7"""
+    n = cand_features.tempo
+    return (n % 7 / 7, 1, int(n), 0.5, 0.5)
+
+
+@pytest.fixture
+def base():
+    try:
+        from auto_mashupper.features import TrackFeatures
+
+        rng = np.random.default_rng(0)
+        return TrackFeatures(
+            tempo=120.0,
+            beats=np.arange(9) * 0.5,
+            chroma=rng.random((12, 8)),
+            bands=rng.random((3, 8)),
+            duration=4.0,
+        )
+    except ImportError as e:
+        pytest.skip(f"Pipeline dependencies not available: {e}")
+
+
+class TestTopK:
+    """Test the bounded sink of the best scores"""
+
+    def test_keeps_the_best_in_discovery_order(self):
+        """Test that the k best are kept, ties going to the first discovered"""
+        try:
+            from auto_mashupper.pipeline import TopK
+
+            sink = TopK(3)
+            for order, value in enumerate([0.2, 0.9, np.nan, 0.5, 0.9, 0.1, 0.5]):
+                track = (440.0 + order, 0.0, 0.5, 8) if order != 4 else None
+                sink.push(order, "%d.mp3" % order, (value, 0, order, 0.0, 0.0), track)
+
+            songs, scores, tracks = sink.results()
+
+            assert len(sink) == 3
+            assert songs == ["1.mp3", "4.mp3", "3.mp3"]
+            np.testing.assert_allclose(scores["mashability"], [0.9, 0.9, 0.5])
+            assert list(scores["beat_offset"]) == [1, 4, 3]
+            # The tracks stay with their candidates, unknown ones are NaN
+            np.testing.assert_array_equal(tracks["tuning"], [441.0, np.nan, 443.0])
+
+        except ImportError as e:
+            pytest.skip(f"Pipeline dependencies not available: {e}")
+
+    def test_keeps_every_score_without_k(self):
+        """Test that only NaN scores are left out without k"""
+        try:
+            from auto_mashupper.pipeline import TopK
+
+            sink = TopK()
+            for order in range(100):
+                sink.push(order, str(order), (order % 10, 0, 0, 0.0, 0.0))
+            sink.push(100, "skipped", (np.nan, 0, 0, 0.0, 0.0))
+
+            songs, scores, _ = sink.results()
+
+            assert len(songs) == 100
+            assert np.all(np.diff(scores["mashability"]) <= 0)
+
+        except ImportError as e:
+            pytest.skip(f"Pipeline dependencies not available: {e}")
+
+
+class TestDecoding:
+    """Test the I/O threads decoding ahead"""
+
+    def test_decoding_is_lazy_and_bounded(self):
+        """Test that a slow consumer holds at most prefetch decoded signals"""
+        try:
+            from auto_mashupper import pipeline
+
+            listed = []
+            decoded = []
+
+            def songs():
+                for i in range(1000):
+                    listed.append(i)
+                    yield i, "%d.mp3" % i
+
+            def load(song, sr=44100, context=None):
+                decoded.append(song)
+                return fake_load(song)
+
+            with patch.object(pipeline, "load_mono", side_effect=load):
+                stream = pipeline.iter_decoded(songs(), n_threads=2, prefetch=4)
+                next(stream)
+                time.sleep(0.3)
+                # Queued, plus one in the hands of each thread
+                assert len(decoded) <= 1 + 4 + 2
+                assert len(listed) <= 1 + 4 + 2
+                stream.close()
+
+            assert threading.active_count() < 5
+
+        except ImportError as e:
+            pytest.skip(f"Pipeline dependencies not available: {e}")
+
+    def test_failed_decodes_are_reported(self):
+        """Test that every song comes out once, with the reason of the failures"""
+        try:
+            from auto_mashupper import pipeline
+
+            songs = ["%d.mp3" % i for i in range(20)] + ["broken.mp3"]
+            with patch.object(pipeline, "load_mono", side_effect=fake_load):
+                items = list(pipeline.iter_decoded(enumerate(songs), n_threads=3))
+
+            assert sorted(item[0] for item in items) == list(range(21))
+            broken = [item for item in items if item[1] == "broken.mp3"]
+            assert broken == [(20, "broken.mp3", None, "EOF error")]
+
+        except ImportError as e:
+            pytest.skip(f"Pipeline dependencies not available: {e}")
+
+
+class TestScanLibrary:
+    """Test the whole streaming scan"""
+
+    @pytest.fixture
+    def stages(self):
+        try:
+            from auto_mashupper import pipeline
+
+            with patch.multiple(
+                pipeline,
+                load_mono=fake_load,
+                candidate_features=fake_features,
+                score_features=fake_score,
+            ):
+                yield pipeline
+        except ImportError as e:
+            pytest.skip(f"Pipeline dependencies not available: {e}")
+
+    def test_top_k_matches_a_full_ranking(self, stages, base):
+        """Test the streamed top-K against ranking every score"""
+        songs = ["%d.mp3" % i for i in range(50)] + ["broken.mp3"]
+        expected = sorted(
+            (i for i in range(50) if i != 13), key=lambda i: (-(i % 7), i)
+        )[:10]
+
+        metadata = MagicMock()
+        with ThreadPoolExecutor(3) as executor:
+            kept, scores, tracks = stages.scan_library(
+                base,
+                iter(songs),
+                k=10,
+                n_workers=3,
+                executor=executor,
+                metadata=metadata,
+            )
+
+        assert kept == ["%d.mp3" % i for i in expected]
+        assert list(scores["beat_offset"]) == expected
+        # Every analysed candidate, scored or not, fills the metadata cache
+        cached = {call.args[0]: call.args[1] for call in metadata.put.call_args_list}
+        assert len(cached) == 49 and cached["7.mp3"] == 7.0
+        # Only the kept candidates keep their tuning and beats, for the mixes
+        assert len(tracks) == 10
+        assert tracks[kept.index("6.mp3")].tolist() == (440.0, 0.0, 0.5, 9)
+
+    def test_resumes_from_a_checkpoint(self, stages, base, tmp_path):
+        """Test that logged candidates are neither decoded nor scored again"""
+        from auto_mashupper.checkpoint import ScanLog
+
+        songs = ["%d.mp3" % i for i in range(20)] + ["broken.mp3"]
+        path = str(tmp_path / "base.scan.jsonl")
+        with ThreadPoolExecutor(2) as executor:
+            with ScanLog(path, {}) as log:
+                first = stages.scan_library(
+                    base, songs[:12], checkpoint=log, executor=executor
+                )
+            with patch.object(stages, "load_mono", side_effect=fake_load) as load:
+                with ScanLog(path, {}, resume=True) as log:
+                    resumed = stages.scan_library(
+                        base, songs, checkpoint=log, executor=executor
+                    )
+            with ScanLog(path, {}, resume=True) as log:
+                assert "13.mp3" in log.errors and "broken.mp3" in log.errors
+
+        assert load.call_count == len(songs) - 12
+        with ThreadPoolExecutor(2) as executor:
+            full = stages.scan_library(base, songs, executor=executor)
+        assert len(first[0]) == 12
+        assert resumed[0] == full[0]
+        np.testing.assert_array_equal(resumed[1], full[1])
+        # Resumed candidates keep the tracks of the first scan
+        np.testing.assert_array_equal(resumed[2], full[2])
+
+
+class TestWorkerContext:
+    """Test the start method of the worker processes"""
+
+    def test_spawns_without_a_fork_server(self):
+        """Test that workers are spawned where there is no fork server"""
+        try:
+            import multiprocessing
+
+            from auto_mashupper.pipeline import worker_context
+
+            with patch.object(
+                multiprocessing, "get_all_start_methods", return_value=["spawn"]
+            ):
+                assert worker_context().get_start_method() == "spawn"
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                assert worker_context().get_start_method() == "forkserver"
+
+        except ImportError as e:
+            pytest.skip(f"Pipeline dependencies not available: {e}")
+
+
+@pytest.mark.slow
+class TestPipelineProcesses:
+    """Test the pipeline with real decoding and worker processes"""
+
+    def test_matches_the_sequential_scan(self, tmp_path):
+        """Test that the streamed scores are the ones of score_candidates"""
+        try:
+            import soundfile
+
+            from auto_mashupper.features import extract_features
+            from auto_mashupper.mashability import score_candidates
+            from auto_mashupper.pipeline import scan_library
+
+            sr = 44100
+            t = np.arange(8 * sr) / sr
+            songs = []
+            for i, (bpm, pitch) in enumerate([(120, 220), (100, 330), (128, 262)]):
+                clicks = (np.sin(2 * np.pi * t * bpm / 60) > 0.99).astype(float)
+                y = 0.3 * np.sin(2 * np.pi * pitch * t) + 0.5 * clicks
+                path = str(tmp_path / ("%d.wav" % i))
+                soundfile.write(path, y.astype(np.float32), sr)
+                songs.append(path)
+            short = str(tmp_path / "short.wav")
+            soundfile.write(short, np.zeros(sr, dtype=np.float32), sr)
+            songs.append(short)
+            base = extract_features(songs[0], tempo_preset="fast")
+
+            sequential = score_candidates(base, songs, tempo_preset="fast")
+            kept, scores, _ = scan_library(
+                base, songs, tempo_preset="fast", n_workers=2
+            )
+
+            scored = np.flatnonzero(~np.isnan(sequential["mashability"]))
+            order = scored[
+                np.argsort(-sequential["mashability"][scored], kind="stable")
+            ]
+            assert kept == [songs[i] for i in order]
+            np.testing.assert_array_equal(scores, sequential[order])
+
+        except ImportError as e:
+            pytest.skip(f"Pipeline dependencies not available: {e}")
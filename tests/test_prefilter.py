@@ -0,0 +1,237 @@
+"""
+Tests for the tempo and key prefilter
+"""
+
+import os
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+C_MAJOR, G_MAJOR, F_MAJOR, A_MINOR, D_MAJOR = 0, 7, 5, 21, 2
+
+
+class TestKeys:
+    """Test the key estimation and compatibility"""
+
+    def test_estimate_key(self):
+        """Test keys estimated from the chroma of scales and chords"""
+        try:
+            from auto_mashupper.prefilter import estimate_key
+
+            c_major_scale = np.zeros(12)
+            c_major_scale[[0, 2, 4, 5, 7, 9, 11]] = 1
+            c_major_scale[[0, 4, 7]] += 1
+            a_minor_chord = np.zeros(12)
+            a_minor_chord[[9, 0, 4]] = 1
+            a_minor_chord[9] += 1
+
+            assert estimate_key(c_major_scale) == C_MAJOR
+            assert estimate_key(np.roll(c_major_scale, 2)) == D_MAJOR
+            assert estimate_key(a_minor_chord) == A_MINOR
+
+        except ImportError as e:
+            pytest.skip(f"Prefilter dependencies not available: {e}")
+
+    def test_compatible_keys(self):
+        """Test the relative key and the fifths, with and without pitch shifts"""
+        try:
+            from auto_mashupper.prefilter import compatible_keys
+
+            assert compatible_keys(C_MAJOR) == [C_MAJOR, F_MAJOR, G_MAJOR, A_MINOR]
+            assert compatible_keys(A_MINOR) == [C_MAJOR, 14, 16, A_MINOR]
+            assert D_MAJOR in compatible_keys(C_MAJOR, max_key_shift=2)
+            assert len(compatible_keys(C_MAJOR, max_key_shift=6)) == 24
+
+        except ImportError as e:
+            pytest.skip(f"Prefilter dependencies not available: {e}")
+
+
+class TestTrackIndex:
+    """Test the range queries of the sorted index"""
+
+    def test_tempo_folding(self):
+        """Test that half and double time tempos are kept"""
+        try:
+            from auto_mashupper.prefilter import TrackIndex
+
+            tempos = [60, 100, 118, 120, 125, 130, 240, 250, 270]
+            songs = ["%d.mp3" % tempo for tempo in tempos]
+            index = TrackIndex(songs, tempos, [C_MAJOR] * len(tempos))
+
+            assert sorted(index.query(120, tempo_tolerance=0.08)) == sorted(
+                ["60.mp3", "118.mp3", "120.mp3", "125.mp3", "240.mp3", "250.mp3"]
+            )
+            assert len(index.query(120, tempo_tolerance=None)) == len(tempos)
+
+        except ImportError as e:
+            pytest.skip(f"Prefilter dependencies not available: {e}")
+
+    def test_query_matches_a_full_pass(self):
+        """Test the binary searches against a mask over every track"""
+        try:
+            from auto_mashupper.prefilter import TrackIndex, compatible_keys
+
+            rng = np.random.default_rng(0)
+            tempos = rng.uniform(50, 260, 2000)
+            keys = rng.integers(0, 24, 2000)
+            songs = ["%04d.mp3" % i for i in range(2000)]
+            index = TrackIndex(songs, tempos, keys)
+
+            for tempo, key, shift in [(120, C_MAJOR, 0), (93.5, A_MINOR, 1)]:
+                ratios = tempos[:, None] / (tempo * np.array([0.5, 1, 2]))
+                mask = (np.abs(ratios - 1) <= 0.08).any(axis=1)
+                mask &= np.isin(keys, compatible_keys(key, shift))
+                expected = [songs[i] for i in np.flatnonzero(mask)]
+
+                kept = index.query(
+                    tempo, key, tempo_tolerance=0.08, max_key_shift=shift
+                )
+
+                assert sorted(kept) == expected
+
+        except ImportError as e:
+            pytest.skip(f"Prefilter dependencies not available: {e}")
+
+
+class TestMetadataCache:
+    """Test the cached tempo and key of library tracks"""
+
+    @pytest.fixture
+    def library(self, tmp_path):
+        songs = []
+        for name in ["base", "half", "fast", "far_key", "broken"]:
+            path = tmp_path / ("%s.mp3" % name)
+            path.write_bytes(name.encode())
+            songs.append(str(path))
+        return songs
+
+    @staticmethod
+    def features(song, **kwargs):
+        from auto_mashupper.features import TrackFeatures
+        from auto_mashupper.mashability import ShorterException
+        from auto_mashupper.prefilter import key_profiles
+
+        name = os.path.basename(song)
+        if name == "broken.mp3":
+            raise ShorterException("EOF error")
+        tempo, key = {
+            "base.mp3": (120.0, C_MAJOR),
+            "half.mp3": (61.0, A_MINOR),
+            "fast.mp3": (140.0, C_MAJOR),
+            "far_key.mp3": (120.0, 6),
+        }[name]
+        profile = key_profiles()[key] / key_profiles()[key].max()
+        return TrackFeatures(
+            tempo=tempo,
+            beats=np.arange(17) * 0.5,
+            chroma=np.tile(profile[:, None], (1, 16)),
+            bands=np.ones((3, 16)),
+            duration=8.0,
+        )
+
+    def test_scans_fill_the_cache(self, tmp_path, library):
+        """Test that uncached candidates are scored once, then filtered"""
+        try:
+            from auto_mashupper.mashability import score_candidates
+            from auto_mashupper.prefilter import (
+                MetadataCache,
+                compatible_songs,
+                features_metadata,
+            )
+
+            cache_path = str(tmp_path / "library.metadata.npz")
+            base, songs = self.features(library[0]), library[1:]
+            cache = MetadataCache(cache_path, {})
+            cache.put(library[0], *features_metadata(base))
+
+            # Nothing is analysed by the prefilter itself
+            assert compatible_songs(base, songs, cache, max_key_shift=0) == songs
+            with patch(
+                "auto_mashupper.mashability.candidate_features",
+                side_effect=self.features,
+            ) as analyse:
+                score_candidates(base, songs, metadata=cache)
+            assert analyse.call_count == 4
+            cache.save()
+
+            cache = MetadataCache(cache_path, {})
+            assert cache.get(library[1]) == (61.0, A_MINOR)
+            assert compatible_songs(base, songs, cache, max_key_shift=0) == [
+                library[1],
+                library[4],
+            ]
+            # Candidates that cannot be analysed are kept, so the scan records why
+            assert compatible_songs(base, songs, cache) == [
+                library[1],
+                library[3],
+                library[4],
+            ]
+
+        except ImportError as e:
+            pytest.skip(f"Prefilter dependencies not available: {e}")
+
+    def test_changed_files_and_settings_invalidate(self, tmp_path, library):
+        """Test that a changed track or analysis setting is analysed again"""
+        try:
+            from auto_mashupper.prefilter import MetadataCache
+
+            cache_path = str(tmp_path / "library.metadata.npz")
+            settings = {"sr": 44100, "analysis_sr": None, "tempo_preset": "fast"}
+            cache = MetadataCache(cache_path, settings)
+            cache.put(library[0], 120.0, C_MAJOR)
+            cache.put(library[1], 61.0, A_MINOR)
+            cache.save()
+
+            os.utime(library[1], ns=(0, 0))
+            cache = MetadataCache(cache_path, settings)
+
+            assert cache.get(library[0]) == (120.0, C_MAJOR)
+            assert cache.get(library[1]) is None
+            assert len(MetadataCache(cache_path, dict(settings, sr=22050))) == 0
+
+        except ImportError as e:
+            pytest.skip(f"Prefilter dependencies not available: {e}")
+
+    def test_queries_reuse_the_index(self, tmp_path, library):
+        """Test that scans query one index, updated with the tracks put since"""
+        try:
+            from auto_mashupper import prefilter
+
+            base = self.features(library[0])
+            cache = prefilter.MetadataCache(str(tmp_path / "library.metadata.npz"), {})
+            for song in library[:4]:
+                cache.put(song, *prefilter.features_metadata(self.features(song)))
+            # The rest of a larger library, far from the base tempo
+            for i in range(8):
+                path = tmp_path / ("slow_%d.mp3" % i)
+                path.write_bytes(b"slow")
+                cache.put(str(path), 80.0 + i, C_MAJOR)
+            songs = library[1:]
+
+            with patch.object(
+                prefilter, "TrackIndex", wraps=prefilter.TrackIndex
+            ) as index:
+                with patch.object(prefilter.os, "stat") as stat:
+                    first = prefilter.compatible_songs(base, songs, cache)
+                    second = prefilter.compatible_songs(base, songs, cache)
+            # Built once, and no file is checked by the queries
+            assert first == second == [library[1], library[3], library[4]]
+            assert index.call_count == 1
+            stat.assert_not_called()
+
+            # A track put again is matched on its new tempo only
+            cache.put(library[2], 120.0, C_MAJOR)
+            cache.put(library[1], 90.0, A_MINOR)
+            with patch.object(
+                prefilter, "TrackIndex", wraps=prefilter.TrackIndex
+            ) as index:
+                assert prefilter.compatible_songs(base, songs, cache) == [
+                    library[2],
+                    library[3],
+                    library[4],
+                ]
+            assert [len(call.args[0]) for call in index.call_args_list] == [2]
+
+        except ImportError as e:
+            pytest.skip(f"Prefilter dependencies not available: {e}")
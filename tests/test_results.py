@@ -0,0 +1,169 @@
+"""
+Tests for the columnar result store
+"""
+
+import numpy as np
+import pytest
+
+SCORE_DTYPE = [
+    ("mashability", np.float32),
+    ("pitch_shift", np.int8),
+    ("beat_offset", np.int32),
+    ("h_contr", np.float32),
+    ("r_contr", np.float32),
+]
+
+
+@pytest.fixture
+def results():
+    """Unranked scores of five candidates, one of them not fitting the base"""
+    files = ["out_loops/%s.mp3" % name for name in "abcde"]
+    scores = np.array(
+        [
+            (0.5, 0, 3, 0.4, 0.9),
+            (0.9, -2, 0, 0.8, 0.9),
+            (np.nan, 0, 0, np.nan, np.nan),
+            (0.7, 5, 8, 0.6, 0.9),
+            (0.7, 1, 4, 0.6, 0.9),
+        ],
+        dtype=SCORE_DTYPE,
+    )
+    return files, scores
+
+
+class TestResultStore:
+    """Test writing, filtering and exporting results"""
+
+    @pytest.mark.dependency
+    def test_round_trip(self, tmp_path, results):
+        """Test that the rows are read back ranked, without the NaN ones"""
+        try:
+            from auto_mashupper.results import ResultReader, write_results
+
+            write_results(str(tmp_path / "base.scores"), *results)
+            reader = ResultReader(str(tmp_path / "base.scores"))
+
+            assert len(reader) == 4
+            # Equally mashable candidates keep their order
+            assert reader.files(range(4)) == [
+                "out_loops/b.mp3",
+                "out_loops/d.mp3",
+                "out_loops/e.mp3",
+                "out_loops/a.mp3",
+            ]
+            np.testing.assert_array_equal(reader.column("beat_offset"), [0, 8, 4, 3])
+            assert reader.column("pitch_shift").dtype == np.int8
+            with pytest.raises(KeyError):
+                reader.column("file")
+
+        except ImportError as e:
+            pytest.skip(f"Result dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_top_k_filters(self, tmp_path, results):
+        """Test the top-K with mashability and pitch shift filters"""
+        try:
+            from auto_mashupper.results import ResultReader, write_results
+
+            write_results(str(tmp_path / "base.scores"), *results)
+            reader = ResultReader(str(tmp_path / "base.scores"))
+
+            assert [row["file"] for row in reader.top_k(2)] == [
+                "out_loops/b.mp3",
+                "out_loops/d.mp3",
+            ]
+            assert [row["file"] for row in reader.top_k(10, max_abs_pitch=1)] == [
+                "out_loops/e.mp3",
+                "out_loops/a.mp3",
+            ]
+            top = reader.top_k(1, min_mashability=0.6, pitch_shifts=[0, 5])
+            assert len(top) == 1
+            assert top[0]["file"] == "out_loops/d.mp3"
+            assert top[0]["beat_offset"] == 8
+            assert reader.top_k(3, min_mashability=0.95) == []
+
+        except ImportError as e:
+            pytest.skip(f"Result dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_csv_export_and_fallback(self, tmp_path, monkeypatch, results):
+        """Test the csv export, and reading the top rows from either format"""
+        try:
+            from auto_mashupper.results import (
+                ResultReader,
+                read_top_candidates,
+                results_path,
+                write_results,
+            )
+
+            monkeypatch.chdir(tmp_path)
+            files, scores = results
+            path = results_path("loops/base.mp3")
+            write_results(path, files, scores)
+            ResultReader(path).to_csv("base.csv", chunk=3)
+
+            rows = (tmp_path / "base.csv").read_text().splitlines()
+            assert rows[0] == "file,mashability,pitch_shift,beat_offset,h_contr,r_contr"
+            assert rows[1] == "out_loops/b.mp3,%s,-2,0,%s,%s" % tuple(
+                scores[["mashability", "h_contr", "r_contr"]][1]
+            )
+            assert len(rows) == 5
+
+            from_store = read_top_candidates("loops/base.mp3", 3)
+            (tmp_path / path / "file_offsets.npy").unlink()
+            (tmp_path / path / "files.bin").unlink()
+            for name in scores.dtype.names:
+                (tmp_path / path / (name + ".npy")).unlink()
+            (tmp_path / path).rmdir()
+            from_csv = read_top_candidates("loops/base.mp3", 3)
+
+            assert [row["file"] for row in from_csv] == [
+                row["file"] for row in from_store
+            ]
+            assert [int(row["pitch_shift"]) for row in from_csv] == [
+                int(row["pitch_shift"]) for row in from_store
+            ]
+
+        except ImportError as e:
+            pytest.skip(f"Result dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_tunings_and_beats_round_trip(self, tmp_path, results):
+        """Test that the tunings and beat grids of the scan are read back"""
+        try:
+            from auto_mashupper.results import (
+                ResultReader,
+                TRACK_DTYPE,
+                unknown_tracks,
+                write_results,
+            )
+
+            path = str(tmp_path / "base.scores")
+            files, scores = results
+            tracks = unknown_tracks(len(files))
+            tracks[:2] = np.array(
+                [(441.0, 0.25, 0.5, 6), (438.0, 0.0, 0.4, 9)], dtype=TRACK_DTYPE
+            )
+            write_results(path, files, scores, tracks)
+
+            rows = ResultReader(path).rows([0, 3])
+            assert [row["file"] for row in rows] == [
+                "out_loops/b.mp3",
+                "out_loops/a.mp3",
+            ]
+            assert rows[0]["tuning"] == 438.0
+            np.testing.assert_allclose(rows[0]["beats"], np.arange(9) * 0.4)
+            np.testing.assert_allclose(rows[1]["beats"], 0.25 + np.arange(6) * 0.5)
+            # Candidates whose tuning is unknown are estimated when mixed
+            assert ResultReader(path).rows([1])[0]["beats"] is None
+
+            # Rewritten without them, the previous ones are not read back
+            write_results(path, files, scores)
+            reader = ResultReader(path)
+            assert not reader.has_tracks
+            assert "tuning" not in reader.rows([0])[0]
+            with pytest.raises(KeyError):
+                reader.column("tuning")
+
+        except ImportError as e:
+            pytest.skip(f"Result dependencies not available: {e}")
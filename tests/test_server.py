@@ -0,0 +1,240 @@
+"""
+Tests for the local mashability job server
+"""
+
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+
+async def http_request(port, method, target, payload=None):
+    """Send a request to the server on localhost and return (status, json)"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write(
+        (
+            "%s %s HTTP/1.1\r\nHost: localhost\r\nContent-Length: %d\r\n\r\n"
+            % (method, target, len(body))
+        ).encode()
+        + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, data = response.partition(b"\r\n\r\n")
+    status = int(head.split(b" ")[1])
+    return status, json.loads(data)
+
+
+class CountingAnalyzer:
+    """Fake analysis that counts how often each track is analysed"""
+
+    def __init__(self, delay=0.1):
+        self.delay = delay
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, path):
+        from auto_mashupper.features import TrackFeatures
+
+        with self.lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+        time.sleep(self.delay)
+        n_beats = 8 if "base" in path else 32
+        rng = np.random.default_rng(len(path))
+        return TrackFeatures(
+            tempo=120,
+            beats=np.arange(n_beats) * 0.5,
+            chroma=rng.random((12, n_beats)),
+            bands=rng.random((3, n_beats)),
+            duration=n_beats * 0.5,
+        )
+
+
+@pytest.fixture
+def tracks(tmp_path):
+    paths = {}
+    for name in ["base.wav", "cand1.wav", "cand2.wav"]:
+        path = tmp_path / name
+        path.write_bytes(b"RIFF")
+        paths[name.split(".")[0]] = str(path)
+    return paths
+
+
+def run_with_server(coro_factory, **kwargs):
+    """Start a server with a thread pool, run the coroutine and close it"""
+    from auto_mashupper.server import MashabilityServer
+
+    async def run():
+        server = MashabilityServer(executor=ThreadPoolExecutor(4), **kwargs)
+        await server.start()
+        try:
+            return await coro_factory(server)
+        finally:
+            await server.close()
+
+    return asyncio.run(run())
+
+
+class TestMashabilityServer:
+    """Test the asyncio job server on localhost"""
+
+    def test_score_deduplicates_concurrent_analyses(self, tracks):
+        """Test that concurrent jobs for the same track share one analysis"""
+        try:
+            analyzer = CountingAnalyzer()
+
+            async def scenario(server):
+                jobs = [
+                    http_request(
+                        server.port,
+                        "POST",
+                        "/score",
+                        {"base": tracks["base"], "candidate": tracks[cand]},
+                    )
+                    for cand in ["cand1", "cand2", "cand1", "cand2"]
+                ]
+                return await asyncio.gather(*jobs), server.metrics()
+
+            responses, metrics = run_with_server(scenario, analyze=analyzer)
+
+            assert all(status == 200 for status, _ in responses)
+            assert set(analyzer.calls.values()) == {1}
+            assert len(analyzer.calls) == 3
+            assert responses[0][1] == responses[2][1]
+            assert metrics["completed"] == 4
+            assert metrics["cached_features"] == 3
+            assert metrics["deduplicated"] + metrics["cache_hits"] == 5
+
+        except ImportError as e:
+            pytest.skip(f"Server dependencies not available: {e}")
+
+    def test_cached_features_are_served(self, tracks):
+        """Test that a second job reuses the cached analyses"""
+        try:
+            analyzer = CountingAnalyzer(delay=0)
+
+            async def scenario(server):
+                job = {"base": tracks["base"], "candidate": tracks["cand1"]}
+                first = await http_request(server.port, "POST", "/score", job)
+                second = await http_request(server.port, "POST", "/score", job)
+                return first, second, server.metrics()
+
+            first, second, metrics = run_with_server(scenario, analyze=analyzer)
+
+            assert first == second
+            assert analyzer.calls[tracks["base"]] == 1
+            assert metrics["cache_hits"] == 2
+
+        except ImportError as e:
+            pytest.skip(f"Server dependencies not available: {e}")
+
+    def test_backpressure_rejects_jobs(self, tracks):
+        """Test that jobs above max_pending are rejected with 503"""
+        try:
+            analyzer = CountingAnalyzer(delay=0.3)
+
+            async def scenario(server):
+                jobs = [
+                    http_request(
+                        server.port,
+                        "POST",
+                        "/score",
+                        {"base": tracks["base"], "candidate": tracks["cand1"]},
+                    )
+                    for _ in range(5)
+                ]
+                return await asyncio.gather(*jobs), server.metrics()
+
+            responses, metrics = run_with_server(
+                scenario, analyze=analyzer, max_pending=2
+            )
+            statuses = sorted(status for status, _ in responses)
+
+            assert statuses == [200, 200, 503, 503, 503]
+            assert metrics["rejected"] == 3
+            assert metrics["queue_depth"] == 0
+
+        except ImportError as e:
+            pytest.skip(f"Server dependencies not available: {e}")
+
+    def test_errors_are_reported(self, tracks):
+        """Test missing files, bad jobs and unknown endpoints"""
+        try:
+
+            async def scenario(server):
+                missing = await http_request(
+                    server.port,
+                    "POST",
+                    "/score",
+                    {"base": tracks["base"], "candidate": "missing.wav"},
+                )
+                bad = await http_request(server.port, "POST", "/score", {})
+                unknown = await http_request(server.port, "GET", "/nothing")
+                return missing, bad, unknown
+
+            missing, bad, unknown = run_with_server(
+                scenario, analyze=CountingAnalyzer(delay=0)
+            )
+
+            assert missing[0] == 404
+            assert bad[0] == 400
+            assert unknown[0] == 404
+
+        except ImportError as e:
+            pytest.skip(f"Server dependencies not available: {e}")
+
+    def test_mix_reuses_the_cached_features(self, tracks, tmp_path):
+        """Test that a mix gets the features of the tracks scored before"""
+        try:
+            mixes = []
+
+            def mix(base, candidate, beat_offset, pitch_shift, output, *features):
+                mixes.append(features)
+                return output
+
+            async def scenario(server):
+                output = str(tmp_path / "mix.wav")
+                job = {"base": tracks["base"], "candidate": tracks["cand1"]}
+                before = await http_request(
+                    server.port, "POST", "/mix", dict(job, output=output)
+                )
+                await http_request(server.port, "POST", "/score", job)
+                after = await http_request(
+                    server.port, "POST", "/mix", dict(job, output=output)
+                )
+                return before, after
+
+            analyzer = CountingAnalyzer(delay=0)
+            before, after = run_with_server(scenario, analyze=analyzer, mix=mix)
+
+            assert before[0] == after[0] == 200
+            # Mixing does not analyse the tracks itself
+            assert mixes[0] == (None, None)
+            assert set(analyzer.calls.values()) == {1}
+            base_features, cand_features = mixes[1]
+            assert len(base_features.beats) == 8
+            assert len(cand_features.beats) == 32
+
+        except ImportError as e:
+            pytest.skip(f"Server dependencies not available: {e}")
+
+    def test_workers_share_the_cores(self, monkeypatch):
+        """Test the BLAS and FFT threads given to each worker process"""
+        try:
+            from auto_mashupper.server import MashabilityServer
+            from auto_mashupper.threads import threads_per_worker
+
+            monkeypatch.delenv("AUTOMASHUPPER_THREADS", raising=False)
+            assert MashabilityServer(max_workers=2).threads == threads_per_worker(2)
+            assert MashabilityServer(max_workers=2, threads=3).threads == 3
+            monkeypatch.setenv("AUTOMASHUPPER_THREADS", "5")
+            assert MashabilityServer(max_workers=2).threads == 5
+
+        except ImportError as e:
+            pytest.skip(f"Server dependencies not available: {e}")
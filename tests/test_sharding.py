@@ -0,0 +1,213 @@
+"""
+Tests for sharded mashability scans
+"""
+
+import multiprocessing
+import os
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+
+
+def fake_features(path, **kwargs):
+    """Features of a made up track, the same for a path in every process"""
+    from auto_mashupper.features import TrackFeatures
+
+    rng = np.random.default_rng(sum(path.encode("utf-8")))
+    n_beats = 8 if "base" in path else 16 + len(path) % 8
+    return TrackFeatures(
+        tempo=120,
+        beats=np.arange(n_beats) * 0.5,
+        chroma=rng.random((12, n_beats)),
+        bands=rng.random((3, n_beats)),
+        duration=n_beats * 0.5,
+    )
+
+
+def fake_analysis():
+    return patch.multiple(
+        "auto_mashupper.mashability",
+        candidate_features=MagicMock(side_effect=fake_features),
+    )
+
+
+def worker(base_song, work_dir, songs, results):
+    """A scan worker, in a forked process that inherits the patched analysis"""
+    from auto_mashupper.sharding import scan_shards
+
+    results.put(scan_shards(base_song, work_dir, 5, songs=songs))
+
+
+@pytest.fixture
+def library():
+    base_song = "loops/base.mp3"
+    songs = ["loops/cand_%02d.mp3" % i for i in range(20)]
+    return base_song, songs
+
+
+class TestPartition:
+    """Test splitting the candidates into shards"""
+
+    def test_partition_is_deterministic(self, library):
+        """Test that every candidate is in one shard, whatever the listing order"""
+        try:
+            from auto_mashupper.sharding import partition
+
+            _, songs = library
+            shards = partition(songs, 4)
+
+            assert sorted(song for shard in shards for song in shard) == songs
+            assert partition(songs[::-1], 4) == shards
+            assert all(shards)
+
+        except ImportError as e:
+            pytest.skip(f"Sharding dependencies not available: {e}")
+
+
+class TestShardQueue:
+    """Test claiming shards through lock files"""
+
+    def test_claims_are_exclusive(self, tmp_path):
+        """Test that two queues on the same directory never claim the same shard"""
+        try:
+            from auto_mashupper.sharding import ShardQueue
+
+            first = ShardQueue.open(str(tmp_path), "loops/base.mp3", 3)
+            second = ShardQueue.open(str(tmp_path), "loops/base.mp3")
+
+            claims = [first.claim(), second.claim(), first.claim(), second.claim()]
+
+            assert second.n_shards == 3
+            assert claims == [0, 1, 2, None]
+            with pytest.raises(ValueError):
+                ShardQueue.open(str(tmp_path), "loops/base.mp3", 4)
+            with pytest.raises(ValueError):
+                ShardQueue.open(str(tmp_path), "loops/other.mp3")
+
+        except ImportError as e:
+            pytest.skip(f"Sharding dependencies not available: {e}")
+
+    def test_stale_locks_are_claimed_again(self, tmp_path):
+        """Test that the shard of a crashed worker is claimed after stale_after"""
+        try:
+            from auto_mashupper.sharding import ShardQueue
+
+            crashed = ShardQueue.open(str(tmp_path), "loops/base.mp3", 1)
+            assert crashed.claim() == 0
+            lock = tmp_path / "shard-0000.lock"
+            os.utime(lock, (0, 0))
+
+            assert ShardQueue.open(str(tmp_path), "loops/base.mp3").claim() is None
+            queue = ShardQueue.open(str(tmp_path), "loops/base.mp3", stale_after=60)
+            assert queue.claim() == 0
+            assert queue.claim() is None
+
+        except ImportError as e:
+            pytest.skip(f"Sharding dependencies not available: {e}")
+
+    def test_file_names_are_portable(self, tmp_path):
+        """Test that the stale and tmp files have no ":" in their names"""
+        try:
+            from auto_mashupper import sharding
+
+            crashed = sharding.ShardQueue.open(str(tmp_path), "loops/base.mp3", 1)
+            assert crashed.claim() == 0
+            os.utime(tmp_path / "shard-0000.lock", (0, 0))
+            queue = sharding.ShardQueue.open(
+                str(tmp_path), "loops/base.mp3", stale_after=60
+            )
+            assert queue.claim() == 0
+
+            replaced = []
+            replace = os.replace
+
+            def record(src, dst):
+                replaced.append(os.path.basename(src))
+                replace(src, dst)
+
+            scores = np.zeros(1, dtype=[("mashability", np.float32)])
+            with patch.object(sharding.os, "replace", side_effect=record):
+                queue.complete(0, ["loops/a.mp3"], scores)
+
+            names = os.listdir(tmp_path) + replaced
+            assert any(".stale-" in name for name in names)
+            assert any(name.endswith(".tmp") for name in names)
+            assert not any(":" in name for name in names)
+            # The lock still tells which host and process hold the shard
+            lock = (tmp_path / "shard-0000.lock").read_text()
+            assert lock == sharding.owner() and ":" in lock
+
+        except ImportError as e:
+            pytest.skip(f"Sharding dependencies not available: {e}")
+
+
+class TestShardedScan:
+    """Test scanning with several processes and merging the shards"""
+
+    @pytest.mark.dependency
+    def test_processes_share_the_scan(self, tmp_path, monkeypatch, library):
+        """Test that concurrent workers score each shard once and merge like main"""
+        try:
+            from auto_mashupper import sharding
+            from auto_mashupper.mashability import score_candidates
+
+            if "fork" not in multiprocessing.get_all_start_methods():
+                pytest.skip("The workers need the fork start method")
+            base_song, songs = library
+            monkeypatch.chdir(tmp_path)
+            work_dir = str(tmp_path / "scan")
+            context = multiprocessing.get_context("fork")
+            results = context.Queue()
+
+            with fake_analysis():
+                with patch.object(
+                    sharding, "extract_features", side_effect=fake_features
+                ):
+                    workers = [
+                        context.Process(
+                            target=worker, args=(base_song, work_dir, songs, results)
+                        )
+                        for _ in range(3)
+                    ]
+                    for process in workers:
+                        process.start()
+                    done = [results.get(timeout=60) for _ in workers]
+                    for process in workers:
+                        process.join(timeout=60)
+                        assert process.exitcode == 0
+
+                    merged_songs, merged_scores = sharding.merge_shards(
+                        base_song, work_dir
+                    )
+                    expected = score_candidates(fake_features(base_song), merged_songs)
+
+            assert sorted(shard for shards in done for shard in shards) == list(
+                range(5)
+            )
+            assert sorted(merged_songs) == songs
+            np.testing.assert_array_equal(merged_scores, expected)
+            rows = (tmp_path / "base.csv").read_text().splitlines()
+            assert len(rows) == 1 + np.count_nonzero(~np.isnan(expected["mashability"]))
+            best = np.nanargmax(expected["mashability"])
+            assert rows[1].startswith(
+                "out_loops/%s," % os.path.basename(merged_songs[best])
+            )
+
+        except ImportError as e:
+            pytest.skip(f"Sharding dependencies not available: {e}")
+
+    def test_merge_needs_every_shard(self, tmp_path, library):
+        """Test that merging an unfinished scan fails"""
+        try:
+            from auto_mashupper.sharding import ShardQueue, merge_shards
+
+            base_song, _ = library
+            queue = ShardQueue.open(str(tmp_path), base_song, 2)
+            queue.complete(0, [], np.zeros(0, dtype=[("mashability", "f4")]))
+
+            with pytest.raises(RuntimeError):
+                merge_shards(base_song, str(tmp_path))
+
+        except ImportError as e:
+            pytest.skip(f"Sharding dependencies not available: {e}")
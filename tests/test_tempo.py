@@ -0,0 +1,158 @@
+"""
+Tests for tempo and beat grid estimation
+"""
+
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+
+def click_track(bpm, phase=0.2, seconds=12, sr=44100):
+    """Noise bursts on every beat, the first one at phase seconds"""
+    rng = np.random.default_rng(0)
+    y = np.zeros(int(seconds * sr) + 2000)
+    burst = rng.standard_normal(2000) * np.exp(-np.arange(2000) / 300)
+    for beat in np.arange(phase, seconds, 60 / bpm):
+        start = int(beat * sr)
+        y[start : start + 2000] += burst
+    return y[: int(seconds * sr)]
+
+
+class TestFastPreset:
+    """Test the onset autocorrelation tempo estimation"""
+
+    @pytest.mark.dependency
+    @pytest.mark.parametrize("bpm", [90, 120, 128])
+    def test_fast_preset_finds_tempo_and_phase(self, bpm):
+        """Test that the fast preset finds the tempo and the first beat"""
+        try:
+            from auto_mashupper.tempo import estimate_tempo
+
+            tempo, beats = estimate_tempo(click_track(bpm), 44100, preset="fast")
+
+            assert tempo == pytest.approx(bpm, rel=0.02)
+            # Within a couple of envelope frames of the first click
+            assert beats[0] == pytest.approx(0.2, abs=0.04)
+            np.testing.assert_allclose(np.diff(beats), 60 / tempo)
+
+        except ImportError as e:
+            pytest.skip(f"Tempo dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_tempo_hint_still_aligns_phase(self):
+        """Test that a precalculated tempo gets a phase-aligned grid"""
+        try:
+            from auto_mashupper.tempo import estimate_tempo
+
+            tempo, beats = estimate_tempo(
+                click_track(120, phase=0.35), 44100, tempo=120
+            )
+
+            assert tempo == 120
+            assert beats[0] == pytest.approx(0.35, abs=0.03)
+
+        except ImportError as e:
+            pytest.skip(f"Tempo dependencies not available: {e}")
+
+
+class TestPresets:
+    """Test what the presets share and validate"""
+
+    @pytest.mark.dependency
+    @pytest.mark.parametrize("preset", ["fast", "accurate"])
+    def test_onset_envelope_computed_once(self, preset):
+        """Test that both presets compute the onset envelope a single time"""
+        try:
+            from auto_mashupper import tempo as tempo_module
+
+            with patch.object(
+                tempo_module,
+                "onset_envelope",
+                wraps=tempo_module.onset_envelope,
+            ) as envelope:
+                tempo_module.estimate_tempo(click_track(120), 44100, preset=preset)
+
+            assert envelope.call_count == 1
+
+        except ImportError as e:
+            pytest.skip(f"Tempo dependencies not available: {e}")
+
+    def test_invalid_arguments(self):
+        """Test unknown presets, out of range tempos and empty signals"""
+        try:
+            from auto_mashupper.tempo import estimate_tempo
+
+            y = np.zeros(44100)
+            with pytest.raises(ValueError):
+                estimate_tempo(y, 44100, preset="fastest")
+            for tempo in [-10, 0, 1000]:
+                with pytest.raises(ValueError):
+                    estimate_tempo(y, 44100, tempo=tempo)
+            with pytest.raises(ValueError):
+                estimate_tempo(np.array([]), 44100, preset="fast")
+
+        except ImportError as e:
+            pytest.skip(f"Tempo dependencies not available: {e}")
+
+    def test_beat_grid(self):
+        """Test the regular beat grid helper"""
+        try:
+            from auto_mashupper.tempo import beat_grid
+
+            np.testing.assert_allclose(beat_grid(2, 120, 0.1), [0.1, 0.6, 1.1, 1.6])
+
+        except ImportError as e:
+            pytest.skip(f"Tempo dependencies not available: {e}")
+
+
+class TestBeatGrid:
+    """Test conversions between beats and samples"""
+
+    def test_beat_to_sample(self):
+        """Test beats inside, between and outside the grid"""
+        try:
+            from auto_mashupper.tempo import BeatGrid
+
+            grid = BeatGrid([0.5, 1.0, 1.6, 2.0], 1000)
+
+            assert grid.beat_to_sample(0) == 500
+            assert grid.beat_to_sample(1.5) == 1300
+            np.testing.assert_array_equal(
+                grid.beat_to_sample([3, 4, -1]), [2000, 2500, 0]
+            )
+            assert isinstance(grid.beat_to_sample(2), int)
+
+        except ImportError as e:
+            pytest.skip(f"Tempo dependencies not available: {e}")
+
+    def test_slice_beats(self):
+        """Test that slices are views clipped to the signal"""
+        try:
+            from auto_mashupper.tempo import BeatGrid
+
+            y = np.arange(3000.0).reshape(1, -1).repeat(2, axis=0)
+            grid = BeatGrid([0.5, 1.0, 1.5], 1000)
+
+            part = grid.slice_beats(y, 1, 2)
+            assert part.shape == (2, 1000)
+            assert part[0, 0] == 1000
+            assert np.shares_memory(part, y)
+            assert grid.slice_beats(y, 2, 8).shape == (2, 1500)
+            assert grid.slice_beats(y, 10, 1).shape == (2, 0)
+
+        except ImportError as e:
+            pytest.skip(f"Tempo dependencies not available: {e}")
+
+    def test_short_grids(self):
+        """Test that grids of fewer than two beats need a tempo"""
+        try:
+            from auto_mashupper.tempo import BeatGrid
+
+            assert BeatGrid([], 1000, tempo=120).beat_to_sample(2) == 1000
+            assert BeatGrid([0.2], 1000, tempo=60).beat_to_sample(1) == 1200
+            with pytest.raises(ValueError):
+                BeatGrid([0.2], 1000)
+
+        except ImportError as e:
+            pytest.skip(f"Tempo dependencies not available: {e}")
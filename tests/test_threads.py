@@ -0,0 +1,145 @@
+"""
+Tests for the BLAS and FFT thread configuration
+"""
+
+import functools
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+THREAD_VARS = (
+    "AUTOMASHUPPER_THREADS",
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+
+
+@pytest.fixture
+def threads(monkeypatch):
+    """The threads module, with the environment and settings restored afterwards"""
+    from auto_mashupper import threads
+
+    for name in THREAD_VARS:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(threads, "_fft_workers", None)
+    return threads
+
+
+class TestThreadSettings:
+    """Test setting the threads of a process"""
+
+    def test_set_threads(self, threads):
+        """Test that the BLAS, OpenMP and FFT thread counts are set"""
+        with patch("threadpoolctl.threadpool_limits") as limits:
+            assert threads.set_threads() is None
+            assert threads.fft_workers() == 1
+
+            assert threads.set_threads(3) == 3
+
+        limits.assert_called_once_with(3, user_api="blas")
+        assert threads.fft_workers() == 3
+        assert all(threads.os.environ[name] == "3" for name in THREAD_VARS)
+        with pytest.raises(ValueError):
+            threads.set_threads(0)
+
+    def test_environment_variable(self, threads, monkeypatch):
+        """Test that AUTOMASHUPPER_THREADS is the default thread count"""
+        monkeypatch.setenv("AUTOMASHUPPER_THREADS", "2")
+        assert threads.fft_workers() == 2
+
+        with patch("threadpoolctl.threadpool_limits"):
+            assert threads.set_threads() == 2
+        assert threads.os.environ["OMP_NUM_THREADS"] == "2"
+
+    def test_splits(self, threads):
+        """Test the splits of the cores between processes and threads"""
+        assert threads.splits(6) == [(1, 6), (2, 3), (3, 2), (6, 1)]
+        assert threads.threads_per_worker(3, n_cores=8) == 2
+        assert threads.threads_per_worker(16, n_cores=8) == 1
+
+
+class TestThreadedFFT:
+    """Test that the FFT workers do not change the features"""
+
+    @pytest.mark.dependency
+    def test_stft_matches_librosa(self, threads):
+        """Test the scipy.fft STFT with several workers against librosa's"""
+        try:
+            import librosa
+
+            y = np.random.default_rng(0).standard_normal(22050).astype(np.float32)
+            expected = librosa.stft(y, n_fft=2048)
+
+            threads._fft_workers = 2
+            np.testing.assert_allclose(
+                threads.stft(y, n_fft=2048), expected, rtol=1e-4, atol=1e-4
+            )
+
+        except ImportError as e:
+            pytest.skip(f"FFT dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_tempo_candidates_with_workers(self, threads):
+        """Test the onset autocorrelation with several FFT workers"""
+        try:
+            from auto_mashupper.tempo import tempo_candidates
+
+            envelope = np.random.default_rng(1).random(2000)
+            expected = tempo_candidates(envelope, 44100)
+
+            threads._fft_workers = 4
+            bpms, scores = tempo_candidates(envelope, 44100)
+
+            np.testing.assert_allclose(bpms, expected[0])
+            np.testing.assert_allclose(scores, expected[1])
+
+        except ImportError as e:
+            pytest.skip(f"Tempo dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_beat_sync_spectrums_with_workers(self, threads):
+        """Test that the public band path runs its FFTs on the FFT workers"""
+        try:
+            import scipy.fft
+
+            from auto_mashupper import segmentation
+
+            y = np.random.default_rng(2).standard_normal(44100).astype(np.float32)
+            beats = (120.0, np.arange(9) * 0.1)
+            with patch.object(
+                segmentation, "self_tempo_estimation", return_value=beats
+            ):
+                expected = segmentation.get_beat_sync_spectrums(y)
+                threads._fft_workers = 3
+                with patch.object(scipy.fft, "fft", wraps=scipy.fft.fft) as fft:
+                    bands = segmentation.get_beat_sync_spectrums(y)
+
+            assert fft.call_count == 8
+            assert {call.kwargs["workers"] for call in fft.call_args_list} == {3}
+            np.testing.assert_allclose(bands, expected, rtol=1e-5)
+
+        except ImportError as e:
+            pytest.skip(f"FFT dependencies not available: {e}")
+
+
+class TestBenchmark:
+    """Test the processes versus threads benchmark"""
+
+    @pytest.mark.dependency
+    def test_benchmark_splits(self, threads):
+        """Test that every split is timed, fastest first"""
+        try:
+            job = functools.partial(threads.analysis_job, duration=1)
+            timings = threads.benchmark_splits(job, range(4), n_cores=2)
+
+            assert sorted(timing[:2] for timing in timings) == [(1, 2), (2, 1)]
+            seconds = [timing[2] for timing in timings]
+            assert seconds == sorted(seconds)
+            assert all(0 < s < np.inf for s in seconds)
+
+        except ImportError as e:
+            pytest.skip(f"Benchmark dependencies not available: {e}")
@@ -150,6 +150,490 @@ class TestMixSongs:
                 pytest.skip(f"mix_songs dependencies not available: {e}")
 
 
+class TestRenderMixes:
+    """Test batched mix rendering over a shared main loop"""
+
+    @staticmethod
+    def _fake_align(
+        cand_song, beat_offset, pitch_shift, final_tempo, final_len, *args, **kwargs
+    ):
+        return cand_song[..., :final_len]
+
+    @pytest.mark.dependency
+    def test_render_mixes_into_preallocated_buffer(self, sample_audio_long):
+        """Test that N mixes are written into one preallocated array"""
+        try:
+            from unittest.mock import MagicMock, patch
+
+            from auto_mashupper.utilities import peak, render_mixes
+
+            rng = np.random.default_rng(0)
+            main_song = sample_audio_long - 0.5
+            cands = [rng.random(len(main_song) + 100) - 0.5 for _ in range(3)]
+            out = np.empty((3, len(main_song)), dtype=np.float32)
+
+            tempo = MagicMock(return_value=(120, None))
+            with patch.multiple(
+                "auto_mashupper.utilities",
+                align_candidate=self._fake_align,
+                self_tempo_estimation=tempo,
+            ):
+                result = render_mixes(main_song, [(c, 0, 0) for c in cands], out=out)
+
+            assert result is out
+            assert tempo.call_count == 1
+            for mix, cand in zip(out, cands):
+                cand = cand[: len(main_song)]
+                expected = 0.5 * cand / peak(cand) + 0.5 * main_song / peak(main_song)
+                np.testing.assert_allclose(mix, expected, rtol=1e-5, atol=1e-6)
+
+        except ImportError as e:
+            pytest.skip(f"render_mixes dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_iter_mixes_reuses_buffer(self, sample_audio_long):
+        """Test that iter_mixes reuses one buffer and pads short candidates"""
+        try:
+            from unittest.mock import MagicMock, patch
+
+            from auto_mashupper.utilities import iter_mixes
+
+            main_song = sample_audio_long
+            short = np.ones(len(main_song) // 2)
+
+            with patch.multiple(
+                "auto_mashupper.utilities",
+                align_candidate=self._fake_align,
+                self_tempo_estimation=MagicMock(return_value=(120, None)),
+            ):
+                mixes = [
+                    (id(mix), mix.copy())
+                    for mix in iter_mixes(main_song, [(short, 0, 0), (short, 0, 0)])
+                ]
+
+            assert mixes[0][0] == mixes[1][0]
+            assert mixes[0][1].dtype == np.float32
+            assert mixes[0][1].shape == main_song.shape
+            half = len(main_song) // 2
+            np.testing.assert_allclose(
+                mixes[0][1][half:],
+                0.5 * main_song[half:] / np.max(main_song),
+                rtol=1e-5,
+            )
+            # The caller's array is left untouched
+            assert np.max(main_song) == np.max(sample_audio_long)
+
+        except ImportError as e:
+            pytest.skip(f"iter_mixes dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_known_tunings_skip_the_extractor(self, sample_audio_long):
+        """Test that tunings from the features are used instead of re-estimated"""
+        try:
+            from unittest.mock import MagicMock, patch
+
+            from auto_mashupper.utilities import mix_songs
+
+            align = MagicMock(side_effect=self._fake_align)
+            tuning = MagicMock(return_value=440.0)
+            with patch.multiple(
+                "auto_mashupper.utilities",
+                align_candidate=align,
+                self_tempo_estimation=MagicMock(return_value=(120, None)),
+                tuning_frequency=tuning,
+            ):
+                mix_songs(
+                    sample_audio_long,
+                    sample_audio_long,
+                    0,
+                    0,
+                    tunning_main=442.0,
+                    tunning_cand=438.0,
+                )
+
+            tuning.assert_not_called()
+            assert align.call_args.args[5:] == (442.0, 44100, 438.0, None)
+
+        except ImportError as e:
+            pytest.skip(f"mix_songs dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_mix_memory_budget(self):
+        """Test that a 10 minutes stereo mix only allocates its output buffer and
+        the mono downmix the main loop is analysed on"""
+        try:
+            import tracemalloc
+            from unittest.mock import MagicMock, patch
+
+            from auto_mashupper.utilities import mix_songs
+
+            rng = np.random.default_rng(0)
+            n_samples = 10 * 60 * 44100
+            main_song = rng.random((2, n_samples), dtype=np.float32) - 0.5
+            cand_song = rng.random((2, n_samples + 44100), dtype=np.float32) - 0.5
+            budget = 3 * n_samples * np.dtype(np.float32).itemsize
+
+            with patch.multiple(
+                "auto_mashupper.utilities",
+                align_candidate=self._fake_align,
+                self_tempo_estimation=MagicMock(return_value=(120, None)),
+            ):
+                tracemalloc.start()
+                try:
+                    mix = mix_songs(
+                        main_song,
+                        cand_song,
+                        0,
+                        0,
+                        sr=44100,
+                        tunning_main=440.0,
+                        tunning_cand=440.0,
+                        mono=False,
+                    )
+                    _, peak_bytes = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+
+            assert mix.shape == main_song.shape
+            # The inputs are neither copied nor scaled out of place
+            assert peak_bytes < budget + 2**20
+
+        except ImportError as e:
+            pytest.skip(f"mix_songs dependencies not available: {e}")
+
+
+class TestAlignCandidate:
+    """Test stretching a candidate to the length of the main loop"""
+
+    @staticmethod
+    def _fake_stretch(y, sr, ratio, X):
+        """Stand-in for rubberband, off by a few samples like the real one"""
+        n = int(round(y.shape[0] * ratio)) + 3
+        return np.resize(y, (n,) + y.shape[1:])
+
+    @pytest.mark.dependency
+    def test_single_pass_to_exact_length(self):
+        """Test that the cut is stretched once, to the length of the main loop"""
+        try:
+            from unittest.mock import MagicMock, patch
+
+            from auto_mashupper.utilities import align_candidate
+
+            rng = np.random.default_rng(4)
+            cand_song = rng.random(3 * 44100, dtype=np.float32) - 0.5
+            stretch = MagicMock(side_effect=self._fake_stretch)
+            core = MagicMock()
+            with patch.multiple(
+                "auto_mashupper.utilities",
+                stretch_and_shift=stretch,
+                self_tempo_estimation=MagicMock(
+                    return_value=(120, np.arange(0, 3, 0.5))
+                ),
+                core=core,
+            ):
+                aligned = align_candidate(
+                    cand_song, 0, 3, 120, 40000, 440.0, 44100, 446.0
+                )
+
+            assert aligned.shape == (40000,)
+            assert aligned.dtype == np.float32
+            assert stretch.call_count == 1
+            core.resample.assert_not_called()
+            cut, _, ratio, pitch_factor = stretch.call_args.args
+            assert ratio == pytest.approx(40000 / len(cut))
+            assert pitch_factor == pytest.approx(446 / 440 * 2 ** (-3 / 12))
+
+        except ImportError as e:
+            pytest.skip(f"align_candidate dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_cut_follows_the_beat_grid(self):
+        """Test that the cut starts on the offset beat and spans the main loop"""
+        try:
+            from unittest.mock import MagicMock, patch
+
+            from auto_mashupper.utilities import align_candidate
+
+            rng = np.random.default_rng(5)
+            cand_song = rng.random(10 * 44100, dtype=np.float32) - 0.5
+            # 100 bpm candidate, first beat at 0.25 s
+            cand_beats = 0.25 + np.arange(16) * 0.6
+            stretch = MagicMock(side_effect=self._fake_stretch)
+            tempo = MagicMock()
+            with patch.multiple(
+                "auto_mashupper.utilities",
+                stretch_and_shift=stretch,
+                self_tempo_estimation=tempo,
+            ):
+                # 4 beats of a 120 bpm main loop
+                align_candidate(
+                    cand_song, 3, 0, 120, 88200, 440.0, 44100, 440.0, cand_beats
+                )
+
+            tempo.assert_not_called()
+            cut = stretch.call_args.args[0]
+            start = int(round((0.25 + 3 * 0.6) * 44100))
+            np.testing.assert_array_equal(
+                cut, cand_song[start : start + int(round(4 * 0.6 * 44100))]
+            )
+            # Slowed down from 100 to 120 bpm
+            assert stretch.call_args.args[2] == pytest.approx(100 / 120, rel=1e-4)
+
+        except ImportError as e:
+            pytest.skip(f"align_candidate dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_cut_clipped_by_the_end_keeps_the_tempo(self):
+        """Test that a cut running past the end is stretched by its beats"""
+        try:
+            from unittest.mock import MagicMock, patch
+
+            from auto_mashupper.utilities import align_candidate
+
+            rng = np.random.default_rng(6)
+            cand_song = rng.random(10 * 44100, dtype=np.float32) - 0.5
+            # 120 bpm candidate, beats from 0.3 to 9.8 s
+            cand_beats = 0.3 + np.arange(20) * 0.5
+            stretch = MagicMock(side_effect=self._fake_stretch)
+            with patch.multiple(
+                "auto_mashupper.utilities",
+                stretch_and_shift=stretch,
+                self_tempo_estimation=MagicMock(),
+            ):
+                # 16 beats of a 120 bpm main loop, the last 0.6 beats are missing
+                aligned = align_candidate(
+                    cand_song, 4, 0, 120, 8 * 44100, 440.0, 44100, 440.0, cand_beats
+                )
+
+            cut, _, ratio, _ = stretch.call_args.args
+            assert len(cut) == int(round(7.7 * 44100))
+            assert ratio == pytest.approx(1.0)
+            assert aligned.shape == (8 * 44100,)
+            assert not aligned[len(cut) :].any()
+
+        except ImportError as e:
+            pytest.skip(f"align_candidate dependencies not available: {e}")
+
+    def test_fit_length_residuals(self):
+        """Test trimming, padding and resampling to an exact length"""
+        try:
+            from auto_mashupper.utilities import fit_length
+
+            t = np.arange(44100) / 44100
+            y = np.sin(2 * np.pi * 5 * t).astype(np.float32)
+
+            np.testing.assert_array_equal(fit_length(y, 44000), y[:44000])
+            padded = fit_length(y, 44200)
+            np.testing.assert_array_equal(padded[:44100], y)
+            assert not padded[44100:].any()
+
+            # A larger residual is resampled, keeping the waveform
+            resampled = fit_length(np.stack([y, -y]), 33075)
+            assert resampled.shape == (2, 33075)
+            expected = np.sin(2 * np.pi * 5 * np.arange(33075) / 33075)
+            np.testing.assert_allclose(
+                resampled[0, 100:-100], expected[100:-100], atol=1e-2
+            )
+            np.testing.assert_allclose(resampled[1], -resampled[0], atol=1e-6)
+
+        except ImportError as e:
+            pytest.skip(f"fit_length dependencies not available: {e}")
+
+
+class TestPartialDecoding:
+    """Test decoding only the region of a candidate that is mixed"""
+
+    @pytest.fixture
+    def stereo_wav(self, tmp_path):
+        import soundfile as sf
+
+        rng = np.random.default_rng(6)
+        y = (rng.random((10 * 44100, 2)) - 0.5).astype(np.float32)
+        path = str(tmp_path / "cand.wav")
+        sf.write(path, y, 44100, subtype="FLOAT")
+        return path, y.T
+
+    def test_load_region_seeks(self, stereo_wav):
+        """Test that only the frames of the region are read"""
+        try:
+            from unittest.mock import patch
+
+            import soundfile as sf
+
+            from auto_mashupper.utilities import load_region
+
+            path, y = stereo_wav
+            with patch("soundfile.read", wraps=sf.read) as read:
+                region = load_region(path, offset=2.0, duration=0.5, mono=False)
+
+            assert read.call_args.kwargs["start"] == 88200
+            assert read.call_args.kwargs["frames"] == 22050
+            np.testing.assert_array_equal(region, y[:, 88200:110250])
+            np.testing.assert_allclose(
+                load_region(path, offset=2.0, duration=0.5),
+                y[:, 88200:110250].mean(axis=0),
+                atol=1e-7,
+            )
+            assert load_region(path, sr=22050, offset=2.0, duration=0.5).shape == (
+                11025,
+            )
+
+        except ImportError as e:
+            pytest.skip(f"load_region dependencies not available: {e}")
+
+    def test_unsupported_formats_use_librosa(self, tmp_path):
+        """Test the fallback for the formats soundfile cannot open"""
+        try:
+            from unittest.mock import MagicMock, patch
+
+            from auto_mashupper.utilities import load_region
+
+            core = MagicMock()
+            core.load.return_value = (np.zeros(100), 44100)
+            with patch("auto_mashupper.utilities.core", core):
+                region = load_region(str(tmp_path / "cand.m4a"), offset=1.5, duration=2)
+
+            assert core.load.call_args.kwargs["offset"] == 1.5
+            assert core.load.call_args.kwargs["duration"] == 2
+            assert region.dtype == np.float32
+
+        except ImportError as e:
+            pytest.skip(f"load_region dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_align_decodes_the_cut_only(self, stereo_wav):
+        """Test that a file with known beats gives the cut of the whole signal"""
+        try:
+            from unittest.mock import MagicMock, patch
+
+            import soundfile as sf
+
+            from auto_mashupper.utilities import align_candidate
+
+            path, y = stereo_wav
+            cand_beats = 0.25 + np.arange(16) * 0.6
+            stretch = MagicMock(side_effect=lambda y, sr, *args: y)
+            args = (3, 0, 120, 88200, 440.0, 44100, 440.0, cand_beats)
+            with patch.multiple(
+                "auto_mashupper.utilities",
+                stretch_and_shift=stretch,
+                self_tempo_estimation=MagicMock(),
+            ):
+                with patch("soundfile.read", wraps=sf.read) as read:
+                    align_candidate(path, *args, mono=False)
+                from_file = stretch.call_args.args[0]
+                align_candidate(y, *args)
+                from_array = stretch.call_args.args[0]
+
+            # The cut and the margin around it, out of 10 seconds
+            assert read.call_args.kwargs["frames"] < 3 * 44100
+            np.testing.assert_array_equal(from_file, from_array)
+
+        except ImportError as e:
+            pytest.skip(f"align_candidate dependencies not available: {e}")
+
+
+class TestStereo:
+    """Test rendering with the channels of the main loop"""
+
+    @staticmethod
+    def _fake_align(
+        cand_song, beat_offset, pitch_shift, final_tempo, final_len, *args, **kwargs
+    ):
+        return cand_song[..., :final_len]
+
+    @pytest.mark.dependency
+    def test_mixes_keep_the_channels_of_the_main_loop(self):
+        """Test stereo mixes of mono and stereo candidates"""
+        try:
+            from unittest.mock import MagicMock, patch
+
+            from auto_mashupper.utilities import peak, render_mixes
+
+            rng = np.random.default_rng(1)
+            main_song = rng.random((2, 44100), dtype=np.float32) - 0.5
+            mono = rng.random(44200, dtype=np.float32) - 0.5
+            stereo = rng.random((2, 44200), dtype=np.float32) - 0.5
+
+            tempo = MagicMock(return_value=(120, None))
+            with patch.multiple(
+                "auto_mashupper.utilities",
+                align_candidate=self._fake_align,
+                self_tempo_estimation=tempo,
+            ):
+                out = render_mixes(
+                    main_song, [(mono, 0, 0), (stereo, 0, 0)], tunning_main=440.0
+                )
+
+            assert out.shape == (2, 2, 44100)
+            # The analysis runs on the downmix
+            assert tempo.call_args.args[0].shape == (44100,)
+            main_part = 0.5 * main_song / peak(main_song)
+            np.testing.assert_allclose(
+                out[0][0] - out[0][1], main_part[0] - main_part[1], atol=1e-6
+            )
+            stereo = stereo[:, :44100]
+            np.testing.assert_allclose(
+                out[1], 0.5 * stereo / peak(stereo) + main_part, rtol=1e-5, atol=1e-6
+            )
+
+        except ImportError as e:
+            pytest.skip(f"render_mixes dependencies not available: {e}")
+
+    @pytest.mark.dependency
+    def test_channels_stretched_in_one_pass(self):
+        """Test that rubberband gets every channel in a single call"""
+        try:
+            from unittest.mock import MagicMock, patch
+
+            from auto_mashupper.utilities import align_candidate
+
+            rng = np.random.default_rng(2)
+            cand_song = rng.random((2, 3 * 44100), dtype=np.float32) - 0.5
+            stretch = MagicMock(side_effect=lambda y, sr, *args: y)
+            with patch.multiple(
+                "auto_mashupper.utilities",
+                stretch_and_shift=stretch,
+                self_tempo_estimation=MagicMock(
+                    return_value=(120, np.arange(0, 3, 0.5))
+                ),
+            ):
+                aligned = align_candidate(
+                    cand_song, 0, 2, 120, 44100, 440.0, 44100, 440.0
+                )
+
+            assert aligned.shape == (2, 44100)
+            assert stretch.call_count == 1
+            # Rubberband takes the channels last
+            assert stretch.call_args.args[0].shape == (44100, 2)
+
+        except ImportError as e:
+            pytest.skip(f"align_candidate dependencies not available: {e}")
+
+    def test_load_song_channels(self, tmp_path):
+        """Test loading a stereo file downmixed or with its channels"""
+        try:
+            import soundfile as sf
+
+            from auto_mashupper.utilities import load_song, match_channels
+
+            rng = np.random.default_rng(3)
+            path = str(tmp_path / "stereo.wav")
+            sf.write(path, rng.random((4410, 2)) - 0.5, 44100)
+
+            stereo = load_song(path, mono=False)
+            mono = load_song(path)
+
+            assert stereo.shape == (2, 4410)
+            assert mono.shape == (4410,)
+            np.testing.assert_allclose(mono, stereo.mean(axis=0), atol=1e-6)
+            assert match_channels(mono, stereo).shape == (2, 4410)
+            assert match_channels(stereo, mono).shape == (4410,)
+
+        except ImportError as e:
+            pytest.skip(f"load_song dependencies not available: {e}")
+
+
 class TestMatchTargetAmplitude:
     """Test match_target_amplitude function"""
 
@@ -292,6 +776,23 @@ class TestRotateAudio:
         except ImportError as e:
             pytest.skip(f"rotate_audio dependencies not available: {e}")
 
+    def test_rotation_by_beats(self):
+        """Test that a rotation of n beats rolls the audio by n beat periods"""
+        try:
+            from unittest.mock import MagicMock, patch
+
+            from auto_mashupper.utilities import rotate_audio
+
+            audio = np.arange(4 * 44100, dtype=np.float32)
+            tempo = MagicMock(return_value=(120, np.arange(0.1, 4, 0.5)))
+            with patch("auto_mashupper.utilities.self_tempo_estimation", tempo):
+                rotated = rotate_audio(audio, 44100, 3)
+
+            np.testing.assert_array_equal(rotated, np.roll(audio, 3 * 22050))
+
+        except ImportError as e:
+            pytest.skip(f"rotate_audio dependencies not available: {e}")
+
 
 @pytest.mark.dependency
 class TestUtilityErrorHandling:
@@ -341,6 +842,42 @@ class TestUtilityErrorHandling:
 class TestUtilityPerformance:
     """Test performance characteristics of utility functions"""
 
+    def test_single_pass_alignment_performance(self, sample_audio_long):
+        """Test that the alignment runs rubberband once, without a resample pass"""
+        try:
+            from unittest.mock import patch
+
+            from pyrubberband import pyrb
+
+            from auto_mashupper import utilities
+            from auto_mashupper.utilities import align_candidate
+
+            cand_song = np.tile(sample_audio_long, 10).astype(np.float32)
+            final_len = len(cand_song) - 4410
+
+            rubberband = getattr(pyrb, "__rubberband")
+            with patch.object(pyrb, "__rubberband", wraps=rubberband) as passes:
+                with patch.object(
+                    utilities.core, "resample", wraps=utilities.core.resample
+                ) as resample:
+                    aligned = align_candidate(
+                        cand_song, 0, 2, 126, final_len, 440.0, 44100, 440.0
+                    )
+
+            assert len(aligned) == final_len
+            # Tempo and pitch in the same rubberband call, the length is trimmed
+            assert passes.call_count == 1
+            assert {"--time", "--frequency"} <= set(passes.call_args.kwargs)
+            resample.assert_not_called()
+
+        except (ImportError, RuntimeError) as e:
+            if "rubberband" in str(e).lower():
+                pytest.skip(
+                    f"Alignment test skipped - rubberband-cli not available: {e}"
+                )
+            else:
+                pytest.skip(f"Alignment dependencies not available: {e}")
+
     def test_tempo_estimation_performance(self, sample_audio_long):
         """Test that tempo estimation completes in reasonable time"""
         import time